@@ -31,6 +31,19 @@ def create_app():
         result_backend=app.config.get("CELERY_RESULT_BACKEND", broker_url),
         broker_use_ssl=app.config.get("CELERY_BROKER_USE_SSL"),
         redis_backend_use_ssl=app.config.get("CELERY_REDIS_BACKEND_USE_SSL"),
+        # 解説タスクは app.tasks.dispatch_explanation がレーン別キューに投入する。
+        # priority: -Q に並べた順にキューを確認する (strict priority)
+        broker_transport_options={"queue_order_strategy": app.config.get("CELERY_QUEUE_ORDER_STRATEGY", "priority")},
+        # 長時間タスクを先読みして抱え込むと、後から来た優先度の高いタスクが待たされる
+        worker_prefetch_multiplier=1,
+        # celery beat: processing のまま止まった質問の回収 (app/reaper.py)
+        beat_schedule={
+            "reap-stuck-explanations": {
+                "task": "app.tasks.reap_stuck_task",
+                "schedule": app.config.get("REAPER_INTERVAL_SECONDS", 300),
+                "options": {"queue": "explain.backfill", "expires": app.config.get("REAPER_INTERVAL_SECONDS", 300)},
+            },
+        },
     )
     # Ensure transport is not overridden or cached
     if broker_url.startswith("redis"):
@@ -47,6 +60,14 @@ def create_app():
     login_manager.init_app(app)
     csrf.init_app(app)
 
+    # リクエストごとの SQL 文の数 (エンドポイント別の上限は @query_budget)
+    from . import querycount
+    querycount.init_app(app)
+
+    # 校舎一覧のプロセス内キャッシュ (テンプレートの school_name())
+    from . import school_directory
+    school_directory.init_app(app)
+
     login_manager.login_view = "auth.login"
 
     # セキュリティヘッダ（本番のみ HTTPS 強制）
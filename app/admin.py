@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
 from flask_login import login_required, current_user
-from .models import School, User, ROLE_HQ, db
+from .models import School, User, TaskRun, UsageRollup, ROLE_HQ, db
 from .audit import log_action
+from .querycount import query_budget
+from . import metrics, school_directory
+from .clients import get_redis
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -23,14 +26,16 @@ def manage_schools():
             s = School(name=name)
             db.session.add(s)
             db.session.commit()
+            # 各ワーカーの校舎一覧を読み直させる
+            school_directory.invalidate()
             log_action(current_user, "add_school", target_type="school", target_id=s.id)
             flash(f"学校「{name}」を追加しました", "success")
             return redirect(url_for("admin.manage_schools"))
 
-    schools = School.query.order_by(School.id).all()
-    return render_template("admin/schools.html", schools=schools)
+    return render_template("admin/schools.html", schools=school_directory.get_directory().by_id())
 
 @admin_bp.route("/users", methods=["GET", "POST"])
+@query_budget(4)
 def manage_users():
     if request.method == "POST":
         # DELETE action
@@ -60,5 +65,115 @@ def manage_users():
         return redirect(url_for("admin.manage_users"))
 
     # List users
+    # 所属校舎名はプロセス内の校舎一覧 (school_name()) から引くので JOIN しない
     users = User.query.order_by(User.id.desc()).limit(100).all() # とりあえず直近100件
     return render_template("admin/users.html", users=users)
+
+
+@admin_bp.route("/queues")
+def queue_metrics():
+    """解説タスクのレーン別キュー待ち時間と滞留数"""
+    from .tasks import LANES, LANE_QUEUES
+    try:
+        redis_client = get_redis()
+        depths = {lane: redis_client.llen(LANE_QUEUES[lane]) for lane in LANES}
+    except Exception:
+        depths = {lane: None for lane in LANES}
+
+    lanes = []
+    for lane in LANES:
+        row = {"name": lane, "queue": LANE_QUEUES[lane], "depth": depths[lane]}
+        for minutes in (15, 60):
+            hist = metrics.histogram(f"queue_wait:{lane}", minutes=minutes)
+            row[f"count_{minutes}"] = hist["count"]
+            row[f"p50_{minutes}"] = metrics.quantile(hist, 0.5)
+            row[f"p95_{minutes}"] = metrics.quantile(hist, 0.95)
+        lanes.append(row)
+    return render_template("admin/queues.html", lanes=lanes)
+
+
+@admin_bp.route("/pipeline")
+def pipeline_metrics():
+    """解説タスクのステージ別所要時間 (p50 / p95 / p99) と直近の遅いタスク"""
+    from datetime import datetime, timedelta
+    from .timing import STAGES, STAGE_BUCKETS
+    minutes = request.args.get("minutes", 60, type=int)
+    # 分ごとに HGETALL するので上限を付ける (HIST_TTL より前のバケットは既に消えている)
+    minutes = min(max(minutes, 1), metrics.HIST_TTL // 60)
+    stages = []
+    for name in STAGES + ("total",):
+        hist = metrics.histogram(f"stage:{name}", minutes=minutes, buckets=STAGE_BUCKETS)
+        stages.append({
+            "name": name,
+            "count": hist["count"],
+            "mean": hist["sum"] / hist["count"] if hist["count"] else None,
+            "p50": metrics.quantile(hist, 0.5),
+            "p95": metrics.quantile(hist, 0.95),
+            "p99": metrics.quantile(hist, 0.99),
+        })
+    slowest = (TaskRun.query
+               .filter(TaskRun.created_at >= datetime.utcnow() - timedelta(minutes=minutes))
+               .order_by(TaskRun.total_ms.desc())
+               .limit(20)
+               .all())
+    return render_template("admin/pipeline.html", stages=stages, slowest=slowest, minutes=minutes,
+                           max_bucket=STAGE_BUCKETS[-1])
+
+
+def _parse_budget(value):
+    value = (value or "").strip()
+    return float(value) if value else None
+
+
+@admin_bp.route("/usage", methods=["GET", "POST"])
+def usage_report():
+    """学校別の今月の利用額・トークン数と月間予算 (集計テーブルのみ参照)"""
+    from datetime import datetime, timedelta
+    from .usage import (month_start, month_spend_micros, budget_state, PERIOD_DAY, PERIOD_HOUR)
+    if request.method == "POST":
+        school = School.query.get_or_404(request.form.get("school_id", type=int))
+        try:
+            soft = _parse_budget(request.form.get("soft"))
+            hard = _parse_budget(request.form.get("hard"))
+        except ValueError:
+            flash("予算は数値 (USD) で入力してください", "warning")
+            return redirect(url_for("admin.usage_report"))
+        school.monthly_budget_soft_usd = soft
+        school.monthly_budget_hard_usd = hard
+        db.session.commit()
+        log_action(current_user, "update_school_budget", target_type="school", target_id=school.id)
+        flash(f"「{school.name}」の月間予算を更新しました", "success")
+        return redirect(url_for("admin.usage_report"))
+
+    totals = {}
+    rows = (db.session.query(UsageRollup.school_id,
+                             db.func.sum(UsageRollup.requests),
+                             db.func.sum(UsageRollup.input_tokens),
+                             db.func.sum(UsageRollup.cached_tokens),
+                             db.func.sum(UsageRollup.output_tokens))
+            .filter(UsageRollup.period == PERIOD_DAY, UsageRollup.bucket_start >= month_start())
+            .group_by(UsageRollup.school_id))
+    for school_id, requests, input_tokens, cached_tokens, output_tokens in rows:
+        totals[school_id] = {"requests": requests or 0, "input_tokens": input_tokens or 0,
+                             "cached_tokens": cached_tokens or 0, "output_tokens": output_tokens or 0}
+    spend = month_spend_micros()
+    schools = []
+    for school in School.query.order_by(School.id).all():
+        schools.append({
+            "school": school,
+            "usage": totals.get(school.id, {"requests": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}),
+            "spend_usd": spend.get(school.id, 0) / 1e6,
+            "state": budget_state(school.id, spend.get(school.id, 0)),
+        })
+
+    # 直近24時間 (全校舎合計、時間別)
+    since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=23)
+    hourly = (db.session.query(UsageRollup.bucket_start,
+                               db.func.sum(UsageRollup.requests),
+                               db.func.sum(UsageRollup.output_tokens),
+                               db.func.sum(UsageRollup.cost_micros))
+              .filter(UsageRollup.period == PERIOD_HOUR, UsageRollup.bucket_start >= since)
+              .group_by(UsageRollup.bucket_start)
+              .order_by(UsageRollup.bucket_start.desc())
+              .all())
+    return render_template("admin/usage.html", schools=schools, hourly=hourly, month=month_start())
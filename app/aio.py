@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+# asyncio によるタスク実行。
+# 解説生成はほぼ全時間をネットワーク待ち (S3 / OpenAI) に使うため、1プロセスに
+# イベントループを1つ持ち、複数のモデル呼び出しを同時に進める。
+# DB アクセスは同期の SQLAlchemy のまま、スレッド数を絞った executor で実行するので
+# 同時実行数を増やしても DB 接続数は DB_EXECUTOR_WORKERS を超えない。
+
+
+class AsyncExecutor:
+    def __init__(self, app, max_in_flight=16, db_workers=4):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.loop = None
+        self._semaphore = None
+        self._thread = None
+        self._db_executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="aio-db")
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            started.set()
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="aio-loop", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def submit(self, coro):
+        """コルーチンをイベントループに投入し concurrent.futures.Future を返す (任意のスレッドから呼べる)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def model_slot(self):
+        """同時に実行中のモデル呼び出し数を max_in_flight に制限する"""
+        return self._semaphore
+
+    async def run_db(self, fn, *args):
+        """DB を使う同期関数を DB 用スレッドで、専用のアプリコンテキスト内で実行する"""
+        def call():
+            with self.app.app_context():
+                return fn(*args)
+        return await self.loop.run_in_executor(self._db_executor, call)
+
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+        self._db_executor.shutdown(wait=False)
+        self._thread = None
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """プロセス共有の AsyncExecutor を返す (初回に起動)"""
+    global _executor
+    if _executor is None:
+        app = current_app._get_current_object()
+        with _lock:
+            if _executor is None:
+                _executor = AsyncExecutor(
+                    app,
+                    max_in_flight=app.config.get("ASYNC_MAX_IN_FLIGHT", 16),
+                    db_workers=app.config.get("DB_EXECUTOR_WORKERS", 4),
+                ).start()
+    return _executor
+
+
+def reset_executor():
+    """fork 後の子プロセスでは親のループ・スレッドは使えないので作り直す"""
+    global _executor
+    with _lock:
+        _executor = None
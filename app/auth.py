@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-from .models import User, School
+from .models import User
 from . import db
 from .audit import log_action
 
@@ -44,8 +44,8 @@ def register():
             flash("登録が完了しました", "success")
             return redirect(url_for("main.list_questions"))
 
-    schools = School.query.order_by(School.name).all()
-    return render_template("auth/register.html", schools=schools)
+    from .school_directory import get_directory
+    return render_template("auth/register.html", schools=get_directory().schools)
 
 @auth_bp.route("/login", methods=["GET", "POST"])
 def login():
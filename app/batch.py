@@ -0,0 +1,108 @@
+import io
+import json
+from datetime import datetime, timedelta
+from . import db, metrics
+from .models import Question
+from .clients import get_openai_client
+from .pipeline import build_prompt, build_request, finalize_explanation, is_stale, record_failure
+from .storage import image_url_for_model
+from .streaming import PartialTextWriter
+from .usage import record_usage, KIND_BATCH
+
+# プロバイダの Batch API による一括再処理。
+# 結果は24時間以内に非同期で返るが料金が安く、通常タスクのレート枠とも競合しない。
+# custom_id に質問 ID と世代番号 (claim) を入れ、取り込み時に claim が最新か確認する。
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# 画像 URL はバッチ完了まで有効である必要がある (SigV4 の上限は7日)
+IMAGE_URL_EXPIRES = 2 * 24 * 3600
+# この状態になったバッチは結果 (一部の場合もある) を取り込める
+FINISHED_STATUSES = ("completed", "expired", "cancelled")
+# バッチに入れた質問の updated_at をこの分だけ先に進める (完了期限 + 取り込みの猶予)
+BATCH_LEASE = timedelta(hours=26)
+
+
+def custom_id(question_id, generation):
+    return f"question-{question_id}-{generation}"
+
+
+def parse_custom_id(value):
+    _, question_id, generation = value.split("-")
+    return int(question_id), int(generation)
+
+
+def build_batch_line(question, generation):
+    """Batch API の入力 (JSONL の1行) を組み立てる"""
+    image_url = image_url_for_model(question.image_path, IMAGE_URL_EXPIRES)
+    body = build_request(build_prompt(question.grade), image_url)
+    # バッチはストリーミング非対応
+    body.pop("stream", None)
+    body.pop("stream_options", None)
+    return {"custom_id": custom_id(question.id, generation), "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+
+def submit_batch(claims):
+    """claim 済みの [(question_id, generation)] をバッチとして投入し、batch オブジェクトを返す"""
+    lines = []
+    for question_id, generation in claims:
+        question = db.session.get(Question, question_id)
+        lines.append(json.dumps(build_batch_line(question, generation), ensure_ascii=False))
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+
+    client = get_openai_client()
+    upload = client.files.create(file=("reprocess.jsonl", io.BytesIO(data)), purpose="batch")
+    batch = client.batches.create(input_file_id=upload.id, endpoint=BATCH_ENDPOINT,
+                                  completion_window=COMPLETION_WINDOW, metadata={"source": "reprocess"})
+    # 結果の取り込みまで processing のままなので、その間は reaper の対象にしない
+    (Question.query.filter(Question.id.in_([question_id for question_id, _ in claims]))
+     .update({Question.updated_at: datetime.utcnow() + BATCH_LEASE}, synchronize_session=False))
+    db.session.commit()
+    metrics.incr("batch:submitted", len(lines))
+    print(f"DEBUG: Submitted batch {batch.id} ({len(lines)} requests)")
+    return batch
+
+
+def collect_batch(batch_id):
+    """バッチの結果を取り込む。
+
+    (batch, summary) を返す。まだ終わっていなければ summary は None。
+    """
+    client = get_openai_client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status not in FINISHED_STATUSES:
+        return batch, None
+
+    summary = {"completed": 0, "failed": 0, "skipped": 0}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if line.strip():
+                outcome = apply_result(json.loads(line))
+                summary[outcome] += 1
+    metrics.incr("batch:collected", summary["completed"])
+    return batch, summary
+
+
+def apply_result(record):
+    """出力ファイルの1行を質問に反映し、completed / failed / skipped を返す"""
+    question_id, generation = parse_custom_id(record["custom_id"])
+    question = db.session.get(Question, question_id)
+    if question is None or is_stale(question, generation):
+        db.session.rollback()
+        return "skipped"
+
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        error = record.get("error") or response.get("body", {}).get("error") or {}
+        record_failure(question_id, Exception(error.get("message", "batch request failed")), generation)
+        return "failed"
+
+    record_usage(KIND_BATCH, response["body"].get("usage"), question_id=question_id, user_id=question.user_id,
+                 school_id=question.school_id, model=response["body"].get("model"))
+    choice = response["body"]["choices"][0]
+    writer = PartialTextWriter(f"question:{question_id}")
+    writer.append(choice["message"].get("content") or "")
+    result = finalize_explanation(question_id, writer, choice.get("finish_reason"), generation)
+    return "completed" if result["status"] == "completed" else "failed"
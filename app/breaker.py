@@ -0,0 +1,223 @@
+import random
+import time
+from contextlib import contextmanager
+import openai
+from flask import current_app
+from . import metrics
+from .clients import get_redis
+from .ratelimit import RateLimitTimeout
+
+# 外部サービス (OpenAI / S3) 呼び出しのサーキットブレーカーとエラー分類。
+# 状態は Redis に置き、全ワーカー・Web で共有する。
+#   closed    : 通常。障害とみなすエラーが窓内で閾値に達したら open へ
+#   open      : 呼び出さずに CircuitOpenError。タスクはリトライを消費せずに後回しにする
+#   half-open : open 期間が過ぎたら1件だけ試行 (probe) し、成功で closed、失敗で再び open
+
+OPENAI = "openai"
+S3 = "s3"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+RETRYABLE = "retryable"
+PERMANENT = "permanent"
+
+
+class CircuitOpenError(Exception):
+    """サーキットが open のため呼び出さなかった"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"circuit {name} is open (retry after {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        if isinstance(response, dict):
+            status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return status
+
+
+def _is_transient_s3(exc):
+    try:
+        from botocore.exceptions import BotoCoreError, ClientError
+    except ImportError:
+        return None
+    if isinstance(exc, ClientError):
+        code = exc.response.get("Error", {}).get("Code")
+        status = _status_code(exc) or 0
+        return status >= 500 or code in ("SlowDown", "Throttling", "ThrottlingException", "RequestTimeout")
+    if isinstance(exc, BotoCoreError):
+        # 接続断・タイムアウト (EndpointConnectionError, ReadTimeoutError など)
+        return True
+    return None
+
+
+def classify(exc):
+    """例外を RETRYABLE (時間をおけば成功しうる) か PERMANENT (何度やっても同じ) に分ける"""
+    if isinstance(exc, (CircuitOpenError, RateLimitTimeout)):
+        return RETRYABLE
+    if isinstance(exc, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        # APITimeoutError は APIConnectionError のサブクラス
+        return RETRYABLE
+    if isinstance(exc, openai.APIStatusError):
+        # 400 (読めない画像・コンテンツポリシー)、401/403、404、422 など
+        return RETRYABLE if _status_code(exc) in (408, 409) or (_status_code(exc) or 0) >= 500 else PERMANENT
+    transient = _is_transient_s3(exc)
+    if transient is not None:
+        return RETRYABLE if transient else PERMANENT
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return RETRYABLE
+    # 分類できないものは従来どおりリトライする
+    return RETRYABLE
+
+
+def is_outage(exc):
+    """サーキットの失敗として数えるエラー (相手側の障害)。
+
+    429 はレートリミット (app/ratelimit.py) が扱うので数えない。
+    """
+    if isinstance(exc, (openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return (_status_code(exc) or 0) >= 500
+    if _is_transient_s3(exc):
+        return True
+    return isinstance(exc, (TimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    """Redis 上のサーキットブレーカー。Redis 障害時は呼び出しを止めない"""
+
+    def __init__(self, name, redis_client, failure_threshold=5, window=60, open_seconds=30, probe_timeout=120):
+        self.name = name
+        self.redis = redis_client
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.failures_key = f"breaker:{name}:failures"
+        self.open_until_key = f"breaker:{name}:open_until"
+        self.probe_key = f"breaker:{name}:probe"
+
+    def _open_until(self):
+        value = self.redis.get(self.open_until_key)
+        return float(value) if value is not None else None
+
+    def state(self):
+        """(状態, open が終わるまでの秒数)"""
+        try:
+            open_until = self._open_until()
+        except Exception as e:
+            current_app.logger.warning(f"circuit breaker {self.name} unavailable: {e}")
+            return CLOSED, 0.0
+        if open_until is None:
+            return CLOSED, 0.0
+        remaining = open_until - time.time()
+        if remaining > 0:
+            return OPEN, remaining
+        return HALF_OPEN, 0.0
+
+    def before_call(self):
+        """呼び出せなければ CircuitOpenError。half-open の試行 (probe) なら True を返す"""
+        state, remaining = self.state()
+        if state == CLOSED:
+            return False
+        if state == OPEN:
+            metrics.incr(f"breaker:{self.name}:rejected")
+            raise CircuitOpenError(self.name, remaining)
+        # half-open: 最初の1件だけ試す
+        try:
+            probe = self.redis.set(self.probe_key, "1", nx=True, ex=self.probe_timeout)
+        except Exception:
+            probe = True
+        if not probe:
+            metrics.incr(f"breaker:{self.name}:rejected")
+            raise CircuitOpenError(self.name, self.open_seconds)
+        return True
+
+    def record_success(self, probe=False):
+        if not probe:
+            return
+        try:
+            self.redis.delete(self.open_until_key, self.failures_key, self.probe_key)
+        except Exception as e:
+            current_app.logger.warning(f"circuit breaker {self.name} update failed: {e}")
+            return
+        print(f"DEBUG: Circuit {self.name} closed")
+
+    def record_failure(self, probe=False):
+        try:
+            if probe:
+                self._trip()
+                self.redis.delete(self.probe_key)
+                return
+            pipe = self.redis.pipeline()
+            pipe.incr(self.failures_key)
+            pipe.expire(self.failures_key, self.window)
+            failures = pipe.execute()[0]
+            if failures >= self.failure_threshold and self._open_until() is None:
+                self._trip()
+        except Exception as e:
+            current_app.logger.warning(f"circuit breaker {self.name} update failed: {e}")
+
+    def _release_probe(self):
+        try:
+            self.redis.delete(self.probe_key)
+        except Exception:
+            pass
+
+    def _trip(self):
+        # open_until は half-open の判定にも使うので probe が成功するまで残す (期限は保険)
+        self.redis.set(self.open_until_key, time.time() + self.open_seconds, ex=24 * 3600)
+        self.redis.delete(self.failures_key)
+        metrics.incr(f"breaker:{self.name}:opened")
+        print(f"WARNING: Circuit {self.name} opened for {self.open_seconds}s")
+
+    @contextmanager
+    def guard(self):
+        """呼び出しを囲む (async 関数の中でも with で使える)"""
+        probe = self.before_call()
+        try:
+            yield
+        except Exception as e:
+            if is_outage(e):
+                self.record_failure(probe)
+            elif probe and _status_code(e) is not None:
+                # 障害以外のエラー応答なら相手は復旧しているので閉じる
+                self.record_success(probe)
+            elif probe:
+                # 呼び出す前に止まった (レートリミット待ちの打ち切りなど)。次の1件に試行を譲る
+                self._release_probe()
+            raise
+        self.record_success(probe)
+
+
+def get_breaker(name):
+    config = current_app.config
+    return CircuitBreaker(
+        name,
+        get_redis(),
+        failure_threshold=config.get("CIRCUIT_FAILURE_THRESHOLD", 5),
+        window=config.get("CIRCUIT_WINDOW_SECONDS", 60),
+        open_seconds=config.get("CIRCUIT_OPEN_SECONDS", 30),
+    )
+
+
+def retry_countdown(exc, retries):
+    """リトライまでの秒数 (指数バックオフ + ジッター)。429 はプロバイダの指示より早くしない"""
+    base = current_app.config.get("RETRY_BASE_SECONDS", 15)
+    cap = current_app.config.get("RETRY_MAX_SECONDS", 600)
+    countdown = random.uniform(base / 2, min(cap, base * (2 ** retries)))
+    if isinstance(exc, openai.RateLimitError):
+        try:
+            countdown = max(countdown, float(exc.response.headers.get("retry-after", 5)))
+        except (TypeError, ValueError, AttributeError):
+            pass
+    if isinstance(exc, CircuitOpenError):
+        countdown = max(countdown, exc.retry_after)
+    return max(1, int(countdown))
@@ -0,0 +1,87 @@
+import os
+import threading
+import boto3
+from botocore.config import Config as BotoConfig
+import redis
+from flask import current_app
+from openai import AsyncOpenAI, OpenAI
+
+# 外部APIクライアントはプロセス内で共有する。
+# 生成のたびに認証情報の解決やコネクションプールの構築が走るため、
+# タスクやリクエストごとに作り直さない。
+
+_lock = threading.Lock()
+_openai_client = None
+_async_openai_client = None
+_s3_client = None
+_redis_client = None
+
+
+def get_openai_client():
+    """プロセス共有の OpenAI クライアントを返す"""
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+
+def get_async_openai_client():
+    """プロセス共有の AsyncOpenAI クライアントを返す (app/aio.py のイベントループ専用)"""
+    global _async_openai_client
+    if _async_openai_client is None:
+        with _lock:
+            if _async_openai_client is None:
+                _async_openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _async_openai_client
+
+
+def get_s3_client():
+    """プロセス共有の S3 クライアントを返す (current_app の設定を使用。boto3 のクライアントはスレッドセーフ)"""
+    global _s3_client
+    if _s3_client is None:
+        config = current_app.config
+        with _lock:
+            if _s3_client is None:
+                _s3_client = boto3.client(
+                    "s3",
+                    aws_access_key_id=config.get("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=config.get("AWS_SECRET_ACCESS_KEY"),
+                    region_name=config.get("AWS_REGION"),
+                    endpoint_url=config.get("S3_ENDPOINT_URL"),
+                    # 既定のプール (10接続) ではスレッドプールのワーカーが接続待ちになる
+                    config=BotoConfig(
+                        max_pool_connections=config.get("S3_MAX_POOL_CONNECTIONS", 50),
+                        connect_timeout=config.get("S3_CONNECT_TIMEOUT", 3),
+                        read_timeout=config.get("S3_READ_TIMEOUT", 10),
+                        retries={"max_attempts": 3, "mode": "standard"},
+                        tcp_keepalive=True,
+                    ),
+                )
+    return _s3_client
+
+
+def get_redis():
+    """プロセス共有の Redis クライアントを返す (ブローカーと同じ REDIS_URL)"""
+    global _redis_client
+    if _redis_client is None:
+        url = current_app.config.get("REDIS_URL", "redis://localhost:6379/0")
+        options = {"socket_connect_timeout": 1, "socket_timeout": 2, "health_check_interval": 30}
+        if url.startswith("rediss://"):
+            # Render 内部 Redis は自己署名証明書
+            options["ssl_cert_reqs"] = None
+        with _lock:
+            if _redis_client is None:
+                _redis_client = redis.Redis.from_url(url, **options)
+    return _redis_client
+
+
+def reset_clients():
+    """共有クライアントを破棄する (fork 後の子プロセスで親のソケットを使わないため)"""
+    global _openai_client, _async_openai_client, _s3_client, _redis_client
+    with _lock:
+        _openai_client = None
+        _async_openai_client = None
+        _s3_client = None
+        _redis_client = None
@@ -63,14 +63,94 @@ class Config:
             "MAIL_FROM": os.getenv("MAIL_FROM", "no-reply@example.com"),
             # ページング
             "PAGE_SIZE": int(os.getenv("PAGE_SIZE", "20")),
+            # @query_budget の上限を超えたリクエストをエラーにする (テスト用。本番は警告のみ)
+            "QUERY_BUDGET_STRICT": os.getenv("QUERY_BUDGET_STRICT", "false").lower() == "true",
+            # SQL 文の数と時間を Server-Timing ヘッダで返す (debug / テストでは常に返す。本番は Redis のヒストグラムのみ)
+            "QUERY_SERVER_TIMING": os.getenv("QUERY_SERVER_TIMING", "false").lower() == "true",
+            # 一覧のモーダルで読み込む解説本文のブラウザキャッシュ秒数 (以降は ETag で再検証)
+            "EXPLANATION_FRAGMENT_MAX_AGE": int(os.getenv("EXPLANATION_FRAGMENT_MAX_AGE", "60")),
+            # 校舎一覧のプロセス内キャッシュが Redis のバージョン番号を確認する間隔 (秒)
+            "SCHOOL_DIRECTORY_CHECK_SECONDS": float(os.getenv("SCHOOL_DIRECTORY_CHECK_SECONDS", "5")),
+            # 一覧に出す件数のキャッシュ秒数 (0 で件数を出さない)
+            "QUESTION_COUNT_TTL": int(os.getenv("QUESTION_COUNT_TTL", "60")),
             # Celery / Redis
+            "REDIS_URL": redis_url,
             "CELERY_BROKER_URL": redis_url,
             "CELERY_RESULT_BACKEND": redis_url,
             "CELERY_REDIS_BACKEND_USE_SSL": ssl_conf,
             "CELERY_BROKER_USE_SSL": ssl_conf,
+            # priority (レーンの strict priority) / round_robin
+            "CELERY_QUEUE_ORDER_STRATEGY": os.getenv("CELERY_QUEUE_ORDER_STRATEGY", "priority"),
             # AWS S3
             "AWS_ACCESS_KEY_ID": os.getenv("AWS_ACCESS_KEY_ID"),
             "AWS_SECRET_ACCESS_KEY": os.getenv("AWS_SECRET_ACCESS_KEY"),
             "AWS_S3_BUCKET_NAME": os.getenv("AWS_S3_BUCKET_NAME"),
             "AWS_REGION": os.getenv("AWS_REGION", "ap-northeast-1"),
+            # 画像の保存先: s3 / local (内容アドレスのローカルディスク。単一ノード・負荷試験用)
+            "STORAGE_BACKEND": os.getenv("STORAGE_BACKEND", "s3"),
+            "LOCAL_STORAGE_ROOT": os.getenv("LOCAL_STORAGE_ROOT") or None,
+            # X-Sendfile ヘッダでファイル送信を前段のサーバーに任せる (ローカル保存の /media)
+            "USE_X_SENDFILE": os.getenv("USE_X_SENDFILE", "false").lower() == "true",
+            # S3 互換ストレージ (MinIO など) を使う場合のエンドポイント
+            "S3_ENDPOINT_URL": os.getenv("S3_ENDPOINT_URL") or None,
+            "S3_MAX_POOL_CONNECTIONS": int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50")),
+            "S3_CONNECT_TIMEOUT": int(os.getenv("S3_CONNECT_TIMEOUT", "3")),
+            "S3_READ_TIMEOUT": int(os.getenv("S3_READ_TIMEOUT", "10")),
+            # presigned GET URL のプロセス内キャッシュの件数上限
+            "PRESIGN_CACHE_SIZE": int(os.getenv("PRESIGN_CACHE_SIZE", "1024")),
+            # 同一画像の解説キャッシュ (content hash + grade)
+            "EXPLANATION_CACHE_ENABLED": os.getenv("EXPLANATION_CACHE_ENABLED", "true").lower() == "true",
+            # asyncio 実行 (1プロセスで複数のモデル呼び出しを同時に進める)
+            "ASYNC_EXECUTION": os.getenv("ASYNC_EXECUTION", "false").lower() == "true",
+            "ASYNC_MAX_IN_FLIGHT": int(os.getenv("ASYNC_MAX_IN_FLIGHT", "16")),
+            "DB_EXECUTOR_WORKERS": int(os.getenv("DB_EXECUTOR_WORKERS", "4")),
+            # OpenAI レート制御 (全プロセス共有のトークンバケット + AIMD 同時実行数)
+            "RATE_LIMIT_ENABLED": os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true",
+            "OPENAI_RPM_LIMIT": int(os.getenv("OPENAI_RPM_LIMIT", "500")),
+            "OPENAI_TPM_LIMIT": int(os.getenv("OPENAI_TPM_LIMIT", "200000")),
+            "OPENAI_MAX_CONCURRENCY": int(os.getenv("OPENAI_MAX_CONCURRENCY", "32")),
+            # 料金 (USD / 100万トークン)。利用額の集計と学校ごとの月間予算の判定に使う
+            "OPENAI_PRICE_INPUT_PER_MTOK": float(os.getenv("OPENAI_PRICE_INPUT_PER_MTOK", "1.75")),
+            "OPENAI_PRICE_CACHED_INPUT_PER_MTOK": float(os.getenv("OPENAI_PRICE_CACHED_INPUT_PER_MTOK", "0.175")),
+            "OPENAI_PRICE_OUTPUT_PER_MTOK": float(os.getenv("OPENAI_PRICE_OUTPUT_PER_MTOK", "14.0")),
+            "OPENAI_BATCH_DISCOUNT": float(os.getenv("OPENAI_BATCH_DISCOUNT", "0.5")),
+            # OpenAI / S3 のサーキットブレーカー (窓内の障害エラー数で open、open_seconds 後に1件だけ試行)
+            "CIRCUIT_FAILURE_THRESHOLD": int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+            "CIRCUIT_WINDOW_SECONDS": int(os.getenv("CIRCUIT_WINDOW_SECONDS", "60")),
+            "CIRCUIT_OPEN_SECONDS": int(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
+            # 解説タスクのリトライ間隔 (指数バックオフ + ジッター)
+            "RETRY_BASE_SECONDS": int(os.getenv("RETRY_BASE_SECONDS", "15")),
+            "RETRY_MAX_SECONDS": int(os.getenv("RETRY_MAX_SECONDS", "600")),
+            # processing のまま更新が止まった質問の回収 (Celery beat または manage.py reap-stuck)
+            "REAPER_LEASE_SECONDS": int(os.getenv("REAPER_LEASE_SECONDS", "1800")),
+            "REAPER_INTERVAL_SECONDS": int(os.getenv("REAPER_INTERVAL_SECONDS", "300")),
+            "REAPER_MAX_REQUEUES": int(os.getenv("REAPER_MAX_REQUEUES", "2")),
+            # 生成途中テキストの SSE 配信 (1接続あたりの最大秒数)。
+            # 接続中は gunicorn のスレッドを1つ占有するので短くし、ブラウザは timeout を受けて再接続する
+            "SSE_MAX_SECONDS": int(os.getenv("SSE_MAX_SECONDS", "5")),
+            # 再質問ジョブ (Redis) の保持秒数
+            "REQUESTION_JOB_TTL": int(os.getenv("REQUESTION_JOB_TTL", "3600")),
+            # 再質問スレッド: そのまま送る直近のやりとり数と、それより古いやりとりの要約の上限文字数
+            "FOLLOWUP_VERBATIM_TURNS": int(os.getenv("FOLLOWUP_VERBATIM_TURNS", "1")),
+            "FOLLOWUP_SUMMARY_MAX_CHARS": int(os.getenv("FOLLOWUP_SUMMARY_MAX_CHARS", "2000")),
+            # 近似重複画像 (知覚ハッシュ) の解説再利用
+            "PHASH_ENABLED": os.getenv("PHASH_ENABLED", "true").lower() == "true",
+            "PHASH_MAX_DISTANCE": int(os.getenv("PHASH_MAX_DISTANCE", "4")),
+            "PHASH_REFRESH_SECONDS": int(os.getenv("PHASH_REFRESH_SECONDS", "60")),
+            # ブラウザから S3 への直接アップロード (presigned POST)。バケットの CORS 設定が必要
+            "UPLOAD_DIRECT_ENABLED": os.getenv("UPLOAD_DIRECT_ENABLED", "true").lower() == "true",
+            "UPLOAD_MAX_BYTES": int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024))),
+            "UPLOAD_POLICY_EXPIRES": int(os.getenv("UPLOAD_POLICY_EXPIRES", "600")),
+            # 質問一覧のサムネイル (WebP)。URL の期限は S3 の presigned URL の上限 (7日) まで
+            "THUMBNAIL_ENABLED": os.getenv("THUMBNAIL_ENABLED", "true").lower() == "true",
+            "THUMBNAIL_MAX_EDGE": int(os.getenv("THUMBNAIL_MAX_EDGE", "320")),
+            "THUMBNAIL_QUALITY": int(os.getenv("THUMBNAIL_QUALITY", "70")),
+            "THUMBNAIL_URL_EXPIRES": int(os.getenv("THUMBNAIL_URL_EXPIRES", str(7 * 24 * 3600))),
+            # 一覧のモーダルで開く原寸画像の presigned URL の期限
+            "IMAGE_URL_EXPIRES": int(os.getenv("IMAGE_URL_EXPIRES", "300")),
+            # アップロード画像の正規化 (向き補正・縮小・再エンコード) と、モデルへの base64 直接送信
+            "IMAGE_NORMALIZE_ENABLED": os.getenv("IMAGE_NORMALIZE_ENABLED", "true").lower() == "true",
+            "IMAGE_MAX_EDGE": int(os.getenv("IMAGE_MAX_EDGE", "2048")),
+            "IMAGE_JPEG_QUALITY": int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+            "IMAGE_INLINE_ENABLED": os.getenv("IMAGE_INLINE_ENABLED", "false").lower() == "true",
         }
@@ -0,0 +1,94 @@
+import base64
+import io
+from PIL import Image, ImageOps
+
+# アップロード画像の正規化。
+# スマホの写真 (4〜12MB) をそのまま保存・送信せず、EXIF の向きを反映してから
+# 長辺を IMAGE_MAX_EDGE までに縮小し、JPEG で再エンコードする (メタデータは持ち越さない)。
+
+try:
+    # HEIC (iPhone) は pillow-heif がある場合のみ対応
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+OUTPUT_CONTENT_TYPE = "image/jpeg"
+OUTPUT_EXTENSION = ".jpg"
+
+
+class NormalizedImage:
+    def __init__(self, data, content_type, extension, size, original_bytes):
+        self.data = data
+        self.content_type = content_type
+        self.extension = extension
+        self.size = size
+        self.original_bytes = original_bytes
+
+
+def normalize_image(data: bytes, max_edge=2048, quality=85) -> NormalizedImage:
+    """向き補正・縮小・再エンコードした画像を返す。
+
+    Pillow で開けない形式は ValueError (呼び出し側で元のバイト列を使う)。
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        # JPEG はデコード時点で 1/2, 1/4 ... に縮小できる (縮小後のサイズを下回らない範囲で)
+        ratio = max_edge / max(img.size)
+        if ratio < 1:
+            img.draft("RGB", (int(img.width * ratio), int(img.height * ratio)))
+        img = ImageOps.exif_transpose(img)
+    except Exception as e:
+        raise ValueError(f"unsupported image: {e}") from e
+
+    if img.mode in ("RGBA", "LA", "P"):
+        # 透過部分は白で塗る (問題の画像は白背景が前提)
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    out = io.BytesIO()
+    # exif / icc_profile を渡さないのでメタデータ (位置情報等) は残らない
+    img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return NormalizedImage(out.getvalue(), OUTPUT_CONTENT_TYPE, OUTPUT_EXTENSION, img.size, len(data))
+
+
+def make_thumbnail(data: bytes, max_edge=320, quality=70) -> bytes:
+    """一覧表示用の小さな WebP を返す (開けない形式は ValueError)"""
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+    except Exception as e:
+        raise ValueError(f"unsupported image: {e}") from e
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or img.mode == "P" else "RGB")
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+def sniff_content_type(data: bytes, default="image/jpeg"):
+    """先頭バイトから画像の MIME タイプを推定する"""
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return default
+
+
+def to_data_url(data: bytes, content_type=None):
+    """モデルに直接渡す base64 の data URL"""
+    content_type = content_type or sniff_content_type(data)
+    return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
@@ -0,0 +1,94 @@
+import time
+from flask import current_app
+from .clients import get_redis
+
+# Redis ベースの軽量メトリクス。
+# gunicorn / Celery の全プロセスで共有するため Redis に集計する。
+# 計測の失敗でリクエストやタスクを落とさないよう、例外はすべて握りつぶす。
+
+KEY_PREFIX = "metrics:"
+
+# ヒストグラムのバケット上限 (秒)。分単位のキーに集計し、HIST_TTL で自然に消える
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+HIST_TTL = 3 * 3600
+
+
+def incr(name, amount=1):
+    """カウンタを加算する"""
+    try:
+        get_redis().incrby(KEY_PREFIX + name, amount)
+    except Exception as e:
+        current_app.logger.warning(f"metrics.incr failed for {name}: {e}")
+
+
+def get_counters(*names):
+    """カウンタの現在値を {name: int} で返す"""
+    try:
+        values = get_redis().mget([KEY_PREFIX + n for n in names])
+    except Exception as e:
+        current_app.logger.warning(f"metrics.get_counters failed: {e}")
+        values = [None] * len(names)
+    return {n: int(v or 0) for n, v in zip(names, values)}
+
+
+def _hist_key(name, minute):
+    return f"{KEY_PREFIX}hist:{name}:{minute}"
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    """値をヒストグラムに記録する (現在の分のバケット)"""
+    bound = next((str(b) for b in buckets if value <= b), "inf")
+    key = _hist_key(name, int(time.time() // 60))
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hincrby(key, bound, 1)
+        pipe.hincrby(key, "count", 1)
+        pipe.hincrbyfloat(key, "sum", value)
+        pipe.expire(key, HIST_TTL)
+        pipe.execute()
+    except Exception as e:
+        current_app.logger.warning(f"metrics.observe failed for {name}: {e}")
+
+
+def histogram(name, minutes=60, buckets=LATENCY_BUCKETS):
+    """直近 minutes 分のヒストグラムを合算して返す"""
+    now = int(time.time() // 60)
+    counts = {str(b): 0 for b in buckets}
+    counts["inf"] = 0
+    total = 0
+    value_sum = 0.0
+    try:
+        pipe = get_redis().pipeline()
+        for minute in range(now - minutes + 1, now + 1):
+            pipe.hgetall(_hist_key(name, minute))
+        rows = pipe.execute()
+    except Exception as e:
+        current_app.logger.warning(f"metrics.histogram failed for {name}: {e}")
+        rows = []
+    for row in rows:
+        for field, value in row.items():
+            field = field.decode()
+            if field == "count":
+                total += int(value)
+            elif field == "sum":
+                value_sum += float(value)
+            else:
+                counts[field] = counts.get(field, 0) + int(value)
+    return {
+        "buckets": [(bound, counts[bound]) for bound in [str(b) for b in buckets] + ["inf"]],
+        "count": total,
+        "sum": value_sum,
+    }
+
+
+def quantile(hist, q):
+    """ヒストグラムから分位点を求める (該当バケットの上限値。データなしは None)"""
+    if not hist["count"]:
+        return None
+    target = q * hist["count"]
+    seen = 0
+    for bound, count in hist["buckets"]:
+        seen += count
+        if seen >= target:
+            return float(bound)
+    return float("inf")
@@ -13,6 +13,9 @@ class School(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 月間の OpenAI 利用額の上限 (USD)。ソフト上限超過で低優先レーンへ、ハード上限超過で受付停止
+    monthly_budget_soft_usd = db.Column(db.Float, nullable=True)
+    monthly_budget_hard_usd = db.Column(db.Float, nullable=True)
 
 class User(UserMixin, db.Model):
     __tablename__ = "users"
@@ -58,9 +61,146 @@ class Question(db.Model):
 
     # AI解説用フィールド
     image_path = db.Column(db.String(255), nullable=True)
+    thumbnail_path = db.Column(db.String(255), nullable=True)  # 一覧用の WebP サムネイル (保存先のキー)
+    # 直接アップロードのキー (取り込み後に image_path が変わっても、完了通知の再送で同じ質問を返すため)
+    upload_key = db.Column(db.String(255), nullable=True)
     grade = db.Column(db.String(20), nullable=True)  # middle / high
     explanation = db.Column(db.Text, nullable=True)
     explanation_status = db.Column(db.String(20), default="pending") # pending, processing, completed, failed
+    content_hash = db.Column(db.String(64), nullable=True)  # 画像バイト列の SHA-256
+    image_phash = db.Column(db.String(16), nullable=True)  # 知覚ハッシュ (dHash, 16進)
+    # 解説生成の世代番号。processing への遷移 (claim) ごとに +1 し、古い世代のタスクは何もせず終わる
+    explanation_generation = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # 最終更新時刻。processing の間はタスクの生存確認 (heartbeat) を兼ね、古いものは reaper が回収する
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # 一括再処理 (manage.py reprocess) の status 絞り込み + id 順走査用
+        db.Index("ix_questions_status_id", "explanation_status", "id"),
+        # 止まったタスクの回収 (manage.py reap-stuck) 用。processing の行だけの部分インデックス
+        db.Index("ix_questions_processing_updated", "updated_at",
+                 postgresql_where=db.text("explanation_status = 'processing'"),
+                 sqlite_where=db.text("explanation_status = 'processing'")),
+        # 一覧のキーセットページング (本部の全校舎 / 校舎別 / 生徒本人)
+        db.Index("ix_questions_created_id", "created_at", "id"),
+        db.Index("ix_questions_school_created_id", "school_id", "created_at", "id"),
+        db.Index("ix_questions_user_created_id", "user_id", "created_at", "id"),
+        # /media の閲覧権限の確認・LocalStorage.delete の参照確認・サムネイルの流用 (保存先のキーで引く)
+        db.Index("ix_questions_image_path", "image_path"),
+        db.Index("ix_questions_thumbnail_path", "thumbnail_path"),
+        db.Index("ix_questions_upload_key", "upload_key", unique=True),
+    )
+
+class ExplanationCache(db.Model):
+    """同一画像 (content hash + grade) の解説キャッシュ"""
+    __tablename__ = "explanation_cache"
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    grade = db.Column(db.String(20), nullable=False, default="")
+    explanation = db.Column(db.Text, nullable=False)
+    image_path = db.Column(db.String(255), nullable=True)
+    source_question_id = db.Column(db.Integer, db.ForeignKey("questions.id"), nullable=True)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_hit_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint("content_hash", "grade", name="uq_explanation_cache_hash_grade"),
+    )
+
+class FollowUpThread(db.Model):
+    """質問ごとの再質問スレッド。古いやりとりは summary に畳み込む"""
+    __tablename__ = "follow_up_threads"
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey("questions.id"), nullable=False, unique=True)
+    summary = db.Column(db.Text, nullable=False, default="")
+    summary_position = db.Column(db.Integer, nullable=False, default=0)  # summary に含めた最後の position
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    question = db.relationship("Question", backref=db.backref("follow_up_thread", uselist=False))
+
+class FollowUp(db.Model):
+    """再質問1回分 (追加質問と回答)"""
+    __tablename__ = "follow_ups"
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.Integer, db.ForeignKey("follow_up_threads.id"), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    question_text = db.Column(db.Text, nullable=False)
+    text_hash = db.Column(db.String(64), nullable=False)  # 正規化した質問文の SHA-256
+    answer = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="processing")  # processing, completed, failed
+    job_id = db.Column(db.String(32), nullable=True)  # 再質問ジョブ (app/requestion.py)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    answered_at = db.Column(db.DateTime, nullable=True)
+
+    thread = db.relationship("FollowUpThread", backref=db.backref("follow_ups", order_by="FollowUp.position"))
+
+    __table_args__ = (
+        db.UniqueConstraint("thread_id", "position", name="uq_follow_ups_thread_position"),
+        db.Index("ix_follow_ups_thread_hash", "thread_id", "text_hash"),
+    )
+
+class TaskRun(db.Model):
+    """解説タスク1回 (リトライの各試行) のステージ別所要時間 (ミリ秒)"""
+    __tablename__ = "task_runs"
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey("questions.id"), nullable=False, index=True)
+    task_id = db.Column(db.String(64), nullable=True)
+    lane = db.Column(db.String(20), nullable=True)
+    attempt = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=True)  # completed, failed, skipped, retry, deferred
+    error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    queue_wait_ms = db.Column(db.Integer, nullable=True)
+    db_fetch_ms = db.Column(db.Integer, nullable=True)
+    image_fetch_ms = db.Column(db.Integer, nullable=True)
+    phash_ms = db.Column(db.Integer, nullable=True)
+    presign_ms = db.Column(db.Integer, nullable=True)
+    ratelimit_wait_ms = db.Column(db.Integer, nullable=True)
+    model_ttft_ms = db.Column(db.Integer, nullable=True)
+    model_total_ms = db.Column(db.Integer, nullable=True)
+    persist_ms = db.Column(db.Integer, nullable=True)
+    total_ms = db.Column(db.Integer, nullable=True)
+
+    question = db.relationship("Question", backref="task_runs")
+
+class UsageEvent(db.Model):
+    """モデル呼び出し1回分のトークン数と料金 (マイクロドル)"""
+    __tablename__ = "usage_events"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # explanation, requestion, batch
+    model = db.Column(db.String(64), nullable=True)
+    question_id = db.Column(db.Integer, db.ForeignKey("questions.id"), nullable=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
+    school_id = db.Column(db.Integer, db.ForeignKey("schools.id"), nullable=True)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)  # キャッシュ分を含む
+    cached_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cost_micros = db.Column(db.BigInteger, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class UsageRollup(db.Model):
+    """UsageEvent の時間別・日別集計 (記録時に加算する)"""
+    __tablename__ = "usage_rollups"
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(10), nullable=False)  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False)  # UTC
+    school_id = db.Column(db.Integer, db.ForeignKey("schools.id"), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    input_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    cached_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    output_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    cost_micros = db.Column(db.BigInteger, nullable=False, default=0)
+
+    school = db.relationship("School")
+
+    __table_args__ = (
+        db.UniqueConstraint("period", "bucket_start", "school_id", "kind", name="uq_usage_rollups_bucket"),
+        # 学校ごとの月初からの合計 (予算判定) 用
+        db.Index("ix_usage_rollups_school_period", "school_id", "period", "bucket_start"),
+    )
 
 class AuditLog(db.Model):
     __tablename__ = "audit_logs"
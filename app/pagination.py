@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func, tuple_
+from .clients import get_redis
+from .models import Question
+
+# 質問一覧のキーセット (カーソル) ページング。
+# OFFSET は読み飛ばす行を毎回走査するため深いページほど遅くなる。
+# (created_at, id) の位置から続きを読むので、何ページ目でも1ページ目と同じコストで済む。
+# カーソルは (created_at, id) を base64 にした不透明なトークンとして URL に載せる。
+
+COUNT_KEY_PREFIX = "question_count:"
+
+
+def encode_cursor(question):
+    raw = json.dumps([question.created_at.isoformat(), question.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """トークンを (created_at, id) に戻す。壊れていれば None (先頭ページ扱い)"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, question_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(question_id)
+    except (ValueError, TypeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def paginate_keyset(query, per_page, after=None, before=None):
+    """新しい順 (created_at desc, id desc) の1ページを返す。
+
+    after: このカーソルより古いもの (次へ)、before: このカーソルより新しいもの (前へ)。
+    1件多く読んで続きの有無を判定する (COUNT は使わない)。
+    """
+    key = tuple_(Question.created_at, Question.id)
+    query = query.order_by(None)
+    after, before = decode_cursor(after), decode_cursor(before)
+
+    if before is not None:
+        rows = (query.filter(key > tuple_(*before))
+                .order_by(Question.created_at.asc(), Question.id.asc())
+                .limit(per_page + 1)
+                .all())
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        prev_cursor = encode_cursor(items[0]) if has_more and items else None
+        next_cursor = encode_cursor(items[-1]) if items else None
+        return KeysetPage(items, next_cursor, prev_cursor)
+
+    if after is not None:
+        query = query.filter(key < tuple_(*after))
+    rows = (query.order_by(Question.created_at.desc(), Question.id.desc())
+            .limit(per_page + 1)
+            .all())
+    items = rows[:per_page]
+    next_cursor = encode_cursor(items[-1]) if len(rows) > per_page else None
+    prev_cursor = encode_cursor(items[0]) if after is not None and items else None
+    return KeysetPage(items, next_cursor, prev_cursor)
+
+
+def cached_count(query, scope):
+    """一覧の件数 (Redis に QUESTION_COUNT_TTL 秒キャッシュ)。
+
+    表示用のおおよその件数なので、ページを移動するたびに COUNT(*) を走らせない。
+    QUESTION_COUNT_TTL=0 なら件数を出さない (None)。
+    """
+    ttl = current_app.config.get("QUESTION_COUNT_TTL", 60)
+    if ttl <= 0:
+        return None
+    key = COUNT_KEY_PREFIX + scope
+    try:
+        value = get_redis().get(key)
+        if value is not None:
+            return int(value)
+    except Exception as e:
+        current_app.logger.warning(f"question count cache unavailable: {e}")
+    # JOIN (eager load) を外した件数だけの SELECT にする
+    total = query.order_by(None).with_entities(func.count(Question.id)).scalar()
+    try:
+        get_redis().set(key, total, ex=ttl)
+    except Exception:
+        pass
+    return total
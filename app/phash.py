@@ -0,0 +1,188 @@
+import io
+import threading
+import time
+from flask import current_app
+from PIL import Image
+from . import db, metrics
+from .models import Question
+
+# 知覚ハッシュ (dHash) による近似重複画像の検索。
+# 同じ問題を少し違う角度・トリミングで撮った画像は SHA-256 では一致しないため、
+# 64bit の dHash をハミング距離で比較する。
+# 索引はワーカープロセスごとのメモリ上に持ち、起動時に DB から再構築する。
+
+HASH_BITS = 64
+
+
+def dhash(image_bytes: bytes) -> int:
+    """画像バイト列から 64bit の差分ハッシュ (dHash) を計算する"""
+    img = Image.open(io.BytesIO(image_bytes))
+    # JPEG はデコード時点で縮小できるので大きな写真でも速い
+    img.draft("L", (64, 64))
+    img = img.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = img.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def from_hex(text: str) -> int:
+    return int(text, 16)
+
+
+class HammingIndex:
+    """マルチインデックスハッシングによるハミング距離検索。
+
+    64bit を max_distance + 1 個のブロックに分割し、ブロックごとに辞書を持つ。
+    距離が max_distance 以下なら少なくとも1ブロックは完全一致する (鳩の巣原理) ので、
+    各ブロックの完全一致候補だけを popcount で検証すればよい。
+    """
+
+    def __init__(self, max_distance=4, bits=HASH_BITS):
+        self.max_distance = max_distance
+        self.bits = bits
+        blocks = max_distance + 1
+        base, extra = divmod(bits, blocks)
+        self._ranges = []
+        shift = 0
+        for i in range(blocks):
+            width = base + (1 if i < extra else 0)
+            self._ranges.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables = [{} for _ in self._ranges]
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def add(self, value: int, item):
+        with self._lock:
+            if item in self._items:
+                return
+            self._items[item] = value
+            entry = (value, item)
+            for (shift, mask), table in zip(self._ranges, self._tables):
+                key = (value >> shift) & mask
+                bucket = table.get(key)
+                if bucket is None:
+                    table[key] = [entry]
+                else:
+                    bucket.append(entry)
+
+    def search(self, value: int, max_distance=None):
+        """距離 max_distance 以内の (distance, item) を距離順で返す"""
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        seen = set()
+        results = []
+        for (shift, mask), table in zip(self._ranges, self._tables):
+            for candidate, item in table.get((value >> shift) & mask, ()):
+                if item in seen:
+                    continue
+                seen.add(item)
+                distance = (value ^ candidate).bit_count()
+                if distance <= limit:
+                    results.append((distance, item))
+        results.sort()
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+_max_indexed_id = 0
+_last_refresh = 0.0
+
+# 別プロセスで付与されたハッシュを取り込むときの id の巻き戻し幅。
+# ハッシュはタスク開始時に付与されるため id 順とは限らない。
+REFRESH_OVERLAP = 500
+
+
+def get_index():
+    """プロセス共有の索引を返す (未構築なら DB から構築)"""
+    global _index
+    if _index is None:
+        rebuild_index()
+    return _index
+
+
+def rebuild_index():
+    """DB の全ハッシュから索引を作り直す (ワーカー起動時)"""
+    global _index, _max_indexed_id, _last_refresh
+    index = HammingIndex(max_distance=current_app.config.get("PHASH_MAX_DISTANCE", 4))
+    max_id = _load_into(index, 0)
+    with _index_lock:
+        _index = index
+        _max_indexed_id = max_id
+        _last_refresh = time.monotonic()
+    print(f"DEBUG: pHash index built ({len(index)} hashes)")
+    return index
+
+
+def refresh_index():
+    """前回以降に他プロセスで付与されたハッシュを取り込む"""
+    global _max_indexed_id, _last_refresh
+    index = get_index()
+    interval = current_app.config.get("PHASH_REFRESH_SECONDS", 60)
+    if time.monotonic() - _last_refresh < interval:
+        return
+    _last_refresh = time.monotonic()
+    max_id = _load_into(index, max(_max_indexed_id - REFRESH_OVERLAP, 0))
+    _max_indexed_id = max(_max_indexed_id, max_id)
+
+
+def _load_into(index, after_id):
+    rows = (db.session.query(Question.id, Question.image_phash)
+            .filter(Question.image_phash.isnot(None), Question.id > after_id)
+            .order_by(Question.id)
+            .yield_per(10000))
+    max_id = after_id
+    for qid, value in rows:
+        index.add(from_hex(value), qid)
+        max_id = qid
+    return max_id
+
+
+def find_near_duplicate(question, image_bytes):
+    """question の画像に近い、解説済みの別の質問を返す (なければ None)。
+
+    question.image_phash を設定し、索引にも追加する (commit は呼び出し側)。
+    """
+    value = dhash(image_bytes)
+    question.image_phash = to_hex(value)
+
+    refresh_index()
+    index = get_index()
+    neighbours = [qid for _, qid in index.search(value, current_app.config.get("PHASH_MAX_DISTANCE", 4))
+                  if qid != question.id]
+    index.add(value, question.id)
+    if not neighbours:
+        metrics.incr("phash:miss")
+        return None
+
+    if question.grade is None:
+        same_grade = Question.grade.is_(None)
+    else:
+        same_grade = Question.grade == question.grade
+    candidates = (Question.query
+                  .filter(Question.id.in_(neighbours[:20]),
+                          Question.explanation_status == "completed",
+                          Question.explanation.isnot(None),
+                          same_grade)
+                  .all())
+    if not candidates:
+        metrics.incr("phash:miss")
+        return None
+    # 距離が最も近いものを採用
+    order = {qid: i for i, qid in enumerate(neighbours)}
+    metrics.incr("phash:hit")
+    return min(candidates, key=lambda c: order[c.id])
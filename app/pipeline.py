@@ -0,0 +1,359 @@
+import time
+from datetime import datetime
+from flask import current_app
+from . import db, metrics, phash, thumbnails
+from .models import Question
+from .services import ExplanationCacheService
+from .storage import get_storage, storage_key, image_url_for_model
+from .imaging import to_data_url
+from .uploads import ingest_upload, UPLOAD_PREFIX
+from .clients import get_openai_client, get_async_openai_client
+from .streaming import PartialTextWriter
+from .ratelimit import model_call, model_call_async
+from .timing import StageTimer
+from .usage import record_usage, KIND_EXPLANATION
+from .breaker import get_breaker, OPENAI
+
+# 解説生成パイプライン。
+# DB ステージ (prepare / finalize) とモデル呼び出しを分け、
+# 同期タスクと asyncio 実行 (app/aio.py) の両方から同じ処理を使う。
+
+MODEL = "gpt-5.2"
+
+EMPTY_EXPLANATION_MESSAGE = "AIからの回答が空でした。別の画像を試すか、しばらく待ってから再試行してください。"
+PERMANENT_FAILURE_MESSAGE = "この画像の解説を作成できませんでした。問題が写っているか確認し、別の画像で質問し直してください。"
+RETRY_EXHAUSTED_MESSAGE = "AIサービスが混み合っているため解説を作成できませんでした。しばらく待ってから再試行してください。"
+
+HIGH_SCHOOL_PROMPT = """
+                あなたは優秀な高校教師です。この画像に写っている問題を分析して、高校生の学習者に適した教育的な指導をしてください。
+
+                【絶対に守ること】
+                - 計算しなくていいから、解き方の手順だけ教えてください
+                - 日本の高校生の知識の範囲内で、専門用語も適宜使用して説明してください
+
+                【表示形式】
+                - 考え方と手順のみ表示
+                - 重要な数式は $$...$$ で中央揃え表示
+                - 式に番号を振ってください
+
+                まず画像の内容を詳しく分析し、問題文を正確に読み取ってから指導を開始してください。
+                """
+
+MIDDLE_SCHOOL_PROMPT = """
+                あなたは優秀な中学教師です。この画像に写っている問題を分析して、中学生の学習者に適した教育的な指導をしてください。
+
+                【絶対に守ること】
+                - 計算しなくていいから、解き方の手順だけ教えてください
+                - 日本の中学生の知識の範囲内で、専門用語は避け、平易な言葉で説明してください
+                - できるだけで細かく、わかりやすく説明してください
+
+                【表示形式】
+                - 考え方と手順のみ表示
+                - 重要な数式は $$...$$ で中央揃え表示
+                - 式に番号を振ってください
+
+                まず画像の内容を詳しく分析し、問題文を正確に読み取ってから指導を開始してください。
+                """
+
+
+class ExplanationJob:
+    """モデル呼び出しに必要な情報 (DB セッションの外に持ち出せる値のみ)"""
+
+    def __init__(self, question_id, request):
+        self.question_id = question_id
+        self.request = request
+
+    @property
+    def stream_name(self):
+        return f"question:{self.question_id}"
+
+
+def build_prompt(grade):
+    # 学年に応じてプロンプトを切り替える
+    if grade == 'high-school':
+        return HIGH_SCHOOL_PROMPT
+    return MIDDLE_SCHOOL_PROMPT  # デフォルトは中学生向け
+
+
+def build_request(prompt, image_url):
+    """chat.completions.create に渡す引数"""
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {
+                    "url": image_url,
+                    "detail": "auto"
+                }}
+            ]}
+        ],
+        "max_completion_tokens": 5000,
+        "temperature": 0.7,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+
+
+def is_stale(question, generation):
+    """タスクの claim が古いか。
+
+    generation なし (claim 導入前に投入されたメッセージ) は従来どおり常に実行する。
+    """
+    if generation is None:
+        return False
+    return question.explanation_generation != generation or question.explanation_status == "completed"
+
+
+def _stale_result(question_id, generation):
+    print(f"DEBUG: Stale claim for question_id={question_id} (generation={generation}), skipping")
+    metrics.incr("task:stale")
+    return {"status": "skipped", "question_id": question_id, "reason": "stale"}
+
+
+def prepare_explanation(question_id, generation=None, timer=None):
+    """DB ステージ: 質問を読み込み、モデル呼び出しの内容を組み立てる。
+
+    (job, None) を返す。モデルを呼ばずに終わった場合は (None, result)。
+    """
+    timer = timer or StageTimer()
+    print(f"DEBUG: Starting task for question_id={question_id}")
+    with timer.stage("db_fetch"):
+        question = db.session.get(Question, question_id)
+        if not question:
+            print("ERROR: Question not found")
+            return None, {"status": "failed", "error": "Question not found"}
+
+        if not question.image_path:
+            print("ERROR: Image path not found")
+            return None, {"status": "failed", "error": "Image path not found"}
+
+        # 重複投入・再生成で置き換えられたタスクはモデルを呼ばずに終える
+        if is_stale(question, generation):
+            db.session.rollback()
+            return None, _stale_result(question_id, generation)
+
+        question.explanation_status = "processing"
+        # claim 済みの行は既に processing なので、status だけでは UPDATE が出ず onupdate も効かない。
+        # キュー待ちが長くても reaper に回収されないよう、処理開始のハートビートを明示的に打つ
+        question.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    # 画像 (保存先のキー)
+    storage = get_storage()
+    key = storage_key(question.image_path)
+    print(f"DEBUG: Image key: {key} ({storage.name})")
+    # ブラウザから直接アップロードされた画像は、まだハッシュ計算・正規化をしていない
+    needs_ingest = question.content_hash is None and key.startswith(f"{UPLOAD_PREFIX}/")
+    # プロバイダが保存先を直接読めなければ base64 で渡す
+    inline = current_app.config.get("IMAGE_INLINE_ENABLED") or not storage.remote_fetchable
+
+    # 画像本体は取り込み・pHash・inline 送信で共用する (保存先からの読み込みは1回)
+    image_bytes = None
+    needs_thumbnail = question.thumbnail_path is None and current_app.config.get("THUMBNAIL_ENABLED", True)
+    if needs_ingest or needs_thumbnail or inline or current_app.config.get("PHASH_ENABLED"):
+        try:
+            with timer.stage("image_fetch"):
+                image_bytes = storage.get(key)
+        except Exception as e:
+            print(f"WARNING: Failed to read image from storage: {e}")
+
+    cached = None
+    if needs_ingest and image_bytes is not None:
+        image_bytes, cached = ingest_upload(question, image_bytes)
+
+    # 一覧用のサムネイル (正規化後の画像から作る)
+    if needs_thumbnail and image_bytes is not None:
+        with timer.stage("thumbnail"):
+            thumbnails.ensure_thumbnail(question, image_bytes)
+
+    if cached is not None:
+        print(f"DEBUG: Reusing cached explanation for uploaded image (hash={question.content_hash[:12]})")
+        question.explanation = cached.explanation
+        question.explanation_status = "completed"
+        db.session.commit()
+        return None, {"status": question.explanation_status, "question_id": question_id, "cached": True}
+    db.session.commit()
+
+    # 近似重複画像 (別角度・トリミング違い) の解説があれば再利用する
+    if current_app.config.get("PHASH_ENABLED") and image_bytes is not None:
+        neighbour = None
+        try:
+            with timer.stage("phash"):
+                neighbour = phash.find_near_duplicate(question, image_bytes)
+        except Exception as e:
+            print(f"WARNING: Near-duplicate lookup failed: {e}")
+        if neighbour is not None:
+            print(f"DEBUG: Reusing explanation of near-duplicate question_id={neighbour.id}")
+            question.explanation = neighbour.explanation
+            question.explanation_status = "completed"
+            ExplanationCacheService.store(question)
+            db.session.commit()
+            return None, {"status": question.explanation_status, "question_id": question_id,
+                          "reused_from": neighbour.id}
+        db.session.commit()
+
+    if inline and image_bytes is not None:
+        # プロバイダに S3 を取りに行かせず、正規化済みの画像を base64 で直接渡す
+        job = ExplanationJob(question.id, build_request(build_prompt(question.grade), to_data_url(image_bytes)))
+        return job, None
+
+    # Presigned URLの発行 (非公開バケット対応)
+    with timer.stage("presign"):
+        image_url = image_url_for_model(question.image_path)
+
+    job = ExplanationJob(question.id, build_request(build_prompt(question.grade), image_url))
+    return job, None
+
+
+class StreamResult:
+    def __init__(self):
+        self.finish_reason = None
+        self.usage = None
+        self.first_token_at = None
+
+    def apply(self, chunk, writer):
+        # include_usage 指定時、最後のチャンクは choices が空で usage のみ
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+        choice = chunk.choices[0]
+        if self.first_token_at is None and choice.delta.content:
+            self.first_token_at = time.monotonic()
+        writer.append(choice.delta.content)
+        self.finish_reason = choice.finish_reason or self.finish_reason
+
+
+def consume_stream(stream, writer):
+    """ストリームを読み切り、途中経過を writer に流す"""
+    result = StreamResult()
+    for chunk in stream:
+        result.apply(chunk, writer)
+    return result
+
+
+async def consume_stream_async(stream, writer):
+    result = StreamResult()
+    async for chunk in stream:
+        result.apply(chunk, writer)
+    return result
+
+
+def finalize_explanation(question_id, writer, finish_reason=None, generation=None, usage=None):
+    """DB ステージ: 確定したテキストと利用量を保存し、購読者に完了を通知する"""
+    print(f"DEBUG: OpenAI stream finished. Finish Reason: {finish_reason}")
+    explanation_text = writer.text.strip()
+
+    print(f"DEBUG: OpenAI Response Length: {len(explanation_text)}")
+    print(f"DEBUG: OpenAI Response Preview: {explanation_text[:100]}...")
+
+    question = db.session.get(Question, question_id)
+    # 結果を使わない場合も料金はかかっているので記録する
+    record_usage(KIND_EXPLANATION, usage, question_id=question_id, user_id=question.user_id,
+                 school_id=question.school_id, model=MODEL)
+    if is_stale(question, generation):
+        # 生成中に新しい claim が入った場合は結果を書き込まない
+        db.session.commit()
+        return _stale_result(question_id, generation)
+    if not explanation_text:
+        print("ERROR: OpenAI returned empty explanation.")
+        question.explanation = EMPTY_EXPLANATION_MESSAGE
+        question.explanation_status = "failed"
+    else:
+        question.explanation = explanation_text
+        question.explanation_status = "completed"
+        # 同じ画像の再投稿に備えてキャッシュ登録
+        ExplanationCacheService.store(question)
+
+    db.session.commit()
+    writer.finish(question.explanation_status, question.explanation)
+    print(f"DEBUG: Task finished. Status: {question.explanation_status}")
+
+    return {"status": question.explanation_status, "question_id": question_id}
+
+
+def _record_model_timing(timer, started, stream_result):
+    if stream_result.first_token_at is not None:
+        timer.record("model_ttft", stream_result.first_token_at - started)
+    timer.record("model_total", time.monotonic() - started)
+
+
+def _persist(timer, question_id, writer, stream_result, generation):
+    with timer.stage("persist"):
+        return finalize_explanation(question_id, writer, stream_result.finish_reason, generation, stream_result.usage)
+
+
+def run_explanation(question_id, generation=None, timer=None):
+    """同期実行: prepare → モデル (ストリーム) → finalize"""
+    timer = timer or StageTimer()
+    job, result = prepare_explanation(question_id, generation, timer)
+    if result is not None:
+        return result
+    # 共有レートリミットの枠を待ってから呼ぶ
+    waiting = time.monotonic()
+    with get_breaker(OPENAI).guard(), model_call(job.request) as call:
+        timer.record("ratelimit_wait", time.monotonic() - waiting)
+        print("DEBUG: Calling OpenAI API (stream)...")
+        started = time.monotonic()
+        raw = get_openai_client().chat.completions.with_raw_response.create(**job.request)
+        call.observe(raw.headers)
+        writer = PartialTextWriter(job.stream_name)
+        stream_result = consume_stream(raw.parse(), writer)
+        call.usage = stream_result.usage
+        _record_model_timing(timer, started, stream_result)
+    return _persist(timer, question_id, writer, stream_result, generation)
+
+
+async def run_explanation_async(question_id, executor, generation=None, timer=None):
+    """asyncio 実行: DB ステージは executor の DB スレッドで、モデル呼び出しはイベントループ上で行う"""
+    timer = timer or StageTimer()
+    job, result = await executor.run_db(prepare_explanation, question_id, generation, timer)
+    if result is not None:
+        return result
+    waiting = time.monotonic()
+    with get_breaker(OPENAI).guard():
+        async with executor.model_slot(), model_call_async(job.request) as call:
+            timer.record("ratelimit_wait", time.monotonic() - waiting)
+            print("DEBUG: Calling OpenAI API (async stream)...")
+            started = time.monotonic()
+            raw = await get_async_openai_client().chat.completions.with_raw_response.create(**job.request)
+            call.observe(raw.headers)
+            writer = PartialTextWriter(job.stream_name)
+            stream_result = await consume_stream_async(raw.parse(), writer)
+            call.usage = stream_result.usage
+            _record_model_timing(timer, started, stream_result)
+    return await executor.run_db(_persist, timer, question_id, writer, stream_result, generation)
+
+
+def extend_lease(question_id, generation=None):
+    """claim がまだ有効なら updated_at を進めて True を返す (リトライ・後回しの前に呼ぶ)。
+
+    reaper は updated_at が古い processing の質問を止まったものとみなす。
+    """
+    db.session.rollback()
+    query = Question.query.filter(Question.id == question_id, Question.explanation_status == "processing")
+    if generation is not None:
+        query = query.filter(Question.explanation_generation == generation)
+    updated = query.update({Question.updated_at: datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+
+def record_failure(question_id, exc, generation=None, message=None):
+    """例外発生時に質問を failed にする。claim が古ければ何もせず False を返す。
+
+    message を渡すと例外の文字列の代わりに生徒に見せる文面を保存する。
+    """
+    db.session.rollback()
+    question = db.session.get(Question, question_id)
+    if question and is_stale(question, generation):
+        return False
+    if question:
+        question.explanation_status = "failed"
+        question.explanation = message or str(exc)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+    return True
@@ -0,0 +1,99 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from . import metrics
+
+# リクエストごとの SQL 文の数と所要時間。
+# 一覧の N+1 (行ごとの q.user / q.school の遅延ロード) のような退行を見つけるため、
+# @query_budget(n) を付けたエンドポイントで上限を超えたら警告し、
+# QUERY_BUDGET_STRICT (テスト) なら QueryBudgetExceeded で落とす。
+# 件数は Redis のヒストグラム (db_queries:<endpoint>) に記録する。
+# Server-Timing ヘッダは誰にでも見えるので、debug / テストか QUERY_SERVER_TIMING のときだけ付ける。
+
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+
+class QueryBudgetExceeded(Exception):
+    """エンドポイントの SQL 文の数が上限を超えた"""
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+
+_scopes = []  # count_queries() の入れ子 (テスト・ベンチマーク用)
+
+
+def _current_stats():
+    stats = list(_scopes)
+    if has_request_context() and "query_stats" in g:
+        stats.append(g.query_stats)
+    return stats
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started")
+    elapsed = time.perf_counter() - started.pop() if started else 0.0
+    for stats in _current_stats():
+        stats.count += 1
+        stats.seconds += elapsed
+        stats.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """with の中で実行された SQL 文を数える"""
+    stats = QueryStats()
+    _scopes.append(stats)
+    try:
+        yield stats
+    finally:
+        _scopes.remove(stats)
+
+
+def query_budget(limit):
+    """ビューの SQL 文の数の上限を宣言する"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return fn(*args, **kwargs)
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    @app.before_request
+    def _start_query_stats():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def _finish_query_stats(response):
+        stats = g.pop("query_stats", None)
+        if stats is None or request.endpoint is None:
+            return response
+        if current_app.debug or current_app.testing or current_app.config.get("QUERY_SERVER_TIMING"):
+            response.headers.add("Server-Timing", f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"')
+        metrics.observe(f"db_queries:{request.endpoint}", stats.count, QUERY_COUNT_BUCKETS)
+
+        view = current_app.view_functions.get(request.endpoint)
+        limit = getattr(view, "query_budget", None)
+        if limit is not None and stats.count > limit:
+            message = f"{request.endpoint} ran {stats.count} queries (budget {limit})"
+            print(f"WARNING: {message}")
+            metrics.incr(f"db_queries:over_budget:{request.endpoint}")
+            if current_app.config.get("QUERY_BUDGET_STRICT"):
+                raise QueryBudgetExceeded(message + "\n" + "\n".join(stats.statements))
+        return response
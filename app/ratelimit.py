@@ -0,0 +1,292 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import openai
+from flask import current_app
+from . import metrics
+from .clients import get_redis
+
+# OpenAI 呼び出しのレート制御。
+# 1. 全ワーカー・Web 共有のトークンバケット (Redis + Lua) で RPM / TPM を守る。
+# 2. プロセスごとの AIMD 同時実行数制御で、レスポンスヘッダの残量が減ってきたら
+#    429 が出る前に同時実行数を絞る。
+
+# 2つのバケット (リクエスト数 / トークン数) を1回の呼び出しで原子的に判定する。
+# 両方に余裕があれば消費して 0 を、なければ待つべきミリ秒を返す。
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local function refill(key, capacity)
+    local data = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(data[1])
+    local ts = tonumber(data[2])
+    if level == nil then
+        return capacity
+    end
+    return math.min(capacity, level + (now - ts) * capacity / 60000)
+end
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm)
+local requests = refill(KEYS[1], rpm)
+local tokens = refill(KEYS[2], tpm)
+local wait = 0
+if requests < 1 then
+    wait = math.max(wait, (1 - requests) * 60000 / rpm)
+end
+if tokens < cost then
+    wait = math.max(wait, (cost - tokens) * 60000 / tpm)
+end
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'level', tostring(requests), 'ts', now)
+redis.call('HSET', KEYS[2], 'level', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+redis.call('PEXPIRE', KEYS[2], 120000)
+return math.ceil(wait)
+"""
+
+
+class RateLimitTimeout(Exception):
+    """待ち時間の上限までにバケットが空かなかった"""
+
+
+class TokenBucketLimiter:
+    """Redis 上の RPM / TPM トークンバケット (全プロセス共有)"""
+
+    def __init__(self, redis_client, rpm, tpm, name="openai"):
+        self.redis = redis_client
+        self.rpm = rpm
+        self.tpm = tpm
+        self.keys = [f"ratelimit:{name}:requests", f"ratelimit:{name}:tokens"]
+        self._script = redis_client.register_script(_ACQUIRE_SCRIPT)
+
+    def try_acquire(self, tokens):
+        """取得できれば 0、できなければ待つべき秒数を返す。Redis 障害時は制限しない"""
+        try:
+            wait_ms = int(self._script(keys=self.keys, args=[self.rpm, self.tpm, int(tokens)]))
+        except Exception as e:
+            current_app.logger.warning(f"rate limiter unavailable, allowing request: {e}")
+            return 0
+        return wait_ms / 1000.0
+
+    def acquire(self, tokens, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                if waited:
+                    metrics.incr("ratelimit:delayed")
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                metrics.incr("ratelimit:timeout")
+                raise RateLimitTimeout(f"rate limit wait {wait:.1f}s exceeds timeout")
+            waited = True
+            # 同時に待っているワーカーが一斉に再試行しないよう揺らす
+            time.sleep(min(wait, 5.0) * random.uniform(1.0, 1.2))
+
+    async def acquire_async(self, tokens, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                metrics.incr("ratelimit:timeout")
+                raise RateLimitTimeout(f"rate limit wait {wait:.1f}s exceeds timeout")
+            await asyncio.sleep(min(wait, 5.0) * random.uniform(1.0, 1.2))
+
+    def reconcile(self, extra_tokens):
+        """見積もりと実際の使用トークンの差分をバケットに反映する"""
+        if not extra_tokens:
+            return
+        try:
+            self.redis.hincrbyfloat(self.keys[1], "level", -extra_tokens)
+        except Exception as e:
+            current_app.logger.warning(f"rate limiter reconcile failed: {e}")
+
+
+class AdaptiveConcurrency:
+    """AIMD による同時実行数の制御 (プロセス内)。
+
+    レスポンスヘッダの残量 (x-ratelimit-remaining-*) に余裕があれば上限を少しずつ上げ、
+    残量が閾値を下回るか 429 を受けたら上限を乗算的に下げる。
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, low_watermark=0.1, decrease=0.7):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.low_watermark = low_watermark
+        self.decrease = decrease
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self):
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait(timeout=1.0)
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        while not self.try_acquire():
+            await asyncio.sleep(0.05)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_response(self, headers):
+        headroom = _headroom(headers)
+        with self._cond:
+            if headroom is not None and headroom < self.low_watermark:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                metrics.incr("ratelimit:backoff")
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1.0))
+            self._cond.notify_all()
+
+    def on_rate_limited(self):
+        with self._cond:
+            self.limit = max(self.minimum, self.limit * 0.5)
+        metrics.incr("ratelimit:429")
+
+
+def _headroom(headers):
+    """残量 / 上限 の小さい方 (ヘッダがなければ None)"""
+    ratios = []
+    for kind in ("requests", "tokens"):
+        try:
+            remaining = float(headers.get(f"x-ratelimit-remaining-{kind}"))
+            limit = float(headers.get(f"x-ratelimit-limit-{kind}"))
+        except (TypeError, ValueError):
+            continue
+        if limit > 0:
+            ratios.append(remaining / limit)
+    return min(ratios) if ratios else None
+
+
+def estimate_tokens(request):
+    """TPM 消費の見積もり (プロンプト文字数 + 画像 + 出力上限)"""
+    text = 0
+    images = 0
+    for message in request.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            text += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                text += len(part["text"])
+            elif part.get("type") == "image_url":
+                images += 1
+    # 日本語はおおむね1文字1トークン。画像は detail=auto で最大 1,105 トークン程度
+    return text + images * 1105 + request.get("max_completion_tokens", 0)
+
+
+class ModelCall:
+    """1回のモデル呼び出しの状態。呼び出し側が headers / usage を記録する"""
+
+    def __init__(self, estimate):
+        self.estimate = estimate
+        self.usage = None
+        self._controller = None
+
+    def observe(self, headers):
+        if self._controller is not None:
+            self._controller.on_response(headers)
+
+
+_limiter = None
+_controller = None
+_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        config = current_app.config
+        with _lock:
+            if _limiter is None:
+                _limiter = TokenBucketLimiter(get_redis(), config["OPENAI_RPM_LIMIT"], config["OPENAI_TPM_LIMIT"])
+    return _limiter
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        config = current_app.config
+        with _lock:
+            if _controller is None:
+                maximum = config["OPENAI_MAX_CONCURRENCY"]
+                _controller = AdaptiveConcurrency(initial=max(1, maximum // 2), maximum=maximum)
+    return _controller
+
+
+def reset():
+    global _limiter, _controller
+    with _lock:
+        _limiter = None
+        _controller = None
+
+
+def _finish(call, limiter):
+    total = getattr(call.usage, "total_tokens", None)
+    if total is not None:
+        limiter.reconcile(total - call.estimate)
+
+
+@contextmanager
+def model_call(request, timeout=None):
+    """同期のモデル呼び出しをバケットと同時実行数制御で囲む"""
+    if not current_app.config.get("RATE_LIMIT_ENABLED", True):
+        yield ModelCall(0)
+        return
+    limiter = get_limiter()
+    controller = get_controller()
+    call = ModelCall(estimate_tokens(request))
+    limiter.acquire(call.estimate, timeout=timeout)
+    controller.acquire()
+    call._controller = controller
+    try:
+        yield call
+    except openai.RateLimitError:
+        controller.on_rate_limited()
+        raise
+    finally:
+        controller.release()
+    _finish(call, limiter)
+
+
+@asynccontextmanager
+async def model_call_async(request, timeout=None):
+    if not current_app.config.get("RATE_LIMIT_ENABLED", True):
+        yield ModelCall(0)
+        return
+    limiter = get_limiter()
+    controller = get_controller()
+    call = ModelCall(estimate_tokens(request))
+    await limiter.acquire_async(call.estimate, timeout=timeout)
+    await controller.acquire_async()
+    call._controller = controller
+    try:
+        yield call
+    except openai.RateLimitError:
+        controller.on_rate_limited()
+        raise
+    finally:
+        controller.release()
+    _finish(call, limiter)
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_
+from . import db, metrics
+from .models import Question
+from .clients import get_redis
+from .services import QuestionService
+
+# processing のまま止まった質問の回収。
+# ワーカーがタスクの途中で落ちると質問は processing のまま残り、画面は完了を待ってポーリングし続ける。
+# updated_at (claim・処理開始・リトライのたびに進む) がリース期間より古いものを
+# claim し直して backfill レーンに投入する。回収済みの回数が上限を超えたものは failed にする。
+
+REAPED_MESSAGE = "解説の作成が中断されました。もう一度「解説を生成」を押してください。"
+REQUEUE_KEY_PREFIX = "reaper:requeued:"
+
+
+def lease_expired(lease_seconds):
+    """最後のハートビート (updated_at) から lease_seconds 以上たっている条件"""
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    return or_(Question.updated_at < cutoff,
+               # updated_at 導入前の行
+               and_(Question.updated_at.is_(None), Question.created_at < cutoff))
+
+
+def stuck_query(lease_seconds):
+    """リース切れの processing の質問 (id, generation) のクエリ"""
+    return (db.session.query(Question.id, Question.explanation_status, Question.explanation_generation)
+            .filter(Question.explanation_status == "processing", lease_expired(lease_seconds)))
+
+
+def _requeue_count(question_id):
+    """この質問を回収した回数 (今回を含む)。Redis 障害時は 1 とみなす"""
+    try:
+        redis_client = get_redis()
+        key = f"{REQUEUE_KEY_PREFIX}{question_id}"
+        count = redis_client.incr(key)
+        redis_client.expire(key, 24 * 3600)
+        return count
+    except Exception as e:
+        current_app.logger.warning(f"reaper requeue counter unavailable: {e}")
+        return 1
+
+
+def fail_stuck(rows, lease_seconds):
+    """まとめて failed にする (読み取り後に heartbeat が来た行は更新しない)"""
+    if not rows:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    failed = 0
+    for row in rows:
+        failed += (Question.query
+                   .filter(Question.id == row.id, Question.explanation_status == "processing",
+                           Question.explanation_generation == row.explanation_generation,
+                           or_(Question.updated_at < cutoff, Question.updated_at.is_(None)))
+                   .update({Question.explanation_status: "failed", Question.explanation: REAPED_MESSAGE},
+                           synchronize_session=False))
+    db.session.commit()
+    return failed
+
+
+def reap(lease_seconds=None, limit=500, fail_all=False, dry_run=False, max_requeues=None):
+    """止まった質問を回収し、集計を dict で返す"""
+    from .tasks import dispatch_explanation, LANE_BACKFILL
+    config = current_app.config
+    lease_seconds = lease_seconds or config.get("REAPER_LEASE_SECONDS", 1800)
+    max_requeues = config.get("REAPER_MAX_REQUEUES", 2) if max_requeues is None else max_requeues
+
+    rows = stuck_query(lease_seconds).order_by(Question.id).limit(limit).all()
+    summary = {"found": len(rows), "requeued": 0, "failed": 0, "skipped": 0}
+    if dry_run or not rows:
+        return summary
+
+    to_fail = []
+    to_requeue = []
+    for row in rows:
+        if fail_all or _requeue_count(row.id) > max_requeues:
+            to_fail.append(row)
+        else:
+            to_requeue.append(row)
+
+    summary["failed"] = fail_stuck(to_fail, lease_seconds)
+    for row in to_requeue:
+        # 読み取り時点の世代のまま processing でリース切れの行だけを claim し直す (古いタスクは stale で終わる)
+        generation = QuestionService.claim_explanation(row.id, statuses=("processing",),
+                                                       generation=row.explanation_generation,
+                                                       lease_seconds=lease_seconds)
+        if generation is None:
+            continue
+        dispatch_explanation(row.id, LANE_BACKFILL, generation=generation)
+        summary["requeued"] += 1
+    summary["skipped"] = summary["found"] - summary["requeued"] - summary["failed"]
+
+    metrics.incr("reaper:requeued", summary["requeued"])
+    metrics.incr("reaper:failed", summary["failed"])
+    print(f"DEBUG: Reaper found={summary['found']} requeued={summary['requeued']} "
+          f"failed={summary['failed']} skipped={summary['skipped']}")
+    return summary
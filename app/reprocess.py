@@ -0,0 +1,150 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_
+from . import db
+from .models import Question
+from .reaper import lease_expired
+from .services import QuestionService
+
+# 障害後に failed / processing のまま残った質問の一括再処理 (manage.py reprocess)。
+# (explanation_status, id) の索引で id 順に少しずつ読み、claim してから
+# backfill レーンに一定レートで投入する。チェックポイントに最後の id を保存して再開できる。
+
+DEFAULT_STATUSES = ("failed", "processing")
+
+
+class Checkpoint:
+    """再開用の状態 (最後に処理した id と投入したバッチ) を JSON ファイルに保存する"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.last_id = 0
+        self.batches = []
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.last_id = data.get("last_id", 0)
+            self.batches = data.get("batches", [])
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"last_id": self.last_id, "batches": self.batches}, f)
+        os.replace(tmp, self.path)
+
+
+def candidate_query(statuses=DEFAULT_STATUSES, school_id=None, older_than_minutes=30, lease_seconds=None):
+    """再処理対象 (id, status, generation) のクエリ
+
+    processing は reaper と同じくハートビート (updated_at) が lease_seconds
+    (既定 REAPER_LEASE_SECONDS) より古いものだけを選ぶ。昔の投稿でも再生成・リトライ中なら
+    updated_at が新しいので claim し直さない (モデルの二重呼び出しになる)。
+    それ以外の status は投稿から older_than_minutes 分たったものを選ぶ。
+    """
+    q = (db.session.query(Question.id, Question.explanation_status, Question.explanation_generation)
+         .filter(Question.explanation_status.in_(statuses), Question.image_path.isnot(None)))
+    if school_id is not None:
+        q = q.filter(Question.school_id == school_id)
+
+    conditions = []
+    if "processing" in statuses:
+        lease_seconds = lease_seconds or current_app.config.get("REAPER_LEASE_SECONDS", 1800)
+        conditions.append(and_(Question.explanation_status == "processing", lease_expired(lease_seconds)))
+    others = [s for s in statuses if s != "processing"]
+    if others:
+        condition = Question.explanation_status.in_(others)
+        if older_than_minutes:
+            # 投稿直後の質問には手を出さない
+            condition = and_(condition,
+                             Question.created_at < datetime.utcnow() - timedelta(minutes=older_than_minutes))
+        conditions.append(condition)
+    return q.filter(or_(*conditions))
+
+
+def iter_chunks(query, after_id=0, chunk_size=50, limit=None):
+    """id 順のキーセットページングで少しずつ返す (OFFSET を使わない)"""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        rows = query.filter(Question.id > after_id).order_by(Question.id).limit(size).all()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1].id
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def claim_rows(rows, lease_seconds=None):
+    """読み取り時点から変わっていない行だけを claim し、[(id, generation)] を返す
+
+    processing の行は claim の時点でもリース切れか確かめる (読み取り後に処理を始めたタスクを奪わない)。
+    """
+    lease_seconds = lease_seconds or current_app.config.get("REAPER_LEASE_SECONDS", 1800)
+    claims = []
+    for row in rows:
+        processing = row.explanation_status == "processing"
+        generation = QuestionService.claim_explanation(row.id, statuses=(row.explanation_status,),
+                                                       generation=row.explanation_generation,
+                                                       lease_seconds=lease_seconds if processing else None)
+        if generation is not None:
+            claims.append((row.id, generation))
+    return claims
+
+
+def reprocess(query, checkpoint, chunk_size=50, rate=2.0, limit=None, dry_run=False, use_batch=False,
+              echo=print, sleep=time.sleep):
+    """対象を chunk_size 件ずつ claim して投入する。rate は1秒あたりの投入数の上限。
+
+    use_batch なら chunk ごとに Batch API へ投入する。集計を dict で返す。
+    """
+    from .tasks import dispatch_explanation, LANE_BACKFILL
+    from .pipeline import record_failure
+
+    total = query.filter(Question.id > checkpoint.last_id).count()
+    if limit is not None:
+        total = min(total, limit)
+    echo(f"{total} question(s) to reprocess" + (" (dry run)" if dry_run else ""))
+
+    summary = {"selected": 0, "enqueued": 0, "skipped": 0, "batches": []}
+    started = time.monotonic()
+    for rows in iter_chunks(query, checkpoint.last_id, chunk_size, limit):
+        summary["selected"] += len(rows)
+        if dry_run:
+            echo("  " + ", ".join(str(r.id) for r in rows))
+            continue
+
+        claims = claim_rows(rows)
+        summary["skipped"] += len(rows) - len(claims)
+        if use_batch and claims:
+            try:
+                from .batch import submit_batch
+                batch = submit_batch(claims)
+            except Exception as e:
+                # claim を戻さないと processing のまま残る
+                for question_id, generation in claims:
+                    record_failure(question_id, e, generation)
+                raise
+            checkpoint.batches.append(batch.id)
+            summary["batches"].append(batch.id)
+        else:
+            for question_id, generation in claims:
+                dispatch_explanation(question_id, LANE_BACKFILL, generation=generation)
+        summary["enqueued"] += len(claims)
+        checkpoint.last_id = rows[-1].id
+        checkpoint.save()
+
+        elapsed = time.monotonic() - started
+        echo(f"[{summary['selected']}/{total}] enqueued={summary['enqueued']} skipped={summary['skipped']} "
+             f"({summary['enqueued'] / max(elapsed, 1e-6):.1f}/s)")
+        # 通常のトラフィックを押し出さないよう投入レートを抑える
+        if rate and not use_batch:
+            wait = summary["enqueued"] / rate - (time.monotonic() - started)
+            if wait > 0:
+                sleep(wait)
+    return summary
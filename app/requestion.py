@@ -0,0 +1,264 @@
+import json
+import time
+import uuid
+from datetime import datetime
+from flask import current_app
+from . import db
+from .models import Question, FollowUp, FollowUpThread
+from .clients import get_openai_client, get_async_openai_client, get_redis
+from .pipeline import MODEL, consume_stream, consume_stream_async
+from .storage import image_url_for_model
+from .streaming import PartialTextWriter
+from .ratelimit import model_call, model_call_async
+from .usage import record_usage, KIND_REQUESTION
+from .breaker import get_breaker, OPENAI
+
+# 再質問 (解説に対する追加質問) のジョブ。
+# Web はジョブを Redis に登録してタスクを投入するだけで、すぐにジョブ ID を返す。
+# 回答はワーカーが生成し、解説と同じ仕組み (app/streaming.py) で途中経過を配信する。
+# やりとりは FollowUp としてスレッドに保存し、プロンプトは
+#   1. 画像 + 元の解説 (毎回同じ先頭部分。プロバイダのプロンプトキャッシュが効く)
+#   2. 古いやりとりの要約
+#   3. 直近のやりとりと今回の質問だけをそのまま
+# の順に組み立てる。
+
+JOB_KEY_PREFIX = "requestion:job:"
+DEFAULT_JOB_TTL = 3600
+
+
+def job_key(job_id):
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+
+def stream_name(job_id):
+    return f"requestion:{job_id}"
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def create_job(question_id, user_id, question_text, follow_up_id=None, job_id=None):
+    """ジョブを登録してジョブ ID を返す (Redis 障害時は例外)"""
+    job_id = job_id or new_job_id()
+    ttl = current_app.config.get("REQUESTION_JOB_TTL", DEFAULT_JOB_TTL)
+    get_redis().set(job_key(job_id), json.dumps({
+        "id": job_id,
+        "question_id": question_id,
+        "follow_up_id": follow_up_id,
+        "user_id": user_id,
+        "question_text": question_text,
+        "status": "queued",
+        "answer": None,
+        "error": None,
+        "created_at": time.time(),
+    }, ensure_ascii=False), ex=ttl)
+    return job_id
+
+
+def get_job(job_id):
+    data = get_redis().get(job_key(job_id))
+    return json.loads(data) if data else None
+
+
+def update_job(job_id, **fields):
+    job = get_job(job_id)
+    if job is None:
+        return None
+    job.update(fields)
+    ttl = current_app.config.get("REQUESTION_JOB_TTL", DEFAULT_JOB_TTL)
+    get_redis().set(job_key(job_id), json.dumps(job, ensure_ascii=False), ex=ttl)
+    return job
+
+
+def build_requestion_prompt(original_explanation, question_text):
+    return f"""
+        ユーザーは以前、画像（添付）で質問をし、以下の解説を受け取りました。
+
+        【以前の解説】
+        ---
+        {original_explanation}
+        ---
+
+        この解説と元の画像を踏まえて、ユーザーから以下の追加質問がありました。
+        この質問に対して、分かりやすく、丁寧に追加の解説をしてください。
+
+        【ユーザーの追加質問】
+        「{question_text}」
+
+        【指示】
+        - 元の画像と以前の解説内容を考慮して回答してください。
+        - 重要な数式は $$...$$ を使って表現してください。
+        """
+
+
+def build_requestion_request(messages):
+    return {
+        "model": MODEL,
+        "messages": messages,
+        "max_completion_tokens": 3000,
+        "temperature": 0.7,
+        "timeout": 60,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+
+
+FOLLOW_UP_PREFIX = """
+        ユーザーは以前、画像（添付）で質問をし、以下の解説を受け取りました。
+
+        【以前の解説】
+        ---
+        {explanation}
+        ---
+
+        この解説と元の画像を踏まえて、ユーザーから追加質問があります。
+        最後の追加質問に対して、分かりやすく、丁寧に追加の解説をしてください。
+
+        【指示】
+        - 元の画像と以前の解説内容を考慮して回答してください。
+        - 重要な数式は $$...$$ を使って表現してください。
+        """
+
+
+def _clip(text, limit):
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def build_follow_up_messages(question, thread, follow_up, image_url):
+    """スレッドの文脈を含む messages を組み立てる"""
+    messages = [{"role": "user", "content": [
+        {"type": "text", "text": FOLLOW_UP_PREFIX.format(explanation=question.explanation)},
+        {"type": "image_url", "image_url": {"url": image_url, "detail": "auto"}},
+    ]}]
+    if thread.summary:
+        messages.append({"role": "user", "content": f"【これまでの追加質問と回答の要約】\n{thread.summary}"})
+    recent = (FollowUp.query
+              .filter(FollowUp.thread_id == thread.id, FollowUp.status == "completed",
+                      FollowUp.position > thread.summary_position, FollowUp.position < follow_up.position)
+              .order_by(FollowUp.position)
+              .all())
+    for turn in recent:
+        messages.append({"role": "user", "content": turn.question_text})
+        messages.append({"role": "assistant", "content": turn.answer})
+    messages.append({"role": "user", "content": f"【ユーザーの追加質問】\n「{follow_up.question_text}」"})
+    return messages
+
+
+def roll_summary(thread):
+    """直近 FOLLOWUP_VERBATIM_TURNS 件より古いやりとりを要約に畳み込む (抜粋による要約)"""
+    keep = current_app.config.get("FOLLOWUP_VERBATIM_TURNS", 1)
+    max_chars = current_app.config.get("FOLLOWUP_SUMMARY_MAX_CHARS", 2000)
+    pending = (FollowUp.query
+               .filter(FollowUp.thread_id == thread.id, FollowUp.status == "completed",
+                       FollowUp.position > thread.summary_position)
+               .order_by(FollowUp.position)
+               .all())
+    fold = pending[:len(pending) - keep] if keep else pending
+    if not fold:
+        return
+    lines = [thread.summary] if thread.summary else []
+    for turn in fold:
+        lines.append(f"Q{turn.position}: {_clip(turn.question_text, 200)}\nA{turn.position}: {_clip(turn.answer, 400)}")
+    summary = "\n".join(lines)
+    if len(summary) > max_chars:
+        # 古い方から落とす (行の途中では切らない)
+        summary = summary[-max_chars:]
+        summary = summary[summary.find("\nQ") + 1:] if "\nQ" in summary else summary
+    thread.summary = summary
+    thread.summary_position = fold[-1].position
+
+
+def prepare_requestion(job_id):
+    """DB ステージ: ジョブと元の質問を読み込んでリクエストを組み立てる (ジョブがなければ None)"""
+    job = update_job(job_id, status="processing")
+    if job is None:
+        print(f"ERROR: Re-question job not found: {job_id}")
+        return None
+    question = db.session.get(Question, job["question_id"])
+    if question is None or not question.explanation:
+        raise ValueError("元の質問または解説が見つかりません")
+    image_url = image_url_for_model(question.image_path)
+    follow_up = db.session.get(FollowUp, job["follow_up_id"]) if job.get("follow_up_id") else None
+    if follow_up is not None:
+        messages = build_follow_up_messages(question, follow_up.thread, follow_up, image_url)
+    else:
+        # スレッド導入前に投入されたジョブ
+        messages = [{"role": "user", "content": [
+            {"type": "text", "text": build_requestion_prompt(question.explanation, job["question_text"])},
+            {"type": "image_url", "image_url": {"url": image_url, "detail": "auto"}},
+        ]}]
+    db.session.rollback()
+    return build_requestion_request(messages)
+
+
+def _finish_follow_up(follow_up_id, status, answer):
+    follow_up = db.session.get(FollowUp, follow_up_id)
+    if follow_up is None:
+        return
+    follow_up.status = status
+    follow_up.answer = answer
+    follow_up.answered_at = datetime.utcnow()
+    if status == "completed":
+        db.session.flush()
+        roll_summary(follow_up.thread)
+    db.session.commit()
+
+
+def finish_requestion(job_id, writer, usage=None):
+    answer = writer.text.strip()
+    status = "completed" if answer else "failed"
+    if usage is not None:
+        job = get_job(job_id)
+        question = db.session.get(Question, job["question_id"]) if job else None
+        if question is not None:
+            record_usage(KIND_REQUESTION, usage, question_id=question.id, user_id=job.get("user_id"),
+                         school_id=question.school_id, model=MODEL)
+            db.session.commit()
+    job = update_job(job_id, status=status, answer=answer or None,
+                     error=None if answer else "AIからの回答が空でした")
+    if job and job.get("follow_up_id"):
+        _finish_follow_up(job["follow_up_id"], status, answer or None)
+    writer.finish(status, answer or "AIからの回答が空でした")
+    return {"status": status, "job_id": job_id}
+
+
+def fail_requestion(job_id, exc):
+    """失敗をジョブに記録し、購読中のブラウザに通知する"""
+    message = "再質問の処理中にエラーが発生しました"
+    db.session.rollback()
+    try:
+        job = update_job(job_id, status="failed", error=message)
+        if job and job.get("follow_up_id"):
+            _finish_follow_up(job["follow_up_id"], "failed", None)
+    except Exception as e:
+        print(f"WARNING: Failed to update re-question job {job_id}: {e}")
+    PartialTextWriter(stream_name(job_id)).finish("failed", message)
+    print(f"Error in re_question job {job_id}: {exc}")
+
+
+def run_requestion(job_id):
+    """同期実行: ジョブ読み込み → モデル (ストリーム) → 結果保存"""
+    request = prepare_requestion(job_id)
+    if request is None:
+        return {"status": "failed", "job_id": job_id}
+    with get_breaker(OPENAI).guard(), model_call(request) as call:
+        raw = get_openai_client().chat.completions.with_raw_response.create(**request)
+        call.observe(raw.headers)
+        writer = PartialTextWriter(stream_name(job_id))
+        call.usage = consume_stream(raw.parse(), writer).usage
+    return finish_requestion(job_id, writer, call.usage)
+
+
+async def run_requestion_async(job_id, executor):
+    request = await executor.run_db(prepare_requestion, job_id)
+    if request is None:
+        return {"status": "failed", "job_id": job_id}
+    with get_breaker(OPENAI).guard():
+        async with executor.model_slot(), model_call_async(request) as call:
+            raw = await get_async_openai_client().chat.completions.with_raw_response.create(**request)
+            call.observe(raw.headers)
+            writer = PartialTextWriter(stream_name(job_id))
+            call.usage = (await consume_stream_async(raw.parse(), writer)).usage
+    return await executor.run_db(finish_requestion, job_id, writer, call.usage)
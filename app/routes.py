@@ -1,16 +1,17 @@
 import csv
+import hashlib
 import io
 import os
-import boto3
-from urllib.parse import urlparse
-from openai import OpenAI
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app, make_response, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app, make_response, jsonify, Response, stream_with_context, send_file
 from flask_login import login_required, current_user
-from .models import Question, User, School, ROLE_HQ, ROLE_MANAGER, ROLE_STUDENT
-from .services import QuestionService, AccessControlService
+from sqlalchemy.exc import IntegrityError
+from .models import Question, User, FollowUp, ROLE_HQ, ROLE_MANAGER, ROLE_STUDENT
+from .services import QuestionService, AccessControlService, ExplanationCacheService, FollowUpService
 from .utils import require_roles
 from .audit import log_action
+from .querycount import query_budget
 from . import db
+from .streaming import iter_sse
 
 main_bp = Blueprint("main", __name__)
 
@@ -19,6 +20,7 @@ def index():
     return redirect(url_for("main.list_questions"))
 
 @main_bp.route("/questions")
+@query_budget(6)
 @login_required
 def list_questions():
     # school 切替（権限チェック込み）
@@ -28,21 +30,36 @@ def list_questions():
     # クエリ取得
     q = QuestionService.get_visible_questions(current_user, view_school_id)
 
-    # ページング
-    page = max(int(request.args.get("page", 1)), 1)
+    # ページング (キーセット。after=次へ / before=前へ のカーソル)
+    from .pagination import paginate_keyset, cached_count
     per_page = current_app.config["PAGE_SIZE"]
-    pagination = q.paginate(page=page, per_page=per_page, error_out=False)
+    pagination = paginate_keyset(q, per_page, after=request.args.get("after"), before=request.args.get("before"))
+    if current_user.role == ROLE_STUDENT:
+        count_scope = f"user:{current_user.id}"
+    else:
+        count_scope = f"school:{view_school_id or 'all'}"
+    total = cached_count(q, count_scope)
 
     schools = None
     if current_user.role in (ROLE_MANAGER, ROLE_HQ):
-        schools = School.query.order_by(School.name.asc()).all()
-
+        from .school_directory import get_directory
+        schools = get_directory().schools
+
+    # サムネイルの URL (S3 は presigned URL をプロセス内で使い回すので、ページを開き直してもブラウザのキャッシュが効く)
+    from .thumbnails import thumbnail_url
+    thumbnail_urls = {item.id: thumbnail_url(item) for item in pagination.items}
+
+    response = render_template("questions/list.html",
+                               questions=pagination.items,
+                               thumbnail_urls=thumbnail_urls,
+                               pagination=pagination,
+                               total=total,
+                               schools=schools,
+                               current_school_id=view_school_id)
+    # 監査ログの commit で読み込み済みの行が expire されるので、描画が終わってから記録する
+    # (先に記録すると描画中に行ごとの再読み込みが走る)
     log_action(current_user, "view_questions", target_type="school", target_id=view_school_id)
-    return render_template("questions/list.html",
-                           questions=pagination.items,
-                           pagination=pagination,
-                           schools=schools,
-                           current_school_id=view_school_id)
+    return response
 
 @main_bp.route("/questions/new", methods=["GET","POST"])
 @login_required
@@ -56,30 +73,59 @@ def new_question():
         if not file or file.filename == '':
             flash("画像をアップロードしてください", "warning")
         else:
-            # 画像保存 (S3)
-            from .utils_s3 import upload_file_to_s3
+            image_bytes = file.read()
+            # 保存前に正規化 (向き補正・縮小・再エンコード、メタデータ除去)
+            upload_bytes, upload_name, upload_type = image_bytes, file.filename, file.content_type
+            if current_app.config.get("IMAGE_NORMALIZE_ENABLED", True):
+                from .imaging import normalize_image
+                try:
+                    normalized = normalize_image(image_bytes, current_app.config.get("IMAGE_MAX_EDGE", 2048),
+                                                 current_app.config.get("IMAGE_JPEG_QUALITY", 85))
+                    upload_bytes, upload_type = normalized.data, normalized.content_type
+                    upload_name = f"upload{normalized.extension}"
+                    print(f"DEBUG: [Web] Normalized image {len(image_bytes)} -> {len(upload_bytes)} bytes {normalized.size}")
+                except ValueError as e:
+                    # 開けない形式はそのまま保存する
+                    print(f"WARNING: Image normalization skipped: {e}")
+
+            # 正規化後のバイト列で照合する (メタデータだけ違う同じ写真も同じハッシュになる)
+            content_hash = ExplanationCacheService.content_hash(upload_bytes)
+
+            # 同じ画像・同じ学年の解説が既にあれば、アップロードもAI呼び出しもせず再利用する
+            cached = ExplanationCacheService.lookup(content_hash, grade)
+            if cached is not None:
+                q = Question(
+                    content="[画像による質問]",
+                    user_id=current_user.id,
+                    school_id=current_user.school_id,
+                    image_path=cached.image_path,
+                    grade=grade,
+                    content_hash=content_hash,
+                    explanation=cached.explanation,
+                    explanation_status="completed"
+                )
+                from .thumbnails import copy_thumbnail
+                copy_thumbnail(q)
+                db.session.add(q)
+                db.session.commit()
+                flash("質問を送信しました。同じ問題の解説が見つかりました。", "success")
+                return redirect(url_for("main.new_question"))
+
+            # 今月の予算 (ハード上限) を使い切った校舎は新しい解説生成を受け付けない
+            from .usage import budget_state, BUDGET_HARD
+            if budget_state(current_user.school_id) == BUDGET_HARD:
+                flash("今月のAI解説の利用上限に達したため、新しい質問を受け付けられません。校舎の担当者にお問い合わせください。", "warning")
+                return redirect(url_for("main.new_question"))
+
+            # 画像保存 (image_path には保存先のキーを入れる)
+            from .storage import get_storage
             try:
-                save_path = upload_file_to_s3(file, file.filename, content_type=file.content_type)
+                save_path = get_storage().put(io.BytesIO(upload_bytes), upload_name, content_type=upload_type)
             except Exception as e:
                 flash(f"画像のアップロードに失敗しました: {e}", "danger")
                 return redirect(url_for("main.new_question"))
 
-            q = Question(
-                content="[画像による質問]", # 内容は自動入力
-                user_id=current_user.id, 
-                school_id=current_user.school_id,
-                image_path=save_path,
-                grade=grade,
-                explanation_status="processing"
-            )
-            db.session.add(q)
-            db.session.commit()
-            
-            # 自動解説タスク起動
-            from .tasks import analyze_image_task
-            print(f"DEBUG: [Web] Dispatching task for question_id={q.id}")
-            task = analyze_image_task.delay(q.id)
-            print(f"DEBUG: [Web] Task dispatched. Task ID: {task.id}")
+            _create_image_question(save_path, grade, content_hash)
 
             flash("質問を送信しました。解説が作成されるまでお待ちください。", "success")
             return redirect(url_for("main.new_question"))
@@ -89,7 +135,95 @@ def new_question():
     
     return render_template("questions/new.html", history=history)
 
+def _create_image_question(image_path, grade, content_hash=None, upload_key=None):
+    """画像の質問を作成し、claim 済みの状態で解説タスクを投入する"""
+    q = Question(
+        content="[画像による質問]", # 内容は自動入力
+        user_id=current_user.id,
+        school_id=current_user.school_id,
+        image_path=image_path,
+        upload_key=upload_key,
+        grade=grade,
+        content_hash=content_hash,
+        explanation_status="processing",
+        explanation_generation=1  # 作成と同時に claim 済み
+    )
+    db.session.add(q)
+    db.session.commit()
+
+    # 自動解説タスク起動 (最優先レーン)
+    from .tasks import dispatch_explanation, budget_lane, LANE_INTERACTIVE
+    print(f"DEBUG: [Web] Dispatching task for question_id={q.id}")
+    task = dispatch_explanation(q.id, budget_lane(q.school_id, LANE_INTERACTIVE),
+                                generation=q.explanation_generation)
+    print(f"DEBUG: [Web] Task dispatched. Task ID: {task.id}")
+    return q
+
+
+@main_bp.route("/api/uploads", methods=["POST"])
+@login_required
+@require_roles(ROLE_STUDENT)
+def create_upload():
+    """ブラウザから S3 へ直接アップロードするための presigned POST を返す"""
+    from .uploads import create_upload_policy
+    from .usage import budget_state, BUDGET_HARD
+    from .storage import get_storage, BACKEND_S3
+    if get_storage().name != BACKEND_S3:
+        # フォームからのアップロードを使ってもらう
+        return jsonify({"error": "直接アップロードは使えません"}), 404
+    data = request.get_json(silent=True) or {}
+    if budget_state(current_user.school_id) == BUDGET_HARD:
+        return jsonify({"error": "今月のAI解説の利用上限に達したため、新しい質問を受け付けられません。"}), 429
+    try:
+        policy = create_upload_policy(current_user.id, data.get("content_type"))
+    except ValueError:
+        return jsonify({"error": "対応していない画像形式です"}), 400
+    except Exception as e:
+        print(f"ERROR: Failed to create upload policy: {e}")
+        return jsonify({"error": "アップロードの準備に失敗しました"}), 503
+    policy["confirm_url"] = url_for("main.confirm_upload")
+    return jsonify(policy)
+
+
+@main_bp.route("/api/uploads/confirm", methods=["POST"])
+@login_required
+@require_roles(ROLE_STUDENT)
+def confirm_upload():
+    """直接アップロードの完了通知。質問を作成して解説タスクを投入する"""
+    from .uploads import owns_upload_key, head_upload
+    data = request.get_json(silent=True) or {}
+    key = data.get("key") or ""
+    grade = data.get("grade")
+    if not owns_upload_key(current_user.id, key):
+        return jsonify({"error": "不正なアップロードです"}), 403
+
+    # 再送された通知は同じ質問を返す (取り込み後は image_path が変わり、元の画像も消えているので
+    # アップロードのキーで引く)
+    q = Question.query.filter_by(user_id=current_user.id, upload_key=key).first()
+    if q is None:
+        head = head_upload(key)
+        if head is None:
+            return jsonify({"error": "アップロードされた画像が見つかりません"}), 400
+        if head[0] > current_app.config.get("UPLOAD_MAX_BYTES", 20 * 1024 * 1024):
+            return jsonify({"error": "画像のサイズが大きすぎます"}), 400
+        try:
+            q = _create_image_question(key, grade, upload_key=key)
+            flash("質問を送信しました。解説が作成されるまでお待ちください。", "success")
+        except IntegrityError:
+            # 同時に届いた通知が先に作成した (upload_key は一意)
+            db.session.rollback()
+            q = Question.query.filter_by(user_id=current_user.id, upload_key=key).first_or_404()
+
+    return jsonify({
+        "success": True,
+        "question_id": q.id,
+        "status_url": url_for("main.get_question_status", id=q.id),
+        "stream_url": url_for("main.stream_question", id=q.id),
+    }), 201
+
+
 @main_bp.route("/export/questions.csv")
+@query_budget(4)
 @login_required
 def export_questions_csv():
     requested_school_id = request.args.get("school_id")
@@ -103,15 +237,16 @@ def export_questions_csv():
     writer = csv.writer(output)
     writer.writerow(["id", "content", "user_email", "school_name", "created_at"])
     
-    # N+1対策: joinedloadで関連データを一括取得
-    from sqlalchemy.orm import joinedload
-    questions = q.options(joinedload(Question.user), joinedload(Question.school)).all()
+    # 投稿者は get_visible_questions が JOIN で読み込む。校舎名はプロセス内の校舎一覧から引く
+    from .school_directory import get_directory
+    school_names = get_directory()
+    questions = q.all()
 
     for row in questions:
         writer.writerow([
             row.id, row.content,
             row.user.email if row.user else "",
-            row.school.name if row.school else "",
+            school_names.name(row.school_id, ""),
             row.created_at.isoformat()
         ])
 
@@ -138,12 +273,28 @@ def explain_question(id):
         flash("画像がないため解説できません", "warning")
         return redirect(url_for("main.list_questions"))
 
-    # Celeryタスク起動
-    from .tasks import analyze_image_task
-    analyze_image_task.delay(q.id)
-    
-    q.explanation_status = "processing"
-    db.session.commit()
+    from .usage import budget_state, BUDGET_HARD
+    if budget_state(q.school_id) == BUDGET_HARD:
+        flash("今月のAI解説の利用上限に達しているため、解説を生成できません。", "warning")
+        return redirect(url_for("main.list_questions"))
+
+    # 先に processing へ遷移させてからタスクを投入する。
+    # 連打や再送で同時に来ても claim に成功するのは1回だけ
+    generation = QuestionService.claim_explanation(q.id)
+    if generation is None:
+        flash("この質問の解説は既に作成中です。", "info")
+        return redirect(url_for("main.list_questions"))
+
+    # Celeryタスク起動 (手動再生成レーン)
+    from .tasks import dispatch_explanation, budget_lane, LANE_MANUAL
+    try:
+        dispatch_explanation(q.id, budget_lane(q.school_id, LANE_MANUAL), generation=generation)
+    except Exception as e:
+        # 投入できなければ再度ボタンを押せるよう failed に戻す
+        from .pipeline import record_failure
+        record_failure(q.id, e, generation)
+        flash(f"解説の生成を開始できませんでした: {e}", "danger")
+        return redirect(url_for("main.list_questions"))
     
     flash("AI解説の生成を開始しました。しばらくお待ちください。", "info")
     return redirect(url_for("main.list_questions"))
@@ -152,108 +303,178 @@ def explain_question(id):
 @main_bp.route("/api/re-question", methods=["POST"])
 @login_required
 def re_question():
-    """既存の質問に対する再質問を処理する"""
-    try:
-        data = request.get_json()
-        question_id = data.get('question_id')
-        question_text = data.get('question_text')
-
-        if not question_id or not question_text:
-            return jsonify({"error": "質問IDと追加質問内容が必要です"}), 400
-
-        # Question取得
-        q = Question.query.get(question_id)
-        if not q:
-            return jsonify({"error": "元の質問が見つかりません"}), 404
-
-        # 権限チェック
-        if current_user.role == ROLE_STUDENT and q.user_id != current_user.id:
-            return jsonify({"error": "権限がありません"}), 403
-        if current_user.role == ROLE_MANAGER and q.school_id != current_user.school_id:
-            return jsonify({"error": "権限がありません"}), 403
-
-        if not q.image_path:
-            return jsonify({"error": "元の画像が見つかりません"}), 400
-
-        original_explanation = q.explanation
-        if not original_explanation:
-             return jsonify({"error": "まだ解説が生成されていません"}), 400
-
-        # 画像URL (S3 Presigned URL)
-        # NOTE: tasks.py とロジック重複。共通化すべきだが、まずは移植優先。
-        image_url = q.image_path
-        try:
-            parsed = urlparse(image_url)
-            s3_key = parsed.path.lstrip('/')
-            
-            s3_client = boto3.client(
-                "s3",
-                aws_access_key_id=current_app.config.get("AWS_ACCESS_KEY_ID"),
-                aws_secret_access_key=current_app.config.get("AWS_SECRET_ACCESS_KEY"),
-                region_name=current_app.config.get("AWS_REGION")
-            )
-
-            presigned_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': current_app.config.get("AWS_S3_BUCKET_NAME"),
-                    'Key': s3_key
-                },
-                ExpiresIn=300
-            )
-            image_url = presigned_url
-        except Exception as e:
-            print(f"WARNING: Failed to generate presigned URL: {e}")
-            # エラー時は元のURLを使用し、エラーは返さない(OpenAI側で失敗する可能性はある)
-
-        # Prompt
-        prompt = f"""
-        ユーザーは以前、画像（添付）で質問をし、以下の解説を受け取りました。
-
-        【以前の解説】
-        ---
-        {original_explanation}
-        ---
-
-        この解説と元の画像を踏まえて、ユーザーから以下の追加質問がありました。
-        この質問に対して、分かりやすく、丁寧に追加の解説をしてください。
-
-        【ユーザーの追加質問】
-        「{question_text}」
-
-        【指示】
-        - 元の画像と以前の解説内容を考慮して回答してください。
-        - 重要な数式は $$...$$ を使って表現してください。
-        """
-
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-        gpt_response = client.chat.completions.create(
-            model="gpt-5.2",
-            messages=[
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {
-                        "url": image_url,
-                        "detail": "auto"
-                    }}
-                ]}
-            ],
-            max_completion_tokens=3000,
-            temperature=0.7,
-            timeout=60
-        )
-
-        answer_text = gpt_response.choices[0].message.content.strip()
-        
-        # ログ記録
-        log_action(current_user, "re_question", target_type="question", target_id=q.id)
+    """既存の質問に対する再質問を受け付ける (回答はワーカーが生成し、ジョブ ID を返す)"""
+    data = request.get_json(silent=True) or {}
+    question_id = data.get('question_id')
+    question_text = (data.get('question_text') or "").strip()
+
+    if not question_id or not question_text:
+        return jsonify({"error": "質問IDと追加質問内容が必要です"}), 400
+
+    # Question取得
+    q = Question.query.get(question_id)
+    if not q:
+        return jsonify({"error": "元の質問が見つかりません"}), 404
 
-        return jsonify({"success": True, "answer": answer_text})
+    # 権限チェック
+    if current_user.role == ROLE_STUDENT and q.user_id != current_user.id:
+        return jsonify({"error": "権限がありません"}), 403
+    if current_user.role == ROLE_MANAGER and q.school_id != current_user.school_id:
+        return jsonify({"error": "権限がありません"}), 403
 
+    if not q.image_path:
+        return jsonify({"error": "元の画像が見つかりません"}), 400
+
+    if not q.explanation:
+        return jsonify({"error": "まだ解説が生成されていません"}), 400
+
+    from .requestion import create_job, get_job, new_job_id
+    from .tasks import dispatch_requestion, budget_lane, LANE_INTERACTIVE
+    from .usage import budget_state, BUDGET_HARD
+
+    # 同じ追加質問には保存済みの回答を返す (処理中なら同じジョブを待ってもらう)
+    thread = FollowUpService.get_thread(q.id, create=True)
+    text_hash = FollowUpService.text_hash(question_text)
+    same = FollowUpService.find_same(thread.id, text_hash)
+    if same is not None and same.status == "completed":
+        db.session.commit()
+        log_action(current_user, "re_question", target_type="question", target_id=q.id)
+        return jsonify({"success": True, "cached": True, "answer": same.answer, "follow_up_id": same.id})
+    job_id = same.job_id if same is not None else None
+    if job_id is None and budget_state(q.school_id) == BUDGET_HARD:
+        db.session.commit()
+        return jsonify({"error": "今月のAI解説の利用上限に達しています"}), 429
+    try:
+        if job_id is None or get_job(job_id) is None:
+            if same is not None:
+                # ジョブが期限切れ (ワーカー停止など) の処理中のものは打ち切る
+                same.status = "failed"
+            job_id = new_job_id()
+            follow_up = FollowUpService.add(thread, current_user.id, question_text, text_hash, job_id)
+            db.session.commit()
+            create_job(q.id, current_user.id, question_text, follow_up_id=follow_up.id, job_id=job_id)
+            dispatch_requestion(job_id, budget_lane(q.school_id, LANE_INTERACTIVE))
     except Exception as e:
         print(f"Error in re_question: {str(e)}")
-        return jsonify({"error": "再質問の処理中にエラーが発生しました"}), 500
+        db.session.rollback()
+        FollowUp.query.filter_by(job_id=job_id, status="processing").update({"status": "failed"})
+        db.session.commit()
+        return jsonify({"error": "再質問の処理中にエラーが発生しました"}), 503
+
+    # ログ記録
+    log_action(current_user, "re_question", target_type="question", target_id=q.id)
+
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status_url": url_for("main.re_question_status", job_id=job_id),
+        "stream_url": url_for("main.re_question_stream", job_id=job_id),
+    }), 202
+
+
+def _load_requestion_job(job_id):
+    """ジョブを取得する (本人のジョブ以外は None)"""
+    from .requestion import get_job
+    job = get_job(job_id)
+    if job is None or job["user_id"] != current_user.id:
+        return None
+    return job
+
+
+@main_bp.route("/api/re-question/<job_id>")
+@login_required
+def re_question_status(job_id):
+    job = _load_requestion_job(job_id)
+    if job is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({"status": job["status"], "answer": job["answer"], "error": job["error"], "job_id": job_id})
+
+
+@main_bp.route("/api/re-question/<job_id>/stream")
+@login_required
+def re_question_stream(job_id):
+    """再質問の回答を Server-Sent Events で配信する"""
+    from .requestion import get_job, stream_name
+    if _load_requestion_job(job_id) is None:
+        return jsonify({"error": "Not found"}), 404
+    db.session.close()
+
+    def check_done():
+        job = get_job(job_id)
+        if job is None:
+            return ("failed", "再質問の有効期限が切れました")
+        if job["status"] in ("completed", "failed"):
+            return (job["status"], job["answer"] or job["error"])
+        return None
+
+    response = Response(stream_with_context(iter_sse(stream_name(job_id), check_done)),
+                        mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@main_bp.route("/api/questions/<int:id>/follow-ups")
+@login_required
+def list_follow_ups(id):
+    """質問の再質問スレッド (回答済みのもの) を返す"""
+    q = Question.query.get_or_404(id)
+    if not AccessControlService.can_view_question(current_user, q):
+        return jsonify({"error": "Forbidden"}), 403
+    thread = FollowUpService.get_thread(q.id)
+    items = []
+    if thread is not None:
+        items = [{"id": f.id, "position": f.position, "question": f.question_text, "answer": f.answer,
+                  "created_at": f.created_at.isoformat()}
+                 for f in thread.follow_ups if f.status == "completed"]
+    return jsonify({"question_id": q.id, "follow_ups": items})
+
+
+@main_bp.route("/media/<path:key>")
+@login_required
+def media(key):
+    """ローカル保存の画像を返す (Range 対応。ファイルは wsgi.file_wrapper / X-Sendfile で送る)"""
+    from .storage import get_storage, BACKEND_LOCAL
+    storage = get_storage()
+    if storage.name != BACKEND_LOCAL:
+        abort(404)
+    # 同じ画像を共有する質問のうち、1件でも閲覧できれば返す
+    questions = Question.query.filter((Question.image_path == key) | (Question.thumbnail_path == key)).all()
+    if not any(AccessControlService.can_view_question(current_user, q) for q in questions):
+        abort(404)
+    try:
+        path = storage.path(key)
+    except ValueError:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+    # 内容アドレスなので同じキーの中身は変わらない
+    response = send_file(path, conditional=True, max_age=365 * 24 * 3600)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+@main_bp.route("/questions/<int:id>/image")
+@login_required
+def question_image(id):
+    """原寸画像へリダイレクトする (一覧のモーダルを開いた時だけ読み込む)"""
+    q = Question.query.get_or_404(id)
+    if not AccessControlService.can_view_question(current_user, q) or not q.image_path:
+        abort(404)
+    from .thumbnails import image_url, IMAGE_REDIRECT_MARGIN
+    expires = current_app.config.get("IMAGE_URL_EXPIRES", 300)
+    url, remaining = image_url(q, expires)
+    response = redirect(url)
+    # presigned URL の期限より長くリダイレクトを覚えさせない。
+    # キャッシュから返した URL は期限が短くなっているので、残りの秒数から余裕を引いた値を上限にする
+    max_age = expires // 2
+    if remaining is not None:
+        max_age = min(max_age, remaining - IMAGE_REDIRECT_MARGIN)
+    response.cache_control.private = True
+    response.cache_control.max_age = max(0, max_age)
+    return response
 
 
 @main_bp.route("/api/questions/<int:id>/status")
@@ -273,3 +494,50 @@ def get_question_status(id):
         "id": q.id
     })
 
+
+
+@main_bp.route("/questions/<int:id>/explanation")
+@query_budget(3)
+@login_required
+def question_explanation(id):
+    """一覧のモーダルに表示する解説本文 (HTML 断片)。モーダルを開いた時にだけ読み込まれる"""
+    q = Question.query.get_or_404(id)
+    if not AccessControlService.can_view_question(current_user, q):
+        abort(404)
+
+    response = make_response(render_template("questions/_explanation.html", q=q))
+    # 再生成で内容が変わるので、短時間だけキャッシュし以降は ETag で再検証する
+    response.set_etag(hashlib.sha1(f"{q.explanation_status}:{q.explanation or ''}".encode()).hexdigest())
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config.get("EXPLANATION_FRAGMENT_MAX_AGE", 60)
+    return response.make_conditional(request)
+
+
+@main_bp.route("/api/questions/<int:id>/stream")
+@login_required
+def stream_question(id):
+    """生成途中の解説を Server-Sent Events で配信する"""
+    q = Question.query.get_or_404(id)
+
+    # 権限チェック
+    if current_user.role == ROLE_STUDENT and q.user_id != current_user.id:
+        return jsonify({"error": "Forbidden"}), 403
+    if current_user.role == ROLE_MANAGER and q.school_id != current_user.school_id:
+        return jsonify({"error": "Forbidden"}), 403
+
+    question_id = q.id
+    # ストリーム中はDB接続を保持しない
+    db.session.close()
+
+    def check_done():
+        row = db.session.query(Question.explanation_status, Question.explanation).filter_by(id=question_id).first()
+        db.session.close()
+        if row is None or row[0] in ("completed", "failed"):
+            return (row[0] if row else "failed", row[1] if row else None)
+        return None
+
+    response = Response(stream_with_context(iter_sse(f"question:{question_id}", check_done)),
+                        mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
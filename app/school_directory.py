@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+from . import metrics
+from .clients import get_redis
+
+# 校舎の一覧 (id -> 名前、名前順の一覧) のプロセス内キャッシュ。
+# 一覧・CSV・登録画面・管理画面のたびに schools を読んでいたが、変わるのは本部が校舎を追加したときだけ。
+# 各ワーカーは Redis のバージョン番号 (school_directory:version) を
+# SCHOOL_DIRECTORY_CHECK_SECONDS 秒ごとに確認し、変わっていれば DB から読み直す。
+# 校舎を追加・変更したら invalidate() でバージョンを上げる (他のワーカーは次の確認で読み直す)。
+
+VERSION_KEY = "school_directory:version"
+
+SchoolEntry = namedtuple("SchoolEntry", ["id", "name", "created_at"])
+
+
+class SchoolDirectory:
+    """ある時点の校舎一覧 (作成後は変更しない。ワーカー内のスレッドで共有する)"""
+
+    def __init__(self, entries, version=None):
+        self.version = version
+        # 画面の選択肢は名前順
+        self.schools = sorted(entries, key=lambda s: (s.name, s.id))
+        self.names = {s.id: s.name for s in entries}
+
+    def name(self, school_id, default="-"):
+        return self.names.get(school_id, default)
+
+    def by_id(self):
+        return sorted(self.schools, key=lambda s: s.id)
+
+
+_lock = threading.Lock()
+_directory = None
+_checked_at = 0.0
+
+
+def _remote_version():
+    """共有のバージョン番号 (未設定は 0)。Redis に繋がらなければ None"""
+    try:
+        value = get_redis().get(VERSION_KEY)
+    except Exception as e:
+        print(f"WARNING: school directory version unavailable: {e}")
+        return None
+    return int(value) if value is not None else 0
+
+
+def _load(version):
+    from .models import School
+    from . import db
+    rows = db.session.query(School.id, School.name, School.created_at).all()
+    print(f"DEBUG: school directory loaded ({len(rows)} schools, version {version})")
+    return SchoolDirectory([SchoolEntry(*row) for row in rows], version)
+
+
+def get_directory():
+    """校舎一覧を返す (必要なら DB から読み直す)"""
+    global _directory, _checked_at
+    directory = _directory
+    now = time.monotonic()
+    interval = current_app.config.get("SCHOOL_DIRECTORY_CHECK_SECONDS", 5)
+    if directory is not None and now - _checked_at < interval:
+        return directory
+
+    # バージョンは DB より先に読む。読み込み中に校舎が追加されても、
+    # invalidate() はその commit の後なので次の確認で食い違いに気づける
+    version = _remote_version()
+    # Redis が使えないときは確認のたびに読み直す (古い一覧を出し続けない)
+    if directory is None or version is None or version != directory.version:
+        directory = _load(version)
+        metrics.incr("school_directory:reload")
+    with _lock:
+        _directory = directory
+        _checked_at = now
+    return directory
+
+
+def invalidate():
+    """校舎の追加・変更の commit 後に呼ぶ (このワーカーは即座に、他のワーカーは次の確認で読み直す)"""
+    reset_directory()
+    try:
+        get_redis().incr(VERSION_KEY)
+    except Exception as e:
+        print(f"WARNING: school directory invalidation not shared: {e}")
+
+
+def reset_directory():
+    global _directory, _checked_at
+    with _lock:
+        _directory = None
+        _checked_at = 0.0
+
+
+def school_name(school_id, default="-"):
+    """テンプレート用: 校舎 id から名前を引く (q.school.name の遅延ロードの代わり)"""
+    if school_id is None:
+        return default
+    return get_directory().name(school_id, default)
+
+
+def init_app(app):
+    app.jinja_env.globals["school_name"] = school_name
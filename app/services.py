@@ -1,5 +1,13 @@
-from .models import Question, School, ROLE_STUDENT, ROLE_MANAGER, ROLE_HQ
+import hashlib
+import re
+import unicodedata
+from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import defer, joinedload
+from sqlalchemy.exc import IntegrityError
+from .models import Question, School, ExplanationCache, FollowUp, FollowUpThread, ROLE_STUDENT, ROLE_MANAGER, ROLE_HQ
 from flask import current_app, abort
+from . import db, metrics
 
 class QuestionService:
     @staticmethod
@@ -27,7 +35,52 @@ class QuestionService:
             # 未定義のロール
             abort(403)
             
-        return q.order_by(Question.created_at.desc())
+        # 一覧・CSV は行ごとに投稿者を表示するので、同じ SELECT で読み込む (N+1 対策)。
+        # 校舎名はプロセス内の校舎一覧 (app/school_directory.py) から引くので JOIN しない。
+        # INNER JOIN にすると SQLite が結合順を入れ替えて users から読み始め、
+        # (created_at, id) のインデックスを使わずに全件を並べ替えることがあるので LEFT OUTER JOIN のままにする
+        # (questions が先に固定され、LIMIT の分だけインデックスを逆順に読めば済む)
+        q = q.options(joinedload(Question.user),
+                      # 解説本文 (最大数千トークン) は一覧に出さない。モーダルを開いた時に別途読み込む
+                      defer(Question.explanation))
+        # id は同時刻の投稿の順序を固定する (キーセットページングのカーソルに使う)
+        return q.order_by(Question.created_at.desc(), Question.id.desc())
+
+    # 解説生成を開始できる状態 (None は status 導入前の古い行)
+    CLAIMABLE_STATUSES = ("pending", "failed")
+
+    @staticmethod
+    def claim_explanation(question_id, statuses=None, generation=None, lease_seconds=None):
+        """
+        解説生成の実行権を取得する。
+        pending / failed の質問だけを条件付き UPDATE で processing にし、世代番号を1つ進める。
+        同時に複数回呼ばれても成功するのは1回だけ。取得できなければ None を返す。
+        一括再処理では statuses / generation を指定し、読み取り時点から変わっていない行だけを取り直す。
+        processing の行を取り直すときは lease_seconds も指定し、読み取り後にタスクが処理を始めた
+        (ハートビートで updated_at が進んだ) 行は取らない。
+        """
+        if statuses is None:
+            claimable = or_(Question.explanation_status.in_(QuestionService.CLAIMABLE_STATUSES),
+                            Question.explanation_status.is_(None))
+        else:
+            claimable = Question.explanation_status.in_(statuses)
+        if generation is not None:
+            claimable = and_(claimable, Question.explanation_generation == generation)
+        if lease_seconds is not None:
+            from .reaper import lease_expired
+            claimable = and_(claimable, lease_expired(lease_seconds))
+        updated = (Question.query
+                   .filter(Question.id == question_id, claimable)
+                   .update({Question.explanation_status: "processing",
+                            Question.explanation_generation: Question.explanation_generation + 1,
+                            Question.updated_at: datetime.utcnow()},
+                           synchronize_session=False))
+        if not updated:
+            db.session.rollback()
+            return None
+        generation = db.session.query(Question.explanation_generation).filter(Question.id == question_id).scalar()
+        db.session.commit()
+        return generation
 
 class AccessControlService:
     @staticmethod
@@ -62,3 +115,109 @@ class AccessControlService:
         if user.role == ROLE_STUDENT:
             return question.user_id == user.id
         return False
+
+
+class ExplanationCacheService:
+    """同一画像の解説キャッシュ (content hash + grade → explanation)"""
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def lookup(content_hash, grade):
+        """キャッシュを引き、ヒット時はヒット数を加算してエントリを返す"""
+        if not current_app.config.get("EXPLANATION_CACHE_ENABLED", True):
+            return None
+        entry = ExplanationCache.query.filter_by(content_hash=content_hash, grade=grade or "").first()
+        if entry is None:
+            metrics.incr("explanation_cache:miss")
+            return None
+        # 同時ヒットで数え漏れしないよう UPDATE で加算する
+        ExplanationCache.query.filter_by(id=entry.id).update({
+            ExplanationCache.hit_count: ExplanationCache.hit_count + 1,
+            ExplanationCache.last_hit_at: datetime.utcnow(),
+        }, synchronize_session=False)
+        metrics.incr("explanation_cache:hit")
+        return entry
+
+    @staticmethod
+    def store(question):
+        """完了した質問の解説をキャッシュに登録する (既に登録済みなら何もしない)"""
+        if not question.content_hash or not question.explanation:
+            return
+        if not current_app.config.get("EXPLANATION_CACHE_ENABLED", True):
+            return
+        entry = ExplanationCache(content_hash=question.content_hash, grade=question.grade or "",
+                                 explanation=question.explanation, image_path=question.image_path,
+                                 source_question_id=question.id)
+        try:
+            with db.session.begin_nested():
+                db.session.add(entry)
+        except IntegrityError:
+            # 同じ画像を別ワーカーが先に登録した
+            pass
+
+    @staticmethod
+    def stats():
+        counters = metrics.get_counters("explanation_cache:hit", "explanation_cache:miss")
+        return {
+            "hits": counters["explanation_cache:hit"],
+            "misses": counters["explanation_cache:miss"],
+            "entries": ExplanationCache.query.count(),
+        }
+
+
+class FollowUpService:
+    """再質問スレッドの保存と、同一の追加質問の再利用"""
+
+    @staticmethod
+    def text_hash(text):
+        """表記ゆれ (全角半角・空白・末尾の記号) を吸収した質問文のハッシュ"""
+        normalized = unicodedata.normalize("NFKC", text).strip().lower()
+        normalized = re.sub(r"\s+", " ", normalized)
+        normalized = normalized.rstrip("?!.。、 ")
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_thread(question_id, create=False):
+        thread = FollowUpThread.query.filter_by(question_id=question_id).first()
+        if thread is None and create:
+            thread = FollowUpThread(question_id=question_id)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(thread)
+            except IntegrityError:
+                # 同時に作成された
+                thread = FollowUpThread.query.filter_by(question_id=question_id).first()
+        return thread
+
+    @staticmethod
+    def find_same(thread_id, text_hash):
+        """同じ追加質問の回答済み (なければ処理中) のものを返す"""
+        candidates = (FollowUp.query
+                      .filter(FollowUp.thread_id == thread_id, FollowUp.text_hash == text_hash,
+                              FollowUp.status.in_(("completed", "processing")))
+                      .order_by(FollowUp.position.desc())
+                      .all())
+        completed = [f for f in candidates if f.status == "completed"]
+        if completed:
+            metrics.incr("follow_up:reused")
+            return completed[0]
+        return candidates[0] if candidates else None
+
+    @staticmethod
+    def add(thread, user_id, question_text, text_hash, job_id):
+        """スレッドの末尾に追加する (position の衝突時は取り直す)"""
+        for _ in range(3):
+            position = (db.session.query(db.func.max(FollowUp.position))
+                        .filter(FollowUp.thread_id == thread.id).scalar() or 0) + 1
+            follow_up = FollowUp(thread_id=thread.id, position=position, user_id=user_id,
+                                 question_text=question_text, text_hash=text_hash, job_id=job_id)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(follow_up)
+                return follow_up
+            except IntegrityError:
+                continue
+        raise RuntimeError("could not allocate follow-up position")
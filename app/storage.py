@@ -0,0 +1,154 @@
+import hashlib
+import os
+import tempfile
+import threading
+from flask import current_app
+from . import metrics
+
+# 画像の保存先 (STORAGE_BACKEND)。
+#   s3    : S3 (または S3_ENDPOINT_URL の S3 互換ストレージ)。app/utils_s3.py を使う
+#   local : ローカルディスク。内容のハッシュをキーにするので同じ画像は1回しか保存しない
+# Question.image_path には保存先に依存しないキー (例 "ab/cd/abcd....jpg") を入れる。
+# 以前の行に残っている S3 の URL は storage_key() でキーに読み替える。
+
+BACKEND_S3 = "s3"
+BACKEND_LOCAL = "local"
+
+
+def storage_key(image_path):
+    """image_path (キー、または以前の形式の S3 URL) から保存先のキーを取り出す"""
+    if image_path and "://" in image_path:
+        from .utils_s3 import s3_key_from_url
+        return s3_key_from_url(image_path)
+    return image_path
+
+
+class S3Storage:
+    name = BACKEND_S3
+    # モデルのプロバイダが presigned URL で直接取りに行ける
+    remote_fetchable = True
+
+    def put(self, file_obj, filename, content_type=None, cache_control=None):
+        from . import utils_s3
+        kwargs = {"cache_control": cache_control} if cache_control else {}
+        return storage_key(utils_s3.upload_file_to_s3(file_obj, filename, content_type=content_type, **kwargs))
+
+    def get(self, key):
+        from .utils_s3 import download_file_from_s3
+        return download_file_from_s3(key)
+
+    def delete(self, key):
+        from .clients import get_s3_client
+        get_s3_client().delete_object(Bucket=current_app.config["AWS_S3_BUCKET_NAME"], Key=key)
+
+    def image_url(self, key, expires=300):
+        from .utils_s3 import presigned_image_url, public_url
+        return presigned_image_url(public_url(key), expires)
+
+    def browser_url(self, key, expires=300):
+        """ブラウザに渡す URL (presigned GET。キャッシュにより期限の手前までは同じ URL を返す)"""
+        from .utils_s3 import presigned_get_url
+        return presigned_get_url(key, expires)
+
+    def browser_url_with_remaining(self, key, expires=300):
+        """(URL, 残りの有効秒数)"""
+        from .utils_s3 import presigned_get_url_with_remaining
+        return presigned_get_url_with_remaining(key, expires)
+
+
+class LocalStorage:
+    """ハッシュの先頭でディレクトリを分けた内容アドレスのファイルストア (root/ab/cd/<sha256><ext>)"""
+    name = BACKEND_LOCAL
+    # プロバイダからは見えないので、画像は base64 でリクエストに入れる
+    remote_fetchable = False
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"invalid storage key: {key}")
+        return path
+
+    def put(self, file_obj, filename, content_type=None, cache_control=None):
+        # cache_control は /media の応答で付ける (内容アドレスなので常に長期キャッシュ可)
+        data = file_obj.read()
+        digest = hashlib.sha256(data).hexdigest()
+        ext = os.path.splitext(filename)[1].lower()
+        key = f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+        path = self.path(key)
+        if os.path.exists(path):
+            metrics.incr("storage:dedup")
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 同時に同じ画像を書いても壊れないよう、一時ファイルに書いてから置き換える
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return key
+
+    def get(self, key):
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def delete(self, key):
+        # 内容アドレスなので他の質問と共有している可能性がある。参照が残っていれば消さない
+        from .models import Question
+        if Question.query.filter((Question.image_path == key) | (Question.thumbnail_path == key)).first() is not None:
+            return
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def image_url(self, key, expires=300):
+        from .imaging import to_data_url
+        return to_data_url(self.get(key))
+
+    def browser_url(self, key, expires=300):
+        from flask import url_for
+        return url_for("main.media", key=key)
+
+    def browser_url_with_remaining(self, key, expires=300):
+        # /media の URL は期限切れにならない
+        return self.browser_url(key, expires), None
+
+
+_lock = threading.Lock()
+_storage = None
+
+
+def get_storage():
+    """プロセス共有の保存先を返す"""
+    global _storage
+    if _storage is None:
+        config = current_app.config
+        with _lock:
+            if _storage is None:
+                backend = config.get("STORAGE_BACKEND", BACKEND_S3)
+                if backend == BACKEND_LOCAL:
+                    root = config.get("LOCAL_STORAGE_ROOT") or os.path.join(current_app.instance_path, "blobs")
+                    _storage = LocalStorage(root)
+                elif backend == BACKEND_S3:
+                    _storage = S3Storage()
+                else:
+                    raise ValueError(f"unknown STORAGE_BACKEND: {backend}")
+    return _storage
+
+
+def reset_storage():
+    global _storage
+    with _lock:
+        _storage = None
+
+
+def image_url_for_model(image_path, expires=300):
+    """モデルに渡す画像の URL (S3 は presigned URL、ローカルは data URL)"""
+    return get_storage().image_url(storage_key(image_path), expires)
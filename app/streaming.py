@@ -0,0 +1,125 @@
+import json
+import time
+from flask import current_app
+from .clients import get_redis
+
+# 生成途中テキストの配信。
+# ワーカーはトークンを受け取るたびに Redis へ差分を PUBLISH し、途中経過全体も
+# キーに保存する。SSE エンドポイントは購読開始後にキーのスナップショットを送り、
+# 以降は差分 (offset 付き) を中継する。確定したテキストだけを DB に書き込む。
+
+PARTIAL_TTL = 900
+
+
+def partial_key(name):
+    return f"stream:partial:{name}"
+
+
+def channel_name(name):
+    return f"stream:channel:{name}"
+
+
+class PartialTextWriter:
+    """生成途中のテキストを一定間隔で Redis に書き出す"""
+
+    def __init__(self, name, min_interval=0.25):
+        self.name = name
+        self.min_interval = min_interval
+        self.text = ""
+        self._published = 0
+        self._last_flush = 0.0
+        try:
+            self._redis = get_redis()
+        except Exception as e:
+            current_app.logger.warning(f"streaming disabled for {name}: {e}")
+            self._redis = None
+
+    def append(self, delta):
+        if not delta:
+            return
+        self.text += delta
+        if time.monotonic() - self._last_flush >= self.min_interval:
+            self.flush()
+
+    def flush(self):
+        if self._redis is None or self._published == len(self.text):
+            return
+        delta = self.text[self._published:]
+        message = json.dumps({"type": "partial", "offset": self._published, "delta": delta}, ensure_ascii=False)
+        try:
+            pipe = self._redis.pipeline()
+            pipe.set(partial_key(self.name), self.text, ex=PARTIAL_TTL)
+            pipe.publish(channel_name(self.name), message)
+            pipe.execute()
+            self._published = len(self.text)
+        except Exception as e:
+            # Redis 障害時は以降の配信をやめ、生成自体は続ける
+            current_app.logger.warning(f"streaming flush failed for {self.name}: {e}")
+            self._redis = None
+        self._last_flush = time.monotonic()
+
+    def finish(self, status, text=None):
+        """確定を通知する。途中経過のキーは削除する"""
+        self.flush()
+        if self._redis is None:
+            return
+        message = json.dumps({"type": "done", "status": status, "text": text if text is not None else self.text},
+                             ensure_ascii=False)
+        try:
+            pipe = self._redis.pipeline()
+            pipe.delete(partial_key(self.name))
+            pipe.publish(channel_name(self.name), message)
+            pipe.execute()
+        except Exception as e:
+            current_app.logger.warning(f"streaming finish failed for {self.name}: {e}")
+
+
+def sse_event(data):
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def iter_sse(name, check_done, max_seconds=None, heartbeat=15.0):
+    """SSE 用のイベント列を生成する。
+
+    check_done() は DB 上で確定済みなら (status, text) を、未確定なら None を返す。
+    ワーカーが落ちて done が届かない場合に備え、一定間隔で確認する。
+    接続は max_seconds で打ち切る (ブラウザは timeout を受けて再接続し、スナップショットから続きを受け取る)。
+    """
+    max_seconds = max_seconds or current_app.config.get("SSE_MAX_SECONDS", 5)
+    redis_client = get_redis()
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel_name(name))
+    try:
+        # 購読開始後にスナップショットを取るので、その間の差分は offset で重複排除できる
+        snapshot = redis_client.get(partial_key(name))
+        if snapshot:
+            yield sse_event({"type": "partial", "offset": 0, "delta": snapshot.decode("utf-8")})
+        done = check_done()
+        if done is not None:
+            yield sse_event({"type": "done", "status": done[0], "text": done[1]})
+            return
+
+        deadline = time.monotonic() + max_seconds
+        last_sent = time.monotonic()
+        last_check = time.monotonic()
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=1.0)
+            if message and message["type"] == "message":
+                data = json.loads(message["data"])
+                yield sse_event(data)
+                last_sent = time.monotonic()
+                if data["type"] == "done":
+                    return
+            elif time.monotonic() - last_check >= 5.0:
+                last_check = time.monotonic()
+                done = check_done()
+                if done is not None:
+                    yield sse_event({"type": "done", "status": done[0], "text": done[1]})
+                    return
+            if time.monotonic() - last_sent >= heartbeat:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+        # web のスレッドを長時間占有しないよう打ち切る (ブラウザ側は再接続する)
+        yield sse_event({"type": "timeout"})
+    finally:
+        pubsub.close()
@@ -1,191 +1,150 @@
-import os
-import json
-import base64
-from datetime import datetime
-from celery import Celery
-from openai import OpenAI
-import boto3
-from urllib.parse import urlparse
-from . import db, create_app
-from .models import Question
-
-# Celeryインスタンスは __init__.py で作成されるが、
-# ここではタスク定義のために必要。循環参照を避けるため、
-# make_celery パターンを使うか、あるいはここで定義するか。
-# 今回はシンプルに、app/__init__.py で作成された celery をインポートする形をとるが、
-# 循環参照になるため、タスク定義はここで行い、__init__.py からインポートさせる。
-
-# しかし、Celeryのベストプラクティスとして、タスクは独立させるのが良い。
-# ここでは shared_task を使う。
-from datetime import datetime
-from openai import OpenAI
-from . import db, create_app, celery
-from .models import Question
+import time
+import traceback
+from flask import current_app
+from . import celery, metrics
+from .aio import get_executor
+from .pipeline import (run_explanation, run_explanation_async, record_failure, extend_lease,
+                       PERMANENT_FAILURE_MESSAGE, RETRY_EXHAUSTED_MESSAGE)
+from .requestion import run_requestion, run_requestion_async, fail_requestion
+from .worker import task_app_context
+from .timing import StageTimer
+from .usage import budget_state, BUDGET_OK
+from .breaker import get_breaker, classify, retry_countdown, CircuitOpenError, OPENAI, OPEN, PERMANENT
 
 # Explicitly use the configured celery instance
 # @shared_task was falling back to unconfigured default (AMQP)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Flask アプリと API クライアントはワーカープロセスごとに一度だけ作成する (app/worker.py)。
+# 処理本体は app/pipeline.py。
+
+# 優先度レーン。ワーカーは -Q で上から順に (strict priority) 取り出す。
+LANE_INTERACTIVE = "interactive"  # 生徒のアップロード直後
+LANE_MANUAL = "manual"            # 「解説を生成」による手動再生成
+LANE_BACKFILL = "backfill"        # リトライ・一括再処理
+LANES = (LANE_INTERACTIVE, LANE_MANUAL, LANE_BACKFILL)
+LANE_QUEUES = {lane: f"explain.{lane}" for lane in LANES}
+
+
+def budget_lane(school_id, lane):
+    """月間予算のソフト上限を超えた学校のリクエストは backfill レーンに回す"""
+    if lane != LANE_BACKFILL and budget_state(school_id) != BUDGET_OK:
+        metrics.incr("budget:demoted")
+        return LANE_BACKFILL
+    return lane
+
+
+def dispatch_explanation(question_id, lane=LANE_INTERACTIVE, countdown=None, generation=None):
+    """解説生成タスクを指定レーンのキューに投入する。
+
+    generation は QuestionService.claim_explanation で取得した世代番号。
+    """
+    return analyze_image_task.apply_async(
+        args=[question_id],
+        kwargs={"lane": lane, "enqueued_at": time.time() + (countdown or 0), "generation": generation},
+        queue=LANE_QUEUES[lane],
+        countdown=countdown,
+    )
+
 
 @celery.task(bind=True, max_retries=3, name='app.tasks.analyze_image_task')
-def analyze_image_task(self, question_id):
+def analyze_image_task(self, question_id, lane=LANE_INTERACTIVE, enqueued_at=None, generation=None):
     """
     画像解析タスク
     """
-    # アプリケーションコンテキストが必要（DBアクセス用）
-    # Flask-Celery-Helper等を使っていない場合は手動でpushが必要な場合があるが、
-    # Flask 2.x/3.x + Celery 5.x の標準的な統合では自動で扱えることが多い。
-    # 念のため明示的に書くなら:
-    # with app.app_context(): ...
-    
-    # ここでは循環参照を避けるため、タスク内で app を import するか、
-    # あるいは create_app() を呼ぶかだが、
-    # 実行時には current_app が使えるはず... いや、Workerプロセスは別なので
-    # アプリコンテキストを作る必要がある。
-    
-    from app import create_app
-    app = create_app()
-    
-    with app.app_context():
+    # アプリ・DBエンジン・クライアントはワーカープロセスで共有し、
+    # ここではタスク用のアプリコンテキストを push するだけにする。
+    with task_app_context():
+        timer = StageTimer()
+        if enqueued_at is not None:
+            # キュー待ち時間 (投入 → 実行開始) をレーン別に記録
+            queue_wait = max(0.0, time.time() - enqueued_at)
+            metrics.observe(f"queue_wait:{lane}", queue_wait)
+            timer.record("queue_wait", queue_wait)
+        run = {"status": None, "error": None}
         try:
-            print(f"DEBUG: Starting task for question_id={question_id}")
-            question = Question.query.get(question_id)
-            if not question:
-                print("ERROR: Question not found")
-                return {"status": "failed", "error": "Question not found"}
-            
-            if not question.image_path:
-                print("ERROR: Image path not found")
-                return {"status": "failed", "error": "Image path not found"}
-
-            question.explanation_status = "processing"
-            db.session.commit()
-
-            # 画像URL (S3)
-            original_url = question.image_path
-            print(f"DEBUG: Original URL: {original_url}")
-
-            # Presigned URLの発行 (非公開バケット対応)
-            try:
-                # URLからキーを抽出 (https://bucket.s3.region.amazonaws.com/KEY)
-                parsed = urlparse(original_url)
-                s3_key = parsed.path.lstrip('/')
-                
-                print(f"DEBUG: Extracting key: {s3_key} from bucket: {app.config.get('AWS_S3_BUCKET_NAME')}")
-
-                s3_client = boto3.client(
-                    "s3",
-                    aws_access_key_id=app.config.get("AWS_ACCESS_KEY_ID"),
-                    aws_secret_access_key=app.config.get("AWS_SECRET_ACCESS_KEY"),
-                    region_name=app.config.get("AWS_REGION")
-                )
-
-                presigned_url = s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={
-                        'Bucket': app.config.get("AWS_S3_BUCKET_NAME"),
-                        'Key': s3_key
-                    },
-                    ExpiresIn=300 # 5分間有効
-                )
-                image_url = presigned_url
-                print(f"DEBUG: Generated presigned URL successfully (len={len(image_url)})")
-
-            except Exception as e:
-                print(f"WARNING: Failed to generate presigned URL: {e}")
-                import traceback
-                traceback.print_exc()
-                # 失敗時は元のURLを使用
-                image_url = original_url
-
-            # プロンプト作成
-            # 学年に応じてプロンプトを切り替える
-            grade_level = getattr(question, 'grade', 'junior-high') 
-            if grade_level == 'high-school':
-                prompt = """
-                あなたは優秀な高校教師です。この画像に写っている問題を分析して、高校生の学習者に適した教育的な指導をしてください。
-
-                【絶対に守ること】
-                - 計算しなくていいから、解き方の手順だけ教えてください
-                - 日本の高校生の知識の範囲内で、専門用語も適宜使用して説明してください
-
-                【表示形式】
-                - 考え方と手順のみ表示
-                - 重要な数式は $$...$$ で中央揃え表示
-                - 式に番号を振ってください
-
-                まず画像の内容を詳しく分析し、問題文を正確に読み取ってから指導を開始してください。
-                """
-            else:  # デフォルトは中学生向け
-                prompt = """
-                あなたは優秀な中学教師です。この画像に写っている問題を分析して、中学生の学習者に適した教育的な指導をしてください。
-
-                【絶対に守ること】
-                - 計算しなくていいから、解き方の手順だけ教えてください
-                - 日本の中学生の知識の範囲内で、専門用語は避け、平易な言葉で説明してください
-                - できるだけで細かく、わかりやすく説明してください
-
-                【表示形式】
-                - 考え方と手順のみ表示
-                - 重要な数式は $$...$$ で中央揃え表示
-                - 式に番号を振ってください
-
-                まず画像の内容を詳しく分析し、問題文を正確に読み取ってから指導を開始してください。
-                """
-
-            print("DEBUG: Calling OpenAI API...")
-            gpt_response = client.chat.completions.create(
-                model="gpt-5.2",
-                messages=[
-                    {"role": "user", "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {
-                            "url": image_url,
-                            "detail": "auto"
-                        }}
-                    ]}
-                ],
-                max_completion_tokens=5000,
-                temperature=0.7
-            )
-            print("DEBUG: OpenAI API returned response.")
-            
-            # Debug full choice details
-            first_choice = gpt_response.choices[0]
-            print(f"DEBUG: Finish Reason: {first_choice.finish_reason}")
-            print(f"DEBUG: Choice Details: {first_choice}")
-
-            explanation_text = first_choice.message.content
-            if not explanation_text:
-                 explanation_text = ""
-            explanation_text = explanation_text.strip()
-            
-            print(f"DEBUG: OpenAI Response Length: {len(explanation_text)}")
-            print(f"DEBUG: OpenAI Response Preview: {explanation_text[:100]}...")
-
-            if not explanation_text:
-                print("ERROR: OpenAI returned empty explanation.")
-                question.explanation = "AIからの回答が空でした。別の画像を試すか、しばらく待ってから再試行してください。"
-                question.explanation_status = "failed"
+            # プロバイダ障害中はモデルを呼ばず、リトライも消費せずに後回しにする
+            state, remaining = get_breaker(OPENAI).state()
+            if state == OPEN:
+                raise CircuitOpenError(OPENAI, remaining)
+            if current_app.config.get("ASYNC_EXECUTION"):
+                # イベントループ上で実行 (このスレッドは結果待ちのみ)
+                executor = get_executor()
+                result = executor.submit(run_explanation_async(question_id, executor, generation, timer)).result()
             else:
-                question.explanation = explanation_text
-                question.explanation_status = "completed"
-            
-            db.session.commit()
-            print(f"DEBUG: Task finished. Status: {question.explanation_status}")
-            
-            return {"status": question.explanation_status, "question_id": question_id}
+                result = run_explanation(question_id, generation, timer)
+            run["status"] = result.get("status")
+            return result
+
+        except CircuitOpenError as e:
+            run["error"] = str(e)
+            # 新しい claim に置き換えられていれば何もしない
+            if not extend_lease(question_id, generation):
+                run["status"] = "skipped"
+                return {"status": "skipped", "question_id": question_id, "reason": "stale"}
+            run["status"] = "deferred"
+            countdown = retry_countdown(e, 0)
+            print(f"DEBUG: Circuit open, deferring question_id={question_id} for {countdown}s")
+            metrics.incr("task:deferred")
+            # 同じレーンに投入し直す (リトライ回数は消費しない)
+            dispatch_explanation(question_id, lane, countdown=countdown, generation=generation)
+            return {"status": "deferred", "question_id": question_id}
 
         except Exception as e:
             print(f"ERROR: Task failed with exception: {e}")
-            import traceback
             traceback.print_exc()
-            db.session.rollback()
-            # エラー記録
-            if question:
-                question.explanation_status = "failed"
-                question.explanation = str(e)
-                try:
-                    db.session.commit()
-                except:
-                    pass
-            raise self.retry(exc=e, countdown=60)
+            run["error"] = str(e)
+            kind = classify(e)
+            if kind == PERMANENT or self.request.retries >= self.max_retries:
+                # これ以上試しても成功しない / リトライを使い切った (新しい claim があれば何もしない)
+                message = PERMANENT_FAILURE_MESSAGE if kind == PERMANENT else RETRY_EXHAUSTED_MESSAGE
+                run["status"] = "failed" if record_failure(question_id, e, generation, message) else "skipped"
+                metrics.incr(f"task:failed:{kind}")
+                return {"status": run["status"], "question_id": question_id, "error": kind}
+            if not extend_lease(question_id, generation):
+                run["status"] = "skipped"
+                return {"status": "skipped", "question_id": question_id, "reason": "stale"}
+            # リトライ中は processing のまま。対話的な処理を妨げないよう backfill レーンに回す
+            run["status"] = "retry"
+            countdown = retry_countdown(e, self.request.retries)
+            raise self.retry(exc=e, countdown=countdown, queue=LANE_QUEUES[LANE_BACKFILL],
+                             kwargs={"lane": LANE_BACKFILL, "enqueued_at": time.time() + countdown,
+                                     "generation": generation})
+        finally:
+            # ステージ別の所要時間を TaskRun として保存
+            timer.save(question_id, task_id=self.request.id, lane=lane, attempt=self.request.retries or 0,
+                       status=run["status"], error=run["error"])
+
+
+def dispatch_requestion(job_id, lane=LANE_INTERACTIVE):
+    """再質問タスクを投入する (生徒が画面で待っているので通常は interactive レーン)"""
+    return requestion_task.apply_async(
+        args=[job_id],
+        kwargs={"lane": lane, "enqueued_at": time.time()},
+        queue=LANE_QUEUES[lane],
+    )
+
+
+@celery.task(bind=True, name='app.tasks.requestion_task')
+def requestion_task(self, job_id, lane=LANE_INTERACTIVE, enqueued_at=None):
+    """
+    再質問タスク (失敗時はリトライせず、生徒に再送してもらう)
+    """
+    with task_app_context():
+        if enqueued_at is not None:
+            metrics.observe(f"queue_wait:{lane}", max(0.0, time.time() - enqueued_at))
+        try:
+            if current_app.config.get("ASYNC_EXECUTION"):
+                executor = get_executor()
+                return executor.submit(run_requestion_async(job_id, executor)).result()
+            return run_requestion(job_id)
+        except Exception as e:
+            traceback.print_exc()
+            fail_requestion(job_id, e)
+            return {"status": "failed", "job_id": job_id}
+
+
+@celery.task(bind=True, name='app.tasks.reap_stuck_task')
+def reap_stuck_task(self):
+    """processing のまま止まった質問の回収 (Celery beat から定期実行)"""
+    from .reaper import reap
+    with task_app_context():
+        return reap()
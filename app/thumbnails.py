@@ -0,0 +1,95 @@
+import io
+from flask import current_app
+from . import metrics
+from .models import Question
+from .storage import get_storage, storage_key
+
+# 質問一覧のサムネイル。
+# ワーカーが画像を読み込んだついでに小さな WebP を作って保存し、Question.thumbnail_path に入れる。
+# 一覧では長期キャッシュ可能な URL (S3 は期限の長い presigned URL をプロセス内で使い回す) で表示し、
+# 原寸の画像は解説のモーダルを開いた時に /questions/<id>/image から読み込む。
+
+# 同じキーの中身は変わらないので、ブラウザに長期間キャッシュさせる
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# 原寸画像へのリダイレクトをブラウザに覚えさせるとき、presigned URL の期限の手前に残す秒数
+IMAGE_REDIRECT_MARGIN = 30
+
+
+def ensure_thumbnail(question, image_bytes):
+    """サムネイルが無ければ作る (commit は呼び出し側)。作れなければ None"""
+    if question.thumbnail_path or not current_app.config.get("THUMBNAIL_ENABLED", True):
+        return question.thumbnail_path
+    from .imaging import make_thumbnail
+    try:
+        data = make_thumbnail(image_bytes, current_app.config.get("THUMBNAIL_MAX_EDGE", 320),
+                              current_app.config.get("THUMBNAIL_QUALITY", 70))
+        question.thumbnail_path = get_storage().put(io.BytesIO(data), "thumb.webp", content_type="image/webp",
+                                                    cache_control=CACHE_CONTROL)
+    except Exception as e:
+        # サムネイルが無くても一覧は表示できる
+        print(f"WARNING: Thumbnail generation failed for question_id={question.id}: {e}")
+        metrics.incr("thumbnail:failed")
+        return None
+    metrics.incr("thumbnail:created")
+    print(f"DEBUG: Thumbnail for question_id={question.id} ({len(data)} bytes)")
+    return question.thumbnail_path
+
+
+def copy_thumbnail(question):
+    """同じ画像を使う質問のサムネイルを流用する (解説キャッシュのヒット時)"""
+    source = (Question.query
+              .filter(Question.image_path == question.image_path, Question.thumbnail_path.isnot(None))
+              .first())
+    if source is not None:
+        question.thumbnail_path = source.thumbnail_path
+
+
+def thumbnail_url(question):
+    """一覧に出すサムネイルの URL (なければ None)"""
+    if not question.thumbnail_path:
+        return None
+    try:
+        return get_storage().browser_url(question.thumbnail_path,
+                                         current_app.config.get("THUMBNAIL_URL_EXPIRES", 7 * 24 * 3600))
+    except Exception as e:
+        print(f"WARNING: Failed to build thumbnail URL: {e}")
+        return None
+
+
+def image_url(question, expires=300):
+    """原寸画像をブラウザに渡す (URL, 残りの有効秒数)。期限の無い URL は残り None"""
+    return get_storage().browser_url_with_remaining(storage_key(question.image_path), expires)
+
+
+def backfill(limit=500, chunk_size=50, echo=print):
+    """サムネイルの無い既存の質問に作る (manage.py backfill-thumbnails)。
+
+    作れなかった質問は飛ばして id 順に進む (同じ質問で止まり続けない)。
+    """
+    from . import db
+    summary = {"created": 0, "failed": 0}
+    last_id = 0
+    while summary["created"] + summary["failed"] < limit:
+        questions = (Question.query
+                     .filter(Question.id > last_id, Question.image_path.isnot(None),
+                             Question.thumbnail_path.is_(None))
+                     .order_by(Question.id.asc())
+                     .limit(min(chunk_size, limit - summary["created"] - summary["failed"]))
+                     .all())
+        if not questions:
+            break
+        for question in questions:
+            last_id = question.id
+            try:
+                image_bytes = get_storage().get(storage_key(question.image_path))
+            except Exception as e:
+                echo(f"question {question.id}: failed to read image ({e})")
+                summary["failed"] += 1
+                continue
+            if ensure_thumbnail(question, image_bytes):
+                summary["created"] += 1
+            else:
+                summary["failed"] += 1
+        db.session.commit()
+    return summary
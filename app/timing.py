@@ -0,0 +1,73 @@
+import time
+from contextlib import contextmanager
+from flask import current_app
+from . import db, metrics
+from .models import TaskRun
+
+# 解説タスクのステージ別計測。
+# 1回のタスク実行 (リトライを含む各試行) ごとに TaskRun を1行保存し、
+# 同じ値を Redis の分単位ヒストグラム (metrics.observe) にも入れて HQ 画面で集計する。
+
+STAGES = (
+    "queue_wait",      # 投入 → 実行開始
+    "db_fetch",        # 質問の読み込みと processing への更新
+    "image_fetch",     # S3 からの画像読み込み (pHash / inline 送信時)
+    "phash",           # 近似重複の検索
+    "presign",         # presigned URL の発行
+    "ratelimit_wait",  # 共有レートリミットの枠待ち
+    "model_ttft",      # モデル呼び出し → 最初のトークン
+    "model_total",     # モデル呼び出し → ストリーム終了
+    "persist",         # 結果の保存と完了通知
+)
+
+# DB や presign はミリ秒単位なのでキュー待ち用 (LATENCY_BUCKETS) より細かくする
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+
+class StageTimer:
+    """ステージごとの所要時間 (秒) を集める"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    def record(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + max(0.0, seconds)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def save(self, question_id, task_id=None, lane=None, attempt=0, status=None, error=None):
+        """TaskRun を保存しヒストグラムに記録する (計測の失敗でタスクを落とさない)"""
+        total = self.elapsed()
+        for name, seconds in self.durations.items():
+            metrics.observe(f"stage:{name}", seconds, STAGE_BUCKETS)
+        metrics.observe("stage:total", total, STAGE_BUCKETS)
+
+        ms = {name: int(seconds * 1000) for name, seconds in self.durations.items()}
+        run = TaskRun(
+            question_id=question_id,
+            task_id=task_id,
+            lane=lane,
+            attempt=attempt,
+            status=status,
+            error=(error or "")[:500] or None,
+            total_ms=int(total * 1000),
+            **{f"{name}_ms": ms.get(name) for name in STAGES},
+        )
+        try:
+            db.session.add(run)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"failed to save task run for question {question_id}: {e}")
+        return run
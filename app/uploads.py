@@ -0,0 +1,104 @@
+import io
+import uuid
+from flask import current_app
+from . import db, metrics
+from .clients import get_s3_client
+from .services import ExplanationCacheService
+from .storage import get_storage, storage_key
+
+# ブラウザから S3 への直接アップロード。
+#   1. POST /api/uploads          : presigned POST (サイズ・形式の制限付き) を返す
+#   2. ブラウザが S3 に直接 POST
+#   3. POST /api/uploads/confirm  : 質問を作成して解説タスクを投入する
+# Web は画像のバイト列を受け取らない。正規化・ハッシュ計算・キャッシュ照合は
+# ワーカーが画像を読み込んだ時に行う (ingest_upload)。
+# バケットには Web のオリジンからの POST を許可する CORS 設定が必要。
+# STORAGE_BACKEND=s3 の場合のみ使える。
+
+UPLOAD_PREFIX = "uploads"
+
+# 受け付ける形式と拡張子
+CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "image/heic": ".heic",
+    "image/heif": ".heif",
+}
+
+
+def upload_key(user_id, content_type):
+    return f"{UPLOAD_PREFIX}/{user_id}/{uuid.uuid4().hex}{CONTENT_TYPES[content_type]}"
+
+
+def owns_upload_key(user_id, key):
+    """アップロード先のキーが本人用に発行したものか (キーの先頭にユーザー ID を入れている)"""
+    prefix = f"{UPLOAD_PREFIX}/{user_id}/"
+    return bool(key) and key.startswith(prefix) and "/" not in key[len(prefix):] and ".." not in key
+
+
+def create_upload_policy(user_id, content_type):
+    """presigned POST を発行する ({"url", "fields", "key"})。対応していない形式なら ValueError"""
+    if content_type not in CONTENT_TYPES:
+        raise ValueError(f"unsupported content type: {content_type}")
+    config = current_app.config
+    key = upload_key(user_id, content_type)
+    post = get_s3_client().generate_presigned_post(
+        Bucket=config["AWS_S3_BUCKET_NAME"],
+        Key=key,
+        Fields={"Content-Type": content_type},
+        Conditions=[
+            {"Content-Type": content_type},
+            ["content-length-range", 1, config.get("UPLOAD_MAX_BYTES", 20 * 1024 * 1024)],
+        ],
+        ExpiresIn=config.get("UPLOAD_POLICY_EXPIRES", 600),
+    )
+    metrics.incr("upload:policy")
+    return {"url": post["url"], "fields": post["fields"], "key": key}
+
+
+def head_upload(key):
+    """アップロード済みのオブジェクトの (サイズ, Content-Type)。なければ None"""
+    try:
+        head = get_s3_client().head_object(Bucket=current_app.config["AWS_S3_BUCKET_NAME"], Key=key)
+    except Exception as e:
+        print(f"WARNING: Uploaded object not found: {key} ({e})")
+        return None
+    return head.get("ContentLength", 0), head.get("ContentType")
+
+
+def ingest_upload(question, image_bytes):
+    """直接アップロードされた画像の取り込み (ワーカー側)。
+
+    Web 経由の投稿では保存前に行っていた処理 (正規化・ハッシュ・解説キャッシュの照合) をここで行う。
+    (モデルに渡す画像のバイト列, 解説キャッシュのエントリまたは None) を返す。
+    """
+    normalized = None
+    if current_app.config.get("IMAGE_NORMALIZE_ENABLED", True):
+        from .imaging import normalize_image
+        try:
+            normalized = normalize_image(image_bytes, current_app.config.get("IMAGE_MAX_EDGE", 2048),
+                                         current_app.config.get("IMAGE_JPEG_QUALITY", 85))
+        except ValueError as e:
+            # 開けない形式はそのまま使う
+            print(f"WARNING: Image normalization skipped: {e}")
+
+    data = normalized.data if normalized is not None else image_bytes
+    # Web 経由の投稿と同じく正規化後のバイト列で照合する
+    question.content_hash = ExplanationCacheService.content_hash(data)
+    cached = ExplanationCacheService.lookup(question.content_hash, question.grade)
+    if normalized is None:
+        return data, cached
+
+    # キャッシュにヒットしても、メタデータ付きの元画像は残さず正規化後の画像に置き換える
+    original_key = storage_key(question.image_path)
+    question.image_path = get_storage().put(io.BytesIO(normalized.data), f"upload{normalized.extension}",
+                                            content_type=normalized.content_type)
+    db.session.commit()
+    try:
+        get_s3_client().delete_object(Bucket=current_app.config["AWS_S3_BUCKET_NAME"], Key=original_key)
+    except Exception as e:
+        print(f"WARNING: Failed to delete original upload {original_key}: {e}")
+    print(f"DEBUG: Ingested upload {len(image_bytes)} -> {len(normalized.data)} bytes {normalized.size}")
+    return data, cached
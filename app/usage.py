@@ -0,0 +1,121 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from . import db, metrics
+from .models import School, UsageEvent, UsageRollup
+
+# OpenAI の利用量 (トークン数・料金) の記録と、学校ごとの月間予算。
+# 呼び出しごとに UsageEvent を1行保存し、同じトランザクションで時間別・日別の
+# UsageRollup に加算する。画面や予算判定は集計行だけを読み、生の行は走査しない。
+
+KIND_EXPLANATION = "explanation"
+KIND_REQUESTION = "requestion"
+KIND_BATCH = "batch"
+
+PERIOD_HOUR = "hour"
+PERIOD_DAY = "day"
+
+BUDGET_OK = "ok"
+BUDGET_SOFT = "soft"  # ソフト上限超過: 低優先レーンで処理
+BUDGET_HARD = "hard"  # ハード上限超過: 新しいリクエストを受け付けない
+
+
+def _field(obj, name):
+    # SDK のオブジェクトと Batch API の JSON (dict) の両方を扱う
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def token_counts(usage):
+    """usage から (入力, うちキャッシュ, 出力) のトークン数を取り出す"""
+    input_tokens = _field(usage, "prompt_tokens") or 0
+    cached_tokens = _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+    output_tokens = _field(usage, "completion_tokens") or 0
+    return int(input_tokens), int(cached_tokens), int(output_tokens)
+
+
+def cost_micros(input_tokens, cached_tokens, output_tokens, kind=KIND_EXPLANATION):
+    """料金をマイクロドル (1e-6 USD) の整数で返す"""
+    config = current_app.config
+    cost = ((input_tokens - cached_tokens) * config.get("OPENAI_PRICE_INPUT_PER_MTOK", 0.0)
+            + cached_tokens * config.get("OPENAI_PRICE_CACHED_INPUT_PER_MTOK", 0.0)
+            + output_tokens * config.get("OPENAI_PRICE_OUTPUT_PER_MTOK", 0.0))
+    if kind == KIND_BATCH:
+        cost *= config.get("OPENAI_BATCH_DISCOUNT", 1.0)
+    # 1トークンあたりの単価が USD / 100万トークン なので、そのままマイクロドルになる
+    return int(round(cost))
+
+
+def bucket_start(at, period):
+    if period == PERIOD_HOUR:
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_to_rollup(period, at, school_id, kind, values):
+    """集計行に加算する (行がなければ作る。同時作成は UPDATE でやり直す)"""
+    start = bucket_start(at, period)
+    query = UsageRollup.query.filter_by(period=period, bucket_start=start, school_id=school_id, kind=kind)
+    increments = {getattr(UsageRollup, name): getattr(UsageRollup, name) + value for name, value in values.items()}
+    if query.update(increments, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(UsageRollup(period=period, bucket_start=start, school_id=school_id, kind=kind, **values))
+    except IntegrityError:
+        query.update(increments, synchronize_session=False)
+
+
+def record_usage(kind, usage, question_id=None, user_id=None, school_id=None, model=None):
+    """1回分の利用量を記録する (commit は呼び出し側)。usage がなければ何もしない"""
+    if usage is None:
+        return None
+    input_tokens, cached_tokens, output_tokens = token_counts(usage)
+    cost = cost_micros(input_tokens, cached_tokens, output_tokens, kind)
+    now = datetime.utcnow()
+    event = UsageEvent(kind=kind, model=model, question_id=question_id, user_id=user_id, school_id=school_id,
+                       input_tokens=input_tokens, cached_tokens=cached_tokens, output_tokens=output_tokens,
+                       cost_micros=cost, created_at=now)
+    db.session.add(event)
+    if school_id is not None:
+        values = {"requests": 1, "input_tokens": input_tokens, "cached_tokens": cached_tokens,
+                  "output_tokens": output_tokens, "cost_micros": cost}
+        for period in (PERIOD_HOUR, PERIOD_DAY):
+            _add_to_rollup(period, now, school_id, kind, values)
+    metrics.incr("usage:output_tokens", output_tokens)
+    print(f"DEBUG: Usage recorded kind={kind} school_id={school_id} "
+          f"input={input_tokens} cached={cached_tokens} output={output_tokens} cost_micros={cost}")
+    return event
+
+
+def month_start(now=None):
+    now = now or datetime.utcnow()
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_spend_micros(school_ids=None):
+    """今月の学校別利用額 {school_id: マイクロドル} (日別集計から求める)"""
+    query = (db.session.query(UsageRollup.school_id, db.func.sum(UsageRollup.cost_micros))
+             .filter(UsageRollup.period == PERIOD_DAY, UsageRollup.bucket_start >= month_start()))
+    if school_ids is not None:
+        query = query.filter(UsageRollup.school_id.in_(school_ids))
+    return {school_id: int(total or 0) for school_id, total in query.group_by(UsageRollup.school_id)}
+
+
+def budget_state(school_id, spend=None):
+    """学校の今月の予算状況 (BUDGET_OK / BUDGET_SOFT / BUDGET_HARD)"""
+    if school_id is None:
+        return BUDGET_OK
+    school = db.session.get(School, school_id)
+    if school is None or (school.monthly_budget_soft_usd is None and school.monthly_budget_hard_usd is None):
+        return BUDGET_OK
+    if spend is None:
+        spend = month_spend_micros([school_id]).get(school_id, 0)
+    if school.monthly_budget_hard_usd is not None and spend >= school.monthly_budget_hard_usd * 1e6:
+        return BUDGET_HARD
+    if school.monthly_budget_soft_usd is not None and spend >= school.monthly_budget_soft_usd * 1e6:
+        return BUDGET_SOFT
+    return BUDGET_OK
@@ -1,46 +1,154 @@
-import boto3
 import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
 from flask import current_app
+from . import metrics
+from .clients import get_s3_client
 
-def upload_file_to_s3(file_obj, filename, content_type=None):
+# S3 まわりの処理をまとめたモジュール。
+# クライアントはプロセス共有 (app/clients.py)。presigned GET URL は有効期限の手前まで
+# プロセス内で使い回す。同じ URL を送り続けることで、再質問のように同じ画像を何度も
+# 渡す場合にプロバイダ側のキャッシュも効きやすくなる。
+
+# 残り有効期間がこの割合を切ったら発行し直す (300秒なら240秒使う)
+PRESIGN_REFRESH_RATIO = 0.2
+PRESIGN_MIN_REMAINING = 30
+
+_presign_lock = threading.Lock()
+_presign_cache = OrderedDict()
+
+
+def s3_key_from_url(url):
+    """保存済みの画像URL (https://bucket.s3.region.amazonaws.com/KEY) からキーを取り出す"""
+    path = urlparse(url).path.lstrip('/')
+    endpoint = current_app.config.get("S3_ENDPOINT_URL")
+    if endpoint and url.startswith(endpoint):
+        # S3 互換ストレージはパス形式 (ENDPOINT/bucket/KEY)
+        path = path.split('/', 1)[1] if '/' in path else path
+    return path
+
+
+def public_url(key):
+    bucket_name = current_app.config["AWS_S3_BUCKET_NAME"]
+    endpoint = current_app.config.get("S3_ENDPOINT_URL")
+    if endpoint:
+        return f"{endpoint.rstrip('/')}/{bucket_name}/{key}"
+    region = current_app.config["AWS_REGION"]
+    return f"https://{bucket_name}.s3.{region}.amazonaws.com/{key}"
+
+
+def upload_file_to_s3(file_obj, filename, content_type=None, cache_control=None):
     """
     Uploads a file object to S3 and returns the public URL.
     """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=current_app.config["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=current_app.config["AWS_SECRET_ACCESS_KEY"],
-        region_name=current_app.config["AWS_REGION"]
-    )
-    
     bucket_name = current_app.config["AWS_S3_BUCKET_NAME"]
-    
+
     # Generate unique filename to avoid collisions
     ext = os.path.splitext(filename)[1]
     unique_filename = f"{uuid.uuid4()}{ext}"
-    
+
     extra_args = {}
     if content_type:
         extra_args["ContentType"] = content_type
         # Assuming public read for OpenAI access
-        # extra_args["ACL"] = "public-read" 
+        # extra_args["ACL"] = "public-read"
         # Note: ACLs might be disabled on the bucket, in which case bucket policy controls access.
+    if cache_control:
+        # presigned URL での GET にもそのまま返る
+        extra_args["CacheControl"] = cache_control
 
+    from .breaker import get_breaker, S3
     try:
-        s3_client.upload_fileobj(
-            file_obj,
-            bucket_name,
-            unique_filename,
-            ExtraArgs=extra_args
-        )
+        with get_breaker(S3).guard():
+            get_s3_client().upload_fileobj(
+                file_obj,
+                bucket_name,
+                unique_filename,
+                ExtraArgs=extra_args
+            )
     except Exception as e:
         print(f"S3 Upload Error: {e}")
         raise e
 
     # Construct Public URL
     # Format: https://{bucket}.s3.{region}.amazonaws.com/{key}
-    region = current_app.config["AWS_REGION"]
-    url = f"https://{bucket_name}.s3.{region}.amazonaws.com/{unique_filename}"
-    
-    return url
+    return public_url(unique_filename)
+
+
+def download_file_from_s3(key):
+    """S3 からオブジェクトを読み込んでバイト列で返す"""
+    from .breaker import get_breaker, S3
+    with get_breaker(S3).guard():
+        response = get_s3_client().get_object(Bucket=current_app.config["AWS_S3_BUCKET_NAME"], Key=key)
+        return response["Body"].read()
+
+
+def _presign(key, expires):
+    return get_s3_client().generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': current_app.config.get("AWS_S3_BUCKET_NAME"),
+            'Key': key
+        },
+        ExpiresIn=expires
+    )
+
+
+def presigned_get_url(key, expires=300):
+    """presigned GET URL を返す (有効期限に余裕があればキャッシュから)"""
+    return presigned_get_url_with_remaining(key, expires)[0]
+
+
+def presigned_get_url_with_remaining(key, expires=300):
+    """(presigned GET URL, 残りの有効秒数) を返す。
+
+    キャッシュから返した URL は expires より短い期限しか残っていないことがあるので、
+    URL をブラウザにキャッシュさせる側 (リダイレクトなど) は残りの秒数を上限にする。
+    """
+    bucket = current_app.config.get("AWS_S3_BUCKET_NAME")
+    cache_key = (bucket, key, expires)
+    margin = max(PRESIGN_MIN_REMAINING, expires * PRESIGN_REFRESH_RATIO)
+    now = time.monotonic()
+    with _presign_lock:
+        entry = _presign_cache.get(cache_key)
+        if entry is not None and entry[1] - now > margin:
+            _presign_cache.move_to_end(cache_key)
+            url = entry[0]
+        else:
+            url = None
+    if url is not None:
+        metrics.incr("presign:hit")
+        return url, int(entry[1] - now)
+
+    url = _presign(key, expires)
+    metrics.incr("presign:miss")
+    with _presign_lock:
+        _presign_cache[cache_key] = (url, now + expires)
+        _presign_cache.move_to_end(cache_key)
+        limit = current_app.config.get("PRESIGN_CACHE_SIZE", 1024)
+        while len(_presign_cache) > limit:
+            _presign_cache.popitem(last=False)
+    return url, expires
+
+
+def clear_presign_cache():
+    with _presign_lock:
+        _presign_cache.clear()
+
+
+def presigned_image_url(image_path, expires=300):
+    """S3 の画像URLから presigned URL を発行する (失敗時は元のURL)"""
+    s3_key = s3_key_from_url(image_path)
+    try:
+        image_url = presigned_get_url(s3_key, expires)
+        print(f"DEBUG: Presigned URL for key {s3_key} (len={len(image_url)})")
+        return image_url
+    except Exception as e:
+        print(f"WARNING: Failed to generate presigned URL: {e}")
+        import traceback
+        traceback.print_exc()
+        # 失敗時は元のURLを使用
+        return image_path
@@ -0,0 +1,68 @@
+import os
+import threading
+from flask import current_app, has_app_context
+from . import create_app, db, phash, ratelimit
+from .aio import get_executor, reset_executor
+from .clients import get_openai_client, get_s3_client, reset_clients
+
+# Celery ワーカーのライフサイクル管理。
+# Flask アプリ・DBエンジン・APIクライアントはワーカープロセスごとに一度だけ作り、
+# タスクは毎回アプリコンテキストを push するだけにする。
+
+_lock = threading.Lock()
+_worker_app = None
+_initialized_pid = None
+
+
+def get_worker_app():
+    """ワーカープロセス共有の Flask アプリを返す (初回のみ create_app)"""
+    global _worker_app
+    if _worker_app is None:
+        with _lock:
+            if _worker_app is None:
+                _worker_app = create_app()
+    return _worker_app
+
+
+def task_app_context():
+    """タスク実行用のアプリコンテキストを返す。
+
+    既にアプリコンテキストがある場合 (テストや eager 実行) はそのアプリを使う。
+    コンテキストはタスクごとに新しく作るので、DBセッションはタスク終了時に破棄され、
+    コネクションはエンジンのプールに返却される。
+    """
+    if has_app_context():
+        app = current_app._get_current_object()
+    else:
+        app = get_worker_app()
+    return app.app_context()
+
+
+def init_worker_process(**kwargs):
+    """worker_process_init / worker_init から呼ばれる初期化処理"""
+    global _initialized_pid
+    pid = os.getpid()
+    if _initialized_pid == pid:
+        return
+    _initialized_pid = pid
+
+    app = get_worker_app()
+    # 親プロセスから fork で引き継いだ接続・ソケットは使わない
+    reset_clients()
+    reset_executor()
+    ratelimit.reset()
+    with app.app_context():
+        db.engine.dispose(close=False)
+        get_openai_client()
+        try:
+            get_s3_client()
+        except Exception as e:
+            print(f"WARNING: Failed to initialize S3 client: {e}")
+        if app.config.get("PHASH_ENABLED"):
+            try:
+                phash.rebuild_index()
+            except Exception as e:
+                print(f"WARNING: Failed to build pHash index: {e}")
+        if app.config.get("ASYNC_EXECUTION"):
+            get_executor()
+    print(f"DEBUG: Worker process initialized (pid={pid})")
@@ -0,0 +1,82 @@
+"""asyncio 実行 (app/aio.py) と従来の逐次実行のスループット比較
+
+ローカルのスタブ OpenAI サーバー (benchmarks/stub_openai_server.py) に対して
+N 件の解説生成を行う。逐次実行は render.yaml の旧設定 --concurrency=1 相当。
+
+    python benchmarks/bench_async_executor.py [--questions 40] [--latency 1.0] [--in-flight 32]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stub_openai_server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--in-flight", type=int, default=32)
+    parser.add_argument("--sequential", type=int, default=5, help="逐次実行で計測する件数")
+    args = parser.parse_args()
+
+    server, base_url = stub_openai_server.start(latency=args.latency)
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url, "OPENAI_API_KEY": "sk-stub",
+        "DATABASE_URL": f"sqlite:///{db_path}", "PHASH_ENABLED": "false",
+        "AWS_ACCESS_KEY_ID": "bench", "AWS_SECRET_ACCESS_KEY": "bench", "AWS_S3_BUCKET_NAME": "bench",
+        "REDIS_URL": "redis://127.0.0.1:1/0",  # 途中経過の配信は無効 (接続失敗は無視される)
+        "RATE_LIMIT_ENABLED": "false",  # 実行方式そのものを比較する
+    })
+
+    from app import create_app, db
+    from app.aio import AsyncExecutor
+    from app.models import Question, School, User, ROLE_STUDENT
+    from app.pipeline import run_explanation, run_explanation_async
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        school = School(name="bench")
+        db.session.add(school)
+        db.session.flush()
+        user = User(email="bench@example.com", role=ROLE_STUDENT, school_id=school.id, password_hash="x")
+        db.session.add(user)
+        db.session.flush()
+        questions = [Question(content="bench", user_id=user.id, school_id=school.id,
+                              image_path=f"https://bench.s3.ap-northeast-1.amazonaws.com/{i}.jpg",
+                              explanation_status="processing")
+                     for i in range(args.questions + args.sequential)]
+        db.session.add_all(questions)
+        db.session.commit()
+        ids = [q.id for q in questions]
+
+        start = time.perf_counter()
+        for qid in ids[:args.sequential]:
+            run_explanation(qid)
+        sequential = args.sequential / (time.perf_counter() - start)
+
+    executor = AsyncExecutor(app, max_in_flight=args.in_flight, db_workers=4).start()
+    with app.app_context():
+        start = time.perf_counter()
+        futures = [executor.submit(run_explanation_async(qid, executor)) for qid in ids[args.sequential:]]
+        results = [f.result() for f in futures]
+        concurrent = len(results) / (time.perf_counter() - start)
+    executor.shutdown()
+    server.shutdown()
+
+    print(f"stub latency: {args.latency:.2f} s")
+    print(f"sequential (concurrency=1): {sequential:6.2f} explanations/s")
+    print(f"async (in-flight={args.in_flight:3d})   : {concurrent:6.2f} explanations/s")
+    print(f"speedup: {concurrent / sequential:.1f}x")
+    print(f"completed: {sum(r['status'] == 'completed' for r in results)}/{len(results)}")
+
+
+if __name__ == "__main__":
+    main()
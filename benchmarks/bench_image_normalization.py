@@ -0,0 +1,115 @@
+"""アップロード画像の正規化 (app.imaging.normalize_image) の効果
+
+    python benchmarks/bench_image_normalization.py [--max-edge 2048] [--quality 85] [IMAGE ...]
+    OPENAI_API_KEY=... python benchmarks/bench_image_normalization.py --live photo.jpg
+
+画像を指定しなければ、スマホ写真相当 (4032x3024, 品質95, EXIF 付き) の合成画像を使う。
+正規化前後のバイト数・処理時間・画像トークン数 (detail=high の計算式による見積もり)・
+指定帯域でのアップロード時間を出力する。--live なら実際に base64 で送信し、
+最初のトークンまでの時間 (TTFT) と usage.prompt_tokens を比較する。
+"""
+import argparse
+import io
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from app.imaging import normalize_image, to_data_url
+
+
+def synthetic_photo(width=4032, height=3024, seed=42):
+    """ノイズの乗った紙に文字列状の線を描いた写真風の画像"""
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 40).convert("RGB")
+    paper = Image.new("RGB", (width, height), (235, 230, 220))
+    img = Image.blend(paper, img, 0.25)
+    draw = ImageDraw.Draw(img)
+    for y in range(200, height - 200, 90):
+        x = 200
+        while x < width - 300:
+            w = rng.randint(30, 160)
+            draw.rectangle([x, y, x + w, y + 40], fill=(rng.randint(10, 60),) * 3)
+            x += w + rng.randint(20, 60)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    exif[0x010F] = "PhoneMaker"
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=95, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def image_tokens(width, height):
+    """detail=high の画像トークン数 (2048 に収めて短辺 768 に縮小し、512px タイルごとに 170)"""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def live_call(data, model):
+    from openai import OpenAI
+    client = OpenAI()
+    start = time.perf_counter()
+    ttft = None
+    usage = None
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": [
+            {"type": "text", "text": "この画像に写っている問題文を一行で要約してください。"},
+            {"type": "image_url", "image_url": {"url": to_data_url(data), "detail": "auto"}},
+        ]}],
+        max_completion_tokens=200,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    for chunk in stream:
+        if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+            ttft = time.perf_counter() - start
+        if chunk.usage is not None:
+            usage = chunk.usage
+    return ttft, usage
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--max-edge", type=int, default=2048)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--uplink-mbps", type=float, default=10.0, help="アップロード時間の見積もりに使う帯域")
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--model", default="gpt-5.2")
+    args = parser.parse_args()
+
+    samples = [(path, open(path, "rb").read()) for path in args.images] or [("synthetic 4032x3024", synthetic_photo())]
+    for name, data in samples:
+        original = Image.open(io.BytesIO(data))
+        timings = []
+        for _ in range(5):
+            t0 = time.perf_counter()
+            result = normalize_image(data, args.max_edge, args.quality)
+            timings.append(time.perf_counter() - t0)
+        upload = lambda n: n * 8 / (args.uplink_mbps * 1e6)
+
+        print(f"{name}")
+        print(f"  bytes          : {len(data) / 1e6:7.2f} MB -> {len(result.data) / 1e6:7.2f} MB "
+              f"({len(result.data) / len(data):.0%})")
+        print(f"  size           : {original.size} -> {result.size}")
+        print(f"  normalize time : {min(timings) * 1000:7.1f} ms (best of 5)")
+        print(f"  upload @{args.uplink_mbps:g}Mbps : {upload(len(data)):7.2f} s -> {upload(len(result.data)):7.2f} s")
+        print(f"  base64 payload : {len(to_data_url(data)) / 1e6:7.2f} MB -> {len(to_data_url(result.data)) / 1e6:7.2f} MB")
+        print(f"  image tokens   : {image_tokens(*original.size):7d} -> {image_tokens(*result.size):7d} (estimate)")
+        if args.live:
+            for label, payload in (("original", data), ("normalized", result.data)):
+                ttft, usage = live_call(payload, args.model)
+                print(f"  live {label:10s}: ttft={ttft:.2f}s prompt_tokens={getattr(usage, 'prompt_tokens', None)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""近似重複画像索引 (app.phash.HammingIndex) の検索性能
+
+    python benchmarks/bench_phash_index.py [--size 300000] [--queries 2000] [--distance 4]
+
+ランダムな 64bit ハッシュを size 件登録し、登録済みハッシュに 0〜distance ビットの
+ノイズを加えたクエリで検索する。線形走査との比較も出力する。
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.phash import HammingIndex
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=300000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--distance", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    hashes = [rng.getrandbits(64) for _ in range(args.size)]
+
+    index = HammingIndex(max_distance=args.distance)
+    start = time.perf_counter()
+    for i, h in enumerate(hashes):
+        index.add(h, i)
+    build = time.perf_counter() - start
+
+    queries = []
+    for _ in range(args.queries):
+        i = rng.randrange(args.size)
+        queries.append((i, flip_bits(hashes[i], rng.randint(0, args.distance), rng)))
+
+    timings = []
+    found = 0
+    for i, q in queries:
+        t0 = time.perf_counter()
+        results = index.search(q)
+        timings.append((time.perf_counter() - t0) * 1e6)
+        found += any(item == i for _, item in results)
+
+    linear = []
+    for _, q in queries[:20]:
+        t0 = time.perf_counter()
+        [j for j, h in enumerate(hashes) if (h ^ q).bit_count() <= args.distance]
+        linear.append((time.perf_counter() - t0) * 1e6)
+
+    timings.sort()
+    print(f"hashes: {args.size}  max distance: {args.distance}")
+    print(f"build: {build:.2f} s")
+    print(f"lookup mean: {statistics.mean(timings):8.1f} us")
+    print(f"lookup p50 : {timings[len(timings) // 2]:8.1f} us")
+    print(f"lookup p99 : {timings[int(len(timings) * 0.99)]:8.1f} us")
+    print(f"linear scan mean: {statistics.mean(linear):8.1f} us")
+    print(f"recall: {found}/{len(queries)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""質問一覧・回収のインデックス (migrations 20261018_0003) の有無による実行計画と時間の比較
+
+    python benchmarks/bench_question_indexes.py [--rows 1000000] [--repeat 5] [--database-url postgresql://...]
+
+rows 件の質問を入れた DB で、インデックスを外した状態と作った状態それぞれについて
+本部の一覧 (全校舎)・校舎の一覧・生徒の履歴・深いページ・止まったタスクの回収のクエリの
+実行計画 (SQLite は EXPLAIN QUERY PLAN、PostgreSQL は EXPLAIN ANALYZE) と所要時間を出す。
+--database-url を省くと SQLite の一時 DB を使う。指定した DB の questions などは作り直すので注意。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INDEXES = ("ix_questions_created_id", "ix_questions_school_created_id",
+           "ix_questions_user_created_id", "ix_questions_processing_updated")
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--schools", type=int, default=20)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--per-page", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.update({"DATABASE_URL": database_url, "REDIS_URL": "redis://127.0.0.1:1/0"})
+
+    from sqlalchemy import text, tuple_
+    from app import create_app, db
+    from app.models import Question, School, User, ROLE_HQ, ROLE_MANAGER, ROLE_STUDENT
+    from app.pagination import encode_cursor
+    from app.reaper import stuck_query
+    from app.services import QuestionService
+
+    app = create_app()
+    with app.app_context():
+        engine = db.engine
+        postgres = engine.dialect.name == "postgresql"
+        db.drop_all()
+        db.create_all()
+
+        schools = [School(name=f"school {i}") for i in range(args.schools)]
+        db.session.add_all(schools)
+        db.session.flush()
+        hq = User(email="hq@example.com", role=ROLE_HQ, password_hash="x")
+        manager = User(email="manager@example.com", role=ROLE_MANAGER, school_id=schools[0].id, password_hash="x")
+        students = [User(email=f"s{i}@example.com", role=ROLE_STUDENT, school_id=schools[i % len(schools)].id,
+                         password_hash="x") for i in range(args.students)]
+        db.session.add_all([hq, manager, *students])
+        db.session.commit()
+
+        start = time.perf_counter()
+        base = datetime(2024, 1, 1)
+        chunk = 50000
+        for offset in range(0, args.rows, chunk):
+            rows = []
+            for i in range(offset, min(offset + chunk, args.rows)):
+                student = students[i % len(students)]
+                created_at = base + timedelta(seconds=i // 2)
+                # 0.1% は processing のまま止まっている
+                status = "processing" if i % 1000 == 0 else "completed"
+                rows.append({"content": "bench", "user_id": student.id, "school_id": student.school_id,
+                             "created_at": created_at, "updated_at": created_at, "explanation_status": status,
+                             "explanation_generation": 1})
+            db.session.execute(Question.__table__.insert(), rows)
+        db.session.commit()
+        print(f"{engine.dialect.name}  rows: {args.rows}  insert: {time.perf_counter() - start:.1f} s")
+
+        def page(query, after=None):
+            if after is not None:
+                query = query.filter(tuple_(Question.created_at, Question.id) < tuple_(*after))
+            return (query.order_by(None)
+                    .order_by(Question.created_at.desc(), Question.id.desc())
+                    .limit(args.per_page + 1))
+
+        hq_query = QuestionService.get_visible_questions(hq)
+        deep = hq_query.order_by(None).order_by(Question.created_at.desc(), Question.id.desc()) \
+            .offset(args.rows // 2).limit(1).first()
+        deep_cursor = (deep.created_at, deep.id)
+        print(f"deep page cursor: {encode_cursor(deep)}")
+        queries = [
+            ("hq list", page(hq_query)),
+            ("hq list (deep page)", page(hq_query, deep_cursor)),
+            ("school list", page(QuestionService.get_visible_questions(manager))),
+            ("student history", page(QuestionService.get_visible_questions(students[0]))),
+            ("reaper stuck", stuck_query(1800)),
+        ]
+
+        def explain(query):
+            sql = str(query.statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            prefix = "EXPLAIN (ANALYZE, BUFFERS) " if postgres else "EXPLAIN QUERY PLAN "
+            rows = db.session.execute(text(prefix + sql)).all()
+            return [row[0] if postgres else row[-1] for row in rows]
+
+        def run(label):
+            db.session.execute(text("ANALYZE"))
+            db.session.commit()
+            print(f"\n===== {label} =====")
+            for name, query in queries:
+                ms = timed(lambda: query.all(), args.repeat)
+                print(f"\n--- {name}: {ms:.2f} ms")
+                for line in explain(query):
+                    print(f"    {line}")
+
+        table_indexes = {index.name: index for index in Question.__table__.indexes}
+        for name in INDEXES:
+            table_indexes[name].drop(bind=engine)
+        run("before (without " + ", ".join(INDEXES) + ")")
+
+        for name in INDEXES:
+            t0 = time.perf_counter()
+            table_indexes[name].create(bind=engine)
+            print(f"create {name}: {time.perf_counter() - t0:.1f} s")
+        run("after")
+
+
+if __name__ == "__main__":
+    main()
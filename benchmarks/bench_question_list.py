@@ -0,0 +1,83 @@
+"""質問一覧のページング: OFFSET (paginate) とキーセット (app.pagination) の比較
+
+    python benchmarks/bench_question_list.py [--rows 1000000] [--per-page 20] [--repeat 5]
+
+SQLite の一時 DB に rows 件の質問を入れ、本部 (全校舎) の一覧と同じクエリで
+浅いページから深いページまでの取得時間を計る。OFFSET は件数 (COUNT) も含む。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--per-page", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ.update({"DATABASE_URL": f"sqlite:///{db_path}", "REDIS_URL": "redis://127.0.0.1:1/0"})
+
+    from app import create_app, db
+    from app.models import Question, School, User, ROLE_HQ
+    from app.pagination import paginate_keyset, encode_cursor
+    from app.services import QuestionService
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        schools = [School(name=f"school {i}") for i in range(20)]
+        db.session.add_all(schools)
+        db.session.flush()
+        user = User(email="bench@example.com", role=ROLE_HQ, password_hash="x")
+        db.session.add(user)
+        db.session.commit()
+
+        start = time.perf_counter()
+        base = datetime(2024, 1, 1)
+        chunk = 50000
+        for offset in range(0, args.rows, chunk):
+            db.session.execute(Question.__table__.insert(), [
+                {"content": "bench", "user_id": user.id, "school_id": schools[i % len(schools)].id,
+                 "created_at": base + timedelta(seconds=i // 2), "explanation_status": "completed",
+                 "explanation_generation": 0}
+                for i in range(offset, min(offset + chunk, args.rows))
+            ])
+        db.session.commit()
+        print(f"rows: {args.rows}  insert: {time.perf_counter() - start:.1f} s")
+
+        query = QuestionService.get_visible_questions(user)
+        pages = [1, 10, 100, 1000, 10000, args.rows // args.per_page]
+        print(f"{'page':>8} {'offset+count ms':>16} {'keyset ms':>10}")
+        for page in pages:
+            offset_ms = timed(lambda: query.paginate(page=page, per_page=args.per_page, error_out=False).items,
+                              args.repeat)
+            # 直前のページの最後の行をカーソルにする (一覧で「次へ」を押した状態)
+            if page == 1:
+                cursor = None
+            else:
+                last = query.offset((page - 1) * args.per_page - 1).limit(1).first()
+                cursor = encode_cursor(last)
+            keyset_ms = timed(lambda: paginate_keyset(query, args.per_page, after=cursor).items, args.repeat)
+            print(f"{page:>8} {offset_ms:>16.2f} {keyset_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
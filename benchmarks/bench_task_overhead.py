@@ -0,0 +1,74 @@
+"""analyze_image_task のタスクあたりセットアップコストの計測
+
+before: 旧実装と同じく毎回 create_app() + boto3.client() + OpenAI() を作る
+after : ワーカープロセス共有のアプリ・クライアントを使い、アプリコンテキストだけ push する
+
+    python benchmarks/bench_task_overhead.py [--iterations 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+
+import boto3
+from openai import OpenAI
+from sqlalchemy import text
+from app import create_app, db
+from app.clients import get_openai_client, get_s3_client
+from app.worker import get_worker_app, task_app_context
+
+
+def per_task_setup_before():
+    app = create_app()
+    with app.app_context():
+        boto3.client(
+            "s3",
+            aws_access_key_id=app.config.get("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=app.config.get("AWS_SECRET_ACCESS_KEY"),
+            region_name=app.config.get("AWS_REGION"),
+        )
+        OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        db.session.execute(text("SELECT 1"))
+        db.session.remove()
+        db.engine.dispose()
+
+
+def per_task_setup_after():
+    with task_app_context():
+        get_s3_client()
+        get_openai_client()
+        db.session.execute(text("SELECT 1"))
+
+
+def measure(fn, iterations):
+    fn()  # import / 初回生成のコストは除外
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    get_worker_app()
+    before = measure(per_task_setup_before, args.iterations)
+    after = measure(per_task_setup_after, args.iterations)
+
+    print(f"iterations: {args.iterations}")
+    print(f"before (create_app per task): {before:8.2f} ms/task")
+    print(f"after  (worker-level setup) : {after:8.2f} ms/task")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""OpenAI 互換のローカルスタブサーバー (ベンチマーク用)
+
+/v1/chat/completions に対し、latency 秒待ってから固定テキストを返す。
+stream=true なら SSE のチャンクで返す。OPENAI_BASE_URL をこのサーバーに向けて使う。
+/v1/files と /v1/batches も最小限実装しており、バッチは作成時に即完了する
+(manage.py reprocess --batch / collect-batch のローカル確認用)。
+
+    python benchmarks/stub_openai_server.py --port 8765 --latency 1.0
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEXT = "まず問題文を読み取り、与えられた条件を整理します。次に式を立てて手順を確認します。"
+
+FILES = {}
+BATCHES = {}
+
+
+def completion_body():
+    return {
+        "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": TEXT}}],
+        "usage": {"prompt_tokens": 1000, "completion_tokens": len(TEXT), "total_tokens": 1000 + len(TEXT)},
+    }
+
+
+def store_file(data, filename, purpose):
+    file_id = f"file-{uuid.uuid4().hex[:12]}"
+    FILES[file_id] = data
+    return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "status": "processed"}
+
+
+def run_batch(body):
+    """入力ファイルの各行に固定テキストで応答し、完了済みのバッチを返す"""
+    lines = [json.loads(line) for line in FILES[body["input_file_id"]].decode("utf-8").splitlines() if line.strip()]
+    output = "".join(json.dumps({"id": f"batch_req_{i}", "custom_id": line["custom_id"], "error": None,
+                                 "response": {"status_code": 200, "request_id": f"req_{i}", "body": completion_body()}},
+                                ensure_ascii=False) + "\n"
+                     for i, line in enumerate(lines))
+    output_file = store_file(output.encode("utf-8"), "batch_output.jsonl", "batch_output")
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    BATCHES[batch_id] = {
+        "id": batch_id, "object": "batch", "endpoint": body["endpoint"], "status": "completed",
+        "input_file_id": body["input_file_id"], "output_file_id": output_file["id"], "error_file_id": None,
+        "completion_window": body["completion_window"], "created_at": int(time.time()),
+        "metadata": body.get("metadata"),
+        "request_counts": {"total": len(lines), "completed": len(lines), "failed": 0},
+    }
+    return BATCHES[batch_id]
+
+
+def make_handler(latency, ttft=None):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/v1/batches/"):
+                self._json(BATCHES[self.path.rsplit("/", 1)[1]])
+            elif self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+                self._send(FILES[self.path.split("/")[3]], "application/octet-stream")
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/v1/files":
+                return self._upload(raw)
+            body = json.loads(raw or b"{}")
+            if self.path == "/v1/batches":
+                return self._json(run_batch(body))
+            first = latency if ttft is None else ttft
+            time.sleep(first)
+            if body.get("stream"):
+                self._stream(latency - first)
+            else:
+                self._complete()
+
+        def _complete(self):
+            self._json(completion_body())
+
+        def _upload(self, raw):
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+            message = BytesParser(policy=policy.default).parsebytes(header + raw)
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields["file"]
+            self._json(store_file(upload.get_payload(decode=True), upload.get_filename(),
+                                  fields["purpose"].get_content().strip()))
+
+        def _json(self, data):
+            self._send(json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+        def _send(self, payload, content_type):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _stream(self, remaining):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            pieces = [TEXT[i:i + 4] for i in range(0, len(TEXT), 4)]
+            for i, piece in enumerate(pieces):
+                last = i == len(pieces) - 1
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                         "choices": [{"index": 0, "delta": {"content": piece},
+                                      "finish_reason": "stop" if last else None}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                if remaining > 0:
+                    time.sleep(remaining / len(pieces))
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start(port=0, latency=1.0, ttft=None):
+    """バックグラウンドスレッドで起動し、(server, base_url) を返す"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, ttft))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0)
+    args = parser.parse_args()
+    server, url = start(args.port, args.latency)
+    print(f"stub OpenAI server listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
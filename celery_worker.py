@@ -1,5 +1,13 @@
-from app import create_app, celery
+from celery.signals import worker_init, worker_process_init
+from app import celery
+from app.worker import get_worker_app, init_worker_process
 import app.tasks
 
-app = create_app()
+# ワーカープロセスごとに一度だけアプリ・DBエンジン・APIクライアントを初期化する。
+# prefork プールでは子プロセスごとに worker_process_init が、
+# solo / threads プールではメインプロセスで worker_init が呼ばれる。
+worker_process_init.connect(init_worker_process, weak=False)
+worker_init.connect(init_worker_process, weak=False)
+
+app = get_worker_app()
 app.app_context().push()
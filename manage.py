@@ -1,25 +1,49 @@
+import os
 import click
+from alembic import command
+from alembic.config import Config as AlembicConfig
 from flask import Flask
 from app import create_app, db
 from app.models import School, User, ROLE_HQ, ROLE_MANAGER, ROLE_STUDENT
 
 app = create_app()
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# init-db が db.create_all() で作っていた頃の DB はこのリビジョン相当
+INITIAL_REVISION = "20250907_0001"
+
+
+def alembic_config(connection=None):
+    """migrations/ を指す Alembic の設定 (カレントディレクトリに依存しない)"""
+    cfg = AlembicConfig(os.path.join(BASE_DIR, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(BASE_DIR, "migrations"))
+    cfg.attributes["connection"] = connection
+    return cfg
+
+
+def upgrade_db(connection):
+    """connection の DB を最新のリビジョンまで上げる"""
+    from sqlalchemy import inspect
+    cfg = alembic_config(connection)
+    inspector = inspect(connection)
+    legacy = inspector.has_table("questions") and not inspector.has_table("alembic_version")
+    # Alembic がリビジョンごとにトランザクションを張れるよう、調べた分は閉じておく
+    connection.commit()
+    if legacy:
+        # 以前の init-db (create_all + ALTER TABLE) で作った DB。足りない列は 0002 が埋める
+        command.stamp(cfg, INITIAL_REVISION)
+        connection.commit()
+    command.upgrade(cfg, "head")
+    connection.commit()
+
+
 @app.cli.command("init-db")
 def init_db():
-    """Create all tables (for local dev)."""
+    """Create / upgrade tables with the Alembic migrations."""
     with app.app_context():
-        db.create_all()
-        # Migration: Add grade column if missing
         with db.engine.connect() as conn:
-            from sqlalchemy import text
-            try:
-                conn.execute(text("ALTER TABLE questions ADD COLUMN IF NOT EXISTS grade VARCHAR(20)"))
-                conn.commit()
-                click.echo("Added grade column.")
-            except Exception as e:
-                click.echo(f"Migration warning: {e}")
-        click.echo("Tables created.")
+            upgrade_db(conn)
+        click.echo("Database is up to date.")
 
 @app.cli.command("seed")
 @click.option("--hq-email", default="hq@example.com")
@@ -53,7 +77,80 @@ def seed(hq_email, manager_email, student_email, password):
 
         db.session.add_all([hq, m, st])
         db.session.commit()
+        # 起動中のワーカーがあれば校舎一覧を読み直させる
+        from app.school_directory import invalidate
+        invalidate()
         click.echo(f"Seeded. Login: {hq_email}/{password}, {manager_email}/{password}, {student_email}/{password}")
 
+@app.cli.command("reprocess")
+@click.option("--status", "statuses", multiple=True, type=click.Choice(["failed", "processing", "pending"]),
+              default=("failed", "processing"), show_default=True)
+@click.option("--school-id", type=int, default=None)
+@click.option("--older-than", type=int, default=30, show_default=True, help="Minutes since the question was posted (failed / pending). "
+                   "Processing questions use the REAPER_LEASE_SECONDS heartbeat instead.")
+@click.option("--limit", type=int, default=None)
+@click.option("--chunk-size", type=int, default=50, show_default=True)
+@click.option("--rate", type=float, default=2.0, show_default=True, help="Max tasks enqueued per second.")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), default=None, help="Resume file (JSON).")
+@click.option("--dry-run", is_flag=True)
+@click.option("--batch", "use_batch", is_flag=True, help="Submit each chunk to the provider batch API.")
+def reprocess(statuses, school_id, older_than, limit, chunk_size, rate, checkpoint, dry_run, use_batch):
+    """Re-enqueue failed / stuck explanations."""
+    from app.reprocess import Checkpoint, candidate_query, reprocess as run_reprocess
+    with app.app_context():
+        state = Checkpoint(checkpoint)
+        if state.last_id:
+            click.echo(f"Resuming after question id {state.last_id}")
+        query = candidate_query(statuses, school_id, older_than)
+        summary = run_reprocess(query, state, chunk_size=chunk_size, rate=rate, limit=limit,
+                                dry_run=dry_run, use_batch=use_batch, echo=click.echo)
+        click.echo(f"Done. selected={summary['selected']} enqueued={summary['enqueued']} skipped={summary['skipped']}")
+        for batch_id in summary["batches"]:
+            click.echo(f"Batch submitted: {batch_id} (collect with: flask --app manage collect-batch {batch_id})")
+
+@app.cli.command("collect-batch")
+@click.argument("batch_ids", nargs=-1)
+@click.option("--checkpoint", type=click.Path(dir_okay=False), default=None, help="Collect batches recorded here.")
+def collect_batch(batch_ids, checkpoint):
+    """Apply results of finished reprocess batches."""
+    from app.batch import collect_batch as run_collect
+    from app.reprocess import Checkpoint
+    with app.app_context():
+        state = Checkpoint(checkpoint) if checkpoint else None
+        pending = list(batch_ids) + (state.batches if state else [])
+        for batch_id in pending:
+            batch, summary = run_collect(batch_id)
+            if summary is None:
+                click.echo(f"{batch_id}: {batch.status} (not finished yet)")
+                continue
+            click.echo(f"{batch_id}: {batch.status} completed={summary['completed']} "
+                       f"failed={summary['failed']} skipped={summary['skipped']}")
+            if state and batch_id in state.batches:
+                state.batches.remove(batch_id)
+                state.save()
+
+@app.cli.command("reap-stuck")
+@click.option("--lease", "lease_seconds", type=int, default=None,
+              help="Seconds without a heartbeat before a processing question counts as stuck (default: REAPER_LEASE_SECONDS).")
+@click.option("--limit", type=int, default=500, show_default=True)
+@click.option("--fail", "fail_all", is_flag=True, help="Mark stuck questions failed instead of re-enqueueing them.")
+@click.option("--dry-run", is_flag=True)
+def reap_stuck(lease_seconds, limit, fail_all, dry_run):
+    """Re-enqueue or fail explanations left in processing by a dead worker."""
+    from app.reaper import reap
+    with app.app_context():
+        summary = reap(lease_seconds, limit=limit, fail_all=fail_all, dry_run=dry_run)
+        click.echo(f"Done. found={summary['found']} requeued={summary['requeued']} failed={summary['failed']} "
+                   f"skipped={summary['skipped']}" + (" (dry run)" if dry_run else ""))
+
+@app.cli.command("backfill-thumbnails")
+@click.option("--limit", type=int, default=500, show_default=True)
+def backfill_thumbnails(limit):
+    """Create list thumbnails for questions posted before thumbnails existed."""
+    from app.thumbnails import backfill
+    with app.app_context():
+        summary = backfill(limit, echo=click.echo)
+        click.echo(f"Done. created={summary['created']} failed={summary['failed']}")
+
 if __name__ == "__main__":
     app.run()
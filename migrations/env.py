@@ -5,11 +5,14 @@ from alembic import context
 
 # this is the Alembic Config object, which provides access to the values within the .ini file
 config = context.config
-fileConfig(config.config_file_name)
+# manage.py init-db から呼ばれたときにアプリのロガーを無効にしない
+fileConfig(config.config_file_name, disable_existing_loggers=False)
 
 # Import Flask app to get metadata & DB URL
+# (manage.py init-db から呼ばれたときは実行中のアプリをそのまま使う)
+from flask import current_app, has_app_context
 from app import create_app, db
-app = create_app()
+app = current_app._get_current_object() if has_app_context() else create_app()
 with app.app_context():
     target_metadata = db.metadata
     # Override DB URL from Flask config (DATABASE_URL / normalized)
@@ -28,11 +31,22 @@ def run_migrations_offline():
         context.run_migrations()
 
 def run_migrations_online():
+    # 呼び出し側が接続を渡した場合 (manage.py init-db / テスト) はそれを使う。
+    # CREATE INDEX CONCURRENTLY (autocommit_block) があるのでリビジョンごとにトランザクションを分ける
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        context.configure(connection=connection, target_metadata=target_metadata, compare_type=True,
+                          transaction_per_migration=True)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section), prefix="sqlalchemy.", poolclass=pool.NullPool
     )
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata, compare_type=True)
+        context.configure(connection=connection, target_metadata=target_metadata, compare_type=True,
+                          transaction_per_migration=True)
         with context.begin_transaction():
             context.run_migrations()
 
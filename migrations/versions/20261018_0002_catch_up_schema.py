@@ -0,0 +1,205 @@
+"""catch up schema (columns and tables previously added by manage.py init-db)
+
+Revision ID: 20261018_0002
+Revises: 20250907_0001
+Create Date: 2026-10-18 00:00:00
+
+init-db の COLUMN_MIGRATIONS (ALTER TABLE ... IF NOT EXISTS) と db.create_all() で
+追加していた列・テーブルをマイグレーションに移したもの。
+既存の DB はどこまで適用済みか分からないので、存在するものは作らない。
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0002'
+down_revision = '20250907_0001'
+branch_labels = None
+depends_on = None
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+# --sql (オフライン) では DB を見られないので、何も無い前提で SQL を出す
+def _has_table(name):
+    return not context.is_offline_mode() and _inspector().has_table(name)
+
+
+def _has_column(table, column):
+    return not context.is_offline_mode() and column in {c["name"] for c in _inspector().get_columns(table)}
+
+
+def _has_index(table, name):
+    return not context.is_offline_mode() and name in {i["name"] for i in _inspector().get_indexes(table)}
+
+
+def _add_column(table, column):
+    if not _has_column(table, column.name):
+        op.add_column(table, column)
+
+
+def _create_index(name, table, columns, **kwargs):
+    if not _has_index(table, name):
+        op.create_index(name, table, columns, **kwargs)
+
+
+def upgrade():
+    # --- questions: AI解説用の列 ---
+    _add_column('questions', sa.Column('image_path', sa.String(length=255), nullable=True))
+    _add_column('questions', sa.Column('grade', sa.String(length=20), nullable=True))
+    _add_column('questions', sa.Column('explanation', sa.Text(), nullable=True))
+    _add_column('questions', sa.Column('explanation_status', sa.String(length=20), nullable=True))
+    _add_column('questions', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    _add_column('questions', sa.Column('image_phash', sa.String(length=16), nullable=True))
+    _add_column('questions', sa.Column('explanation_generation', sa.Integer(), nullable=False, server_default='0'))
+    _add_column('questions', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    _add_column('questions', sa.Column('thumbnail_path', sa.String(length=255), nullable=True))
+    op.execute("UPDATE questions SET updated_at = created_at WHERE updated_at IS NULL")
+    _create_index('ix_questions_status_id', 'questions', ['explanation_status', 'id'])
+
+    # --- schools: 月間予算 ---
+    _add_column('schools', sa.Column('monthly_budget_soft_usd', sa.Float(), nullable=True))
+    _add_column('schools', sa.Column('monthly_budget_hard_usd', sa.Float(), nullable=True))
+
+    # 0001 は ix_audit_timestamp で作ったが、モデル (index=True) の名前は ix_audit_logs_timestamp
+    _create_index('ix_audit_logs_timestamp', 'audit_logs', ['timestamp'])
+    if _has_index('audit_logs', 'ix_audit_timestamp'):
+        op.drop_index('ix_audit_timestamp', table_name='audit_logs')
+
+    if not _has_table('explanation_cache'):
+        op.create_table(
+            'explanation_cache',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('content_hash', sa.String(length=64), nullable=False),
+            sa.Column('grade', sa.String(length=20), nullable=False),
+            sa.Column('explanation', sa.Text(), nullable=False),
+            sa.Column('image_path', sa.String(length=255), nullable=True),
+            sa.Column('source_question_id', sa.Integer(), sa.ForeignKey('questions.id'), nullable=True),
+            sa.Column('hit_count', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('last_hit_at', sa.DateTime(), nullable=True),
+            sa.UniqueConstraint('content_hash', 'grade', name='uq_explanation_cache_hash_grade'),
+        )
+
+    if not _has_table('follow_up_threads'):
+        op.create_table(
+            'follow_up_threads',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('question_id', sa.Integer(), sa.ForeignKey('questions.id'), nullable=False, unique=True),
+            sa.Column('summary', sa.Text(), nullable=False),
+            sa.Column('summary_position', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+        )
+
+    if not _has_table('follow_ups'):
+        op.create_table(
+            'follow_ups',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('thread_id', sa.Integer(), sa.ForeignKey('follow_up_threads.id'), nullable=False),
+            sa.Column('position', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('question_text', sa.Text(), nullable=False),
+            sa.Column('text_hash', sa.String(length=64), nullable=False),
+            sa.Column('answer', sa.Text(), nullable=True),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('job_id', sa.String(length=32), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('answered_at', sa.DateTime(), nullable=True),
+            sa.UniqueConstraint('thread_id', 'position', name='uq_follow_ups_thread_position'),
+        )
+    _create_index('ix_follow_ups_thread_hash', 'follow_ups', ['thread_id', 'text_hash'])
+
+    if not _has_table('task_runs'):
+        op.create_table(
+            'task_runs',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('question_id', sa.Integer(), sa.ForeignKey('questions.id'), nullable=False),
+            sa.Column('task_id', sa.String(length=64), nullable=True),
+            sa.Column('lane', sa.String(length=20), nullable=True),
+            sa.Column('attempt', sa.Integer(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=True),
+            sa.Column('error', sa.String(length=500), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('queue_wait_ms', sa.Integer(), nullable=True),
+            sa.Column('db_fetch_ms', sa.Integer(), nullable=True),
+            sa.Column('image_fetch_ms', sa.Integer(), nullable=True),
+            sa.Column('phash_ms', sa.Integer(), nullable=True),
+            sa.Column('presign_ms', sa.Integer(), nullable=True),
+            sa.Column('ratelimit_wait_ms', sa.Integer(), nullable=True),
+            sa.Column('model_ttft_ms', sa.Integer(), nullable=True),
+            sa.Column('model_total_ms', sa.Integer(), nullable=True),
+            sa.Column('persist_ms', sa.Integer(), nullable=True),
+            sa.Column('total_ms', sa.Integer(), nullable=True),
+        )
+    _create_index('ix_task_runs_question_id', 'task_runs', ['question_id'])
+    _create_index('ix_task_runs_created_at', 'task_runs', ['created_at'])
+
+    if not _has_table('usage_events'):
+        op.create_table(
+            'usage_events',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('kind', sa.String(length=20), nullable=False),
+            sa.Column('model', sa.String(length=64), nullable=True),
+            sa.Column('question_id', sa.Integer(), sa.ForeignKey('questions.id'), nullable=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+            sa.Column('school_id', sa.Integer(), sa.ForeignKey('schools.id'), nullable=True),
+            sa.Column('input_tokens', sa.Integer(), nullable=False),
+            sa.Column('cached_tokens', sa.Integer(), nullable=False),
+            sa.Column('output_tokens', sa.Integer(), nullable=False),
+            sa.Column('cost_micros', sa.BigInteger(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+        )
+    _create_index('ix_usage_events_question_id', 'usage_events', ['question_id'])
+    _create_index('ix_usage_events_user_id', 'usage_events', ['user_id'])
+    _create_index('ix_usage_events_created_at', 'usage_events', ['created_at'])
+
+    if not _has_table('usage_rollups'):
+        op.create_table(
+            'usage_rollups',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('period', sa.String(length=10), nullable=False),
+            sa.Column('bucket_start', sa.DateTime(), nullable=False),
+            sa.Column('school_id', sa.Integer(), sa.ForeignKey('schools.id'), nullable=False),
+            sa.Column('kind', sa.String(length=20), nullable=False),
+            sa.Column('requests', sa.Integer(), nullable=False),
+            sa.Column('input_tokens', sa.BigInteger(), nullable=False),
+            sa.Column('cached_tokens', sa.BigInteger(), nullable=False),
+            sa.Column('output_tokens', sa.BigInteger(), nullable=False),
+            sa.Column('cost_micros', sa.BigInteger(), nullable=False),
+            sa.UniqueConstraint('period', 'bucket_start', 'school_id', 'kind', name='uq_usage_rollups_bucket'),
+        )
+    _create_index('ix_usage_rollups_school_period', 'usage_rollups', ['school_id', 'period', 'bucket_start'])
+
+
+def downgrade():
+    op.drop_index('ix_usage_rollups_school_period', table_name='usage_rollups')
+    op.drop_table('usage_rollups')
+    op.drop_index('ix_usage_events_created_at', table_name='usage_events')
+    op.drop_index('ix_usage_events_user_id', table_name='usage_events')
+    op.drop_index('ix_usage_events_question_id', table_name='usage_events')
+    op.drop_table('usage_events')
+    op.drop_index('ix_task_runs_created_at', table_name='task_runs')
+    op.drop_index('ix_task_runs_question_id', table_name='task_runs')
+    op.drop_table('task_runs')
+    op.drop_index('ix_follow_ups_thread_hash', table_name='follow_ups')
+    op.drop_table('follow_ups')
+    op.drop_table('follow_up_threads')
+    op.drop_table('explanation_cache')
+
+    op.create_index('ix_audit_timestamp', 'audit_logs', ['timestamp'])
+    op.drop_index('ix_audit_logs_timestamp', table_name='audit_logs')
+
+    with op.batch_alter_table('schools') as batch_op:
+        batch_op.drop_column('monthly_budget_hard_usd')
+        batch_op.drop_column('monthly_budget_soft_usd')
+
+    op.drop_index('ix_questions_status_id', table_name='questions')
+    # 0003 の downgrade で戻した以前の init-db のインデックス
+    if _has_index('questions', 'ix_questions_status_updated'):
+        op.drop_index('ix_questions_status_updated', table_name='questions')
+    with op.batch_alter_table('questions') as batch_op:
+        for column in ('thumbnail_path', 'updated_at', 'explanation_generation', 'image_phash',
+                       'content_hash', 'explanation_status', 'explanation', 'grade', 'image_path'):
+            batch_op.drop_column(column)
@@ -0,0 +1,55 @@
+"""question list / reaper indexes
+
+Revision ID: 20261018_0003
+Revises: 20261018_0002
+Create Date: 2026-10-18 00:00:01
+
+一覧のキーセットページング (本部の全校舎 / 校舎別 / 生徒本人) 用の複合インデックスと、
+止まったタスクの回収用の processing の行だけの部分インデックス。
+一覧は created_at desc, id desc で読むが、昇順のインデックスを逆向きに走査すれば足りるので
+列はすべて昇順にしている (created_at DESC, id のように向きを混ぜると逆に使えなくなる)。
+PostgreSQL では CREATE INDEX CONCURRENTLY で書き込みを止めずに作る。
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0003'
+down_revision = '20261018_0002'
+branch_labels = None
+depends_on = None
+
+PROCESSING = sa.text("explanation_status = 'processing'")
+
+INDEXES = [
+    ('ix_questions_created_id', ['created_at', 'id'], {}),
+    ('ix_questions_school_created_id', ['school_id', 'created_at', 'id'], {}),
+    ('ix_questions_user_created_id', ['user_id', 'created_at', 'id'], {}),
+    ('ix_questions_processing_updated', ['updated_at'],
+     {'postgresql_where': PROCESSING, 'sqlite_where': PROCESSING}),
+]
+
+
+def _has_index(name):
+    if context.is_offline_mode():
+        return name == 'ix_questions_status_updated'
+    return name in {i["name"] for i in sa.inspect(op.get_bind()).get_indexes('questions')}
+
+
+def upgrade():
+    # CONCURRENTLY はトランザクションの中では使えない
+    with op.get_context().autocommit_block():
+        for name, columns, kwargs in INDEXES:
+            if not _has_index(name):
+                op.create_index(name, 'questions', columns, postgresql_concurrently=True, **kwargs)
+        # 以前の init-db が作っていた (explanation_status, updated_at)。部分インデックスで置き換える
+        if _has_index('ix_questions_status_updated'):
+            op.drop_index('ix_questions_status_updated', table_name='questions', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_questions_status_updated', 'questions', ['explanation_status', 'updated_at'],
+                        postgresql_concurrently=True)
+        for name, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name='questions', postgresql_concurrently=True)
@@ -0,0 +1,43 @@
+"""question image key indexes
+
+Revision ID: 20261018_0004
+Revises: 20261018_0003
+Create Date: 2026-10-18 00:00:02
+
+/media/<key> の閲覧権限の確認と LocalStorage.delete の参照確認は
+image_path / thumbnail_path = key で質問を探すので、画像1枚ごとに全件走査にならないようにする。
+PostgreSQL では 0003 と同じく CREATE INDEX CONCURRENTLY で作る。
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0004'
+down_revision = '20261018_0003'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_questions_image_path', ['image_path']),
+    ('ix_questions_thumbnail_path', ['thumbnail_path']),
+]
+
+
+def _has_index(name):
+    if context.is_offline_mode():
+        return False
+    return name in {i["name"] for i in sa.inspect(op.get_bind()).get_indexes('questions')}
+
+
+def upgrade():
+    # CONCURRENTLY はトランザクションの中では使えない
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES:
+            if not _has_index(name):
+                op.create_index(name, 'questions', columns, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(INDEXES):
+            op.drop_index(name, table_name='questions', postgresql_concurrently=True)
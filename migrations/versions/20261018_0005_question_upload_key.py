@@ -0,0 +1,48 @@
+"""question upload key
+
+Revision ID: 20261018_0005
+Revises: 20261018_0004
+Create Date: 2026-10-18 00:00:03
+
+直接アップロードの完了通知 (/api/uploads/confirm) の再送で同じ質問を返すため、
+アップロードのキーを questions.upload_key に残す。ワーカーの取り込みで image_path は
+内容アドレスのキーに変わるので、image_path では引けない。
+同時に届いた通知で質問が2件できないよう一意インデックスにする (NULL は重複可)。
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0005'
+down_revision = '20261018_0004'
+branch_labels = None
+depends_on = None
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def _has_column(name):
+    return not context.is_offline_mode() and name in {c["name"] for c in _inspector().get_columns('questions')}
+
+
+def _has_index(name):
+    return not context.is_offline_mode() and name in {i["name"] for i in _inspector().get_indexes('questions')}
+
+
+def upgrade():
+    if not _has_column('upload_key'):
+        op.add_column('questions', sa.Column('upload_key', sa.String(length=255), nullable=True))
+    # CONCURRENTLY はトランザクションの中では使えない
+    with op.get_context().autocommit_block():
+        if not _has_index('ix_questions_upload_key'):
+            op.create_index('ix_questions_upload_key', 'questions', ['upload_key'], unique=True,
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_questions_upload_key', table_name='questions', postgresql_concurrently=True)
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_column('upload_key')
@@ -1,14 +1,21 @@
+import io
 import pytest
 from app import create_app, db
-from app.models import User, School, ROLE_STUDENT, ROLE_MANAGER, ROLE_HQ
+from app.models import Question, User, School, ROLE_STUDENT, ROLE_MANAGER, ROLE_HQ
 
 @pytest.fixture
 def app():
+    from app.storage import reset_storage
+    from app.school_directory import reset_directory
+    reset_storage()
+    # テストごとに DB を作り直すので、前のテストの校舎一覧を持ち越さない
+    reset_directory()
     app = create_app()
     app.config.update({
         "TESTING": True,
         "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
         "WTF_CSRF_ENABLED": False,  # テスト時はCSRF無効化
+        "QUERY_BUDGET_STRICT": True,  # @query_budget の超過 (N+1 の退行) でテストを落とす
     })
 
     with app.app_context():
@@ -17,6 +24,22 @@ def app():
         db.session.remove()
         db.drop_all()
 
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    """Redis を使う機能 (メトリクス等) はテストでは fakeredis に向ける"""
+    try:
+        import fakeredis
+    except ImportError:
+        yield None
+        return
+    from app import clients, ratelimit
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(clients, "_redis_client", r)
+    # Redis クライアントを保持するプロセス共有オブジェクトも作り直させる
+    monkeypatch.setattr(ratelimit, "_limiter", None)
+    monkeypatch.setattr(ratelimit, "_controller", None)
+    yield r
+
 @pytest.fixture
 def client(app):
     return app.test_client()
@@ -52,3 +75,97 @@ def seed_data(app):
         "manager": manager,
         "hq": hq
     }
+
+@pytest.fixture
+def make_question(seed_data):
+    """生徒 (school_a) の画像の質問を作る。status / generation / updated_at と列の値はキーワードで上書きする"""
+    def make(status="processing", generation=1, updated_at=None, **kwargs):
+        values = {"content": "[画像による質問]", "user_id": seed_data["student"].id,
+                  "school_id": seed_data["school_a"].id,
+                  "image_path": "https://bucket.s3.ap-northeast-1.amazonaws.com/abc.jpg", "grade": "middle"}
+        values.update(kwargs)
+        q = Question(explanation_status=status, explanation_generation=generation, **values)
+        db.session.add(q)
+        db.session.commit()
+        if updated_at is not None:
+            # onupdate で上書きされないよう UPDATE で直接設定する
+            Question.query.filter_by(id=q.id).update({Question.updated_at: updated_at})
+            db.session.commit()
+        return q
+    return make
+
+class _StubCompletions:
+    def __init__(self, content):
+        from types import SimpleNamespace
+        self.content = content
+        self.calls = []
+        self.headers = {}
+        self.usage = None  # 設定すると最後に usage のみのチャンクを返す
+        self.with_raw_response = SimpleNamespace(create=self._create_raw)
+
+    def _create_raw(self, **kwargs):
+        from types import SimpleNamespace
+        result = self.create(**kwargs)
+        return SimpleNamespace(headers=self.headers, parse=lambda: result)
+
+    def create(self, **kwargs):
+        from types import SimpleNamespace
+        self.calls.append(kwargs)
+        if kwargs.get("stream"):
+            # 2文字ずつのチャンクで返す
+            pieces = [self.content[i:i + 2] for i in range(0, len(self.content), 2)]
+            chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p), finish_reason=None)])
+                      for p in pieces]
+            chunks.append(SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")]))
+            if self.usage is not None:
+                chunks.append(SimpleNamespace(choices=[], usage=self.usage))
+            return iter(chunks)
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+class _StubS3:
+    def __init__(self):
+        self.objects = {}
+        self.presign_calls = 0
+        self.extra_args = {}
+
+    def get_object(self, Bucket=None, Key=None):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def generate_presigned_url(self, operation, Params=None, ExpiresIn=None):
+        self.presign_calls += 1
+        return f"https://stub-s3.local/{Params['Key']}?expires={ExpiresIn}"
+
+    def upload_fileobj(self, file_obj, Bucket=None, Key=None, ExtraArgs=None):
+        self.objects[Key] = file_obj.read()
+        self.extra_args[Key] = ExtraArgs
+
+    def generate_presigned_post(self, Bucket=None, Key=None, Fields=None, Conditions=None, ExpiresIn=None):
+        self.post_conditions = Conditions
+        return {"url": f"https://stub-s3.local/{Bucket}", "fields": dict(Fields or {}, key=Key)}
+
+    def head_object(self, Bucket=None, Key=None):
+        if Key not in self.objects:
+            raise KeyError(Key)
+        return {"ContentLength": len(self.objects[Key]), "ContentType": "image/png"}
+
+    def delete_object(self, Bucket=None, Key=None):
+        self.objects.pop(Key, None)
+
+@pytest.fixture
+def stub_openai(monkeypatch):
+    """プロセス共有の OpenAI クライアントをスタブに差し替える"""
+    from types import SimpleNamespace
+    from app import clients
+    completions = _StubCompletions("スタブ解説")
+    monkeypatch.setattr(clients, "_openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    return completions
+
+@pytest.fixture
+def stub_s3(monkeypatch):
+    from app import clients
+    from app.utils_s3 import clear_presign_cache
+    s3 = _StubS3()
+    monkeypatch.setattr(clients, "_s3_client", s3)
+    clear_presign_cache()
+    return s3
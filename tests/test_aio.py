@@ -0,0 +1,68 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from app import db, clients
+from app.aio import AsyncExecutor
+from app.models import Question
+from app.pipeline import run_explanation_async
+
+LATENCY = 0.3
+
+class _StubAsyncStream:
+    def __init__(self, text):
+        self.text = text
+
+    async def __aiter__(self):
+        for piece in (self.text[:2], self.text[2:]):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece), finish_reason=None)])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")])
+
+class _StubAsyncCompletions:
+    """人工的な遅延で応答する AsyncOpenAI 互換スタブ"""
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+        self.with_raw_response = SimpleNamespace(create=self._create_raw)
+
+    async def _create_raw(self, **kwargs):
+        stream = await self.create(**kwargs)
+        return SimpleNamespace(headers={}, parse=lambda: stream)
+
+    async def create(self, **kwargs):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(LATENCY)
+        self.in_flight -= 1
+        return _StubAsyncStream("非同期スタブ解説")
+
+@pytest.fixture
+def stub_async_openai(monkeypatch):
+    completions = _StubAsyncCompletions()
+    monkeypatch.setattr(clients, "_async_openai_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    return completions
+
+def test_async_executor_runs_model_calls_concurrently(app, seed_data, stub_async_openai, stub_s3):
+    app.config["PHASH_ENABLED"] = False
+    questions = [Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                          image_path=f"https://b/{i}.jpg", explanation_status="processing") for i in range(10)]
+    db.session.add_all(questions)
+    db.session.commit()
+    ids = [q.id for q in questions]
+
+    # in-memory SQLite は接続を共有するので DB スレッドは1本
+    executor = AsyncExecutor(app, max_in_flight=4, db_workers=1).start()
+    try:
+        start = time.perf_counter()
+        futures = [executor.submit(run_explanation_async(qid, executor)) for qid in ids]
+        results = [f.result(timeout=10) for f in futures]
+        elapsed = time.perf_counter() - start
+    finally:
+        executor.shutdown()
+
+    assert all(r["status"] == "completed" for r in results)
+    assert stub_async_openai.peak == 4
+    # 逐次なら 10 * LATENCY = 3 秒かかる
+    assert elapsed < 10 * LATENCY / 2
+    db.session.expire_all()
+    assert {q.explanation for q in Question.query.all()} == {"非同期スタブ解説"}
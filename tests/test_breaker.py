@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+import openai
+import pytest
+from app import db
+from app.breaker import (CircuitBreaker, CircuitOpenError, classify, get_breaker,
+                         CLOSED, OPEN, HALF_OPEN, OPENAI, PERMANENT, RETRYABLE)
+from app.models import Question
+from app.pipeline import PERMANENT_FAILURE_MESSAGE
+from app.tasks import analyze_image_task
+
+def _status_error(cls, status):
+    response = SimpleNamespace(status_code=status, headers={}, request=None)
+    return cls("error", response=response, body=None)
+
+def test_classify_errors(app):
+    assert classify(_status_error(openai.BadRequestError, 400)) == PERMANENT
+    assert classify(_status_error(openai.InternalServerError, 503)) == RETRYABLE
+    assert classify(_status_error(openai.RateLimitError, 429)) == RETRYABLE
+    assert classify(openai.APITimeoutError(request=None)) == RETRYABLE
+
+def test_breaker_opens_and_half_open_probe_closes(app, fake_redis, monkeypatch):
+    breaker = CircuitBreaker("test", fake_redis, failure_threshold=3, window=60, open_seconds=30)
+    for _ in range(3):
+        with pytest.raises(openai.InternalServerError):
+            with breaker.guard():
+                raise _status_error(openai.InternalServerError, 500)
+    assert breaker.state()[0] == OPEN
+    with pytest.raises(CircuitOpenError):
+        with breaker.guard():
+            pass
+
+    # open 期間が過ぎると1件だけ試行できる
+    import app.breaker as breaker_module
+    now = breaker_module.time.time()
+    monkeypatch.setattr(breaker_module.time, "time", lambda: now + 31)
+    assert breaker.state()[0] == HALF_OPEN
+    probe = breaker.guard()
+    probe.__enter__()
+    with pytest.raises(CircuitOpenError):
+        with breaker.guard():
+            pass
+    probe.__exit__(None, None, None)
+    assert breaker.state()[0] == CLOSED
+
+def test_permanent_error_fails_without_retry(app, stub_openai, stub_s3, monkeypatch, make_question):
+    q = make_question()
+
+    def reject(**kwargs):
+        stub_openai.calls.append(kwargs)
+        raise _status_error(openai.BadRequestError, 400)
+    monkeypatch.setattr(stub_openai, "create", reject)
+
+    result = analyze_image_task.apply(args=[q.id], kwargs={"generation": 1}).get()
+
+    assert result["status"] == "failed"
+    assert len(stub_openai.calls) == 1
+    db.session.expire_all()
+    row = db.session.get(Question, q.id)
+    assert (row.explanation_status, row.explanation) == ("failed", PERMANENT_FAILURE_MESSAGE)
+
+def test_open_circuit_defers_task_without_calling_model(app, stub_openai, stub_s3, monkeypatch, make_question):
+    q = make_question()
+    breaker = get_breaker(OPENAI)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    sent = []
+    monkeypatch.setattr("app.tasks.analyze_image_task.apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="t"))
+
+    result = analyze_image_task.apply(args=[q.id], kwargs={"lane": "manual", "generation": 1}).get()
+
+    assert result["status"] == "deferred"
+    assert stub_openai.calls == []
+    assert sent[0]["queue"] == "explain.manual"
+    assert sent[0]["countdown"] >= 1
+    db.session.expire_all()
+    assert db.session.get(Question, q.id).explanation_status == "processing"
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+import app.tasks
+from app import db
+from app.models import Question
+from app.services import QuestionService
+from app.tasks import analyze_image_task
+
+def test_claim_succeeds_once(app, make_question):
+    q = make_question(status="failed", generation=3)
+    qid = q.id
+
+    assert QuestionService.claim_explanation(qid) == 4
+    assert QuestionService.claim_explanation(qid) is None
+    row = db.session.get(Question, qid)
+    assert (row.explanation_status, row.explanation_generation) == ("processing", 4)
+
+def test_repeated_explain_posts_dispatch_once(client, monkeypatch, make_question):
+    q = make_question(status="failed", generation=0)
+    qid = q.id
+    sent = []
+    monkeypatch.setattr(app.tasks.analyze_image_task, "apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="stub-task"))
+
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+    client.post(f"/questions/{qid}/explain")
+    client.post(f"/questions/{qid}/explain")
+
+    assert len(sent) == 1
+    assert sent[0]["kwargs"]["generation"] == 1
+
+def test_stale_task_exits_without_model_call(app, stub_openai, stub_s3, make_question):
+    q = make_question(generation=2)
+
+    result = analyze_image_task.apply(args=[q.id], kwargs={"generation": 1}).get()
+
+    assert result["status"] == "skipped"
+    assert stub_openai.calls == []
+    db.session.expire_all()
+    assert db.session.get(Question, q.id).explanation_status == "processing"
+
+def test_current_claim_completes(app, stub_openai, stub_s3, make_question):
+    q = make_question(generation=2)
+
+    result = analyze_image_task.apply(args=[q.id], kwargs={"generation": 2}).get()
+    assert result["status"] == "completed"
+
+    # 完了後に同じメッセージが再配信されても再実行しない
+    again = analyze_image_task.apply(args=[q.id], kwargs={"generation": 2}).get()
+    assert again["status"] == "skipped"
+    assert len(stub_openai.calls) == 1
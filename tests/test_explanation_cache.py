@@ -0,0 +1,85 @@
+import io
+from app import db
+from app.models import Question, ExplanationCache
+from app.services import ExplanationCacheService
+
+IMAGE = b"\x89PNG fake image bytes"
+
+def _login_student(client):
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+
+def test_cache_hit_skips_upload_and_task(client, seed_data, monkeypatch):
+    source = Question(content="[画像による質問]", user_id=seed_data["student"].id,
+                      school_id=seed_data["school_a"].id, image_path="https://b/abc.png", grade="middle",
+                      content_hash=ExplanationCacheService.content_hash(IMAGE),
+                      explanation="キャッシュ済み解説", explanation_status="completed")
+    db.session.add(source)
+    db.session.commit()
+    ExplanationCacheService.store(source)
+    db.session.commit()
+
+    import app.utils_s3
+    import app.tasks
+    monkeypatch.setattr(app.utils_s3, "upload_file_to_s3", lambda *a, **k: (_ for _ in ()).throw(AssertionError("uploaded")))
+    monkeypatch.setattr(app.tasks.analyze_image_task, "apply_async", lambda *a, **k: (_ for _ in ()).throw(AssertionError("dispatched")))
+
+    _login_student(client)
+    resp = client.post("/questions/new", data={"grade": "middle", "image": (io.BytesIO(IMAGE), "q.png")},
+                       content_type="multipart/form-data", follow_redirects=True)
+    assert resp.status_code == 200
+
+    q = Question.query.order_by(Question.id.desc()).first()
+    assert q.id != source.id
+    assert q.explanation_status == "completed"
+    assert q.explanation == "キャッシュ済み解説"
+    assert q.image_path == "https://b/abc.png"
+    assert ExplanationCache.query.one().hit_count == 1
+    assert ExplanationCacheService.stats()["hits"] == 1
+
+def test_cache_is_keyed_by_grade(app, seed_data):
+    h = ExplanationCacheService.content_hash(IMAGE)
+    q = Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                 grade="middle", content_hash=h, explanation="中学生向け", explanation_status="completed")
+    db.session.add(q)
+    db.session.commit()
+    ExplanationCacheService.store(q)
+    ExplanationCacheService.store(q)  # 二重登録は無視される
+    db.session.commit()
+
+    assert ExplanationCacheService.lookup(h, "high") is None
+    assert ExplanationCacheService.lookup(h, "middle").explanation == "中学生向け"
+    assert ExplanationCache.query.count() == 1
+
+def _png(maker):
+    from PIL import Image
+    exif = Image.Exif()
+    exif[0x010F] = maker
+    out = io.BytesIO()
+    Image.new("RGB", (40, 30), (10, 160, 90)).save(out, format="PNG", exif=exif.tobytes())
+    return out.getvalue()
+
+def test_cache_hit_ignores_metadata_differences(client, seed_data, monkeypatch):
+    from app.imaging import normalize_image
+    config = client.application.config
+    # 同じ写真をメタデータ違いで再エンコードしたもの
+    first, second = _png("PhoneA"), _png("PhoneB")
+    assert first != second
+    normalized = normalize_image(first, config["IMAGE_MAX_EDGE"], config["IMAGE_JPEG_QUALITY"])
+    source = Question(content="[画像による質問]", user_id=seed_data["student"].id,
+                      school_id=seed_data["school_a"].id, image_path="https://b/abc.jpg", grade="middle",
+                      content_hash=ExplanationCacheService.content_hash(normalized.data),
+                      explanation="キャッシュ済み解説", explanation_status="completed")
+    db.session.add(source)
+    db.session.commit()
+    ExplanationCacheService.store(source)
+    db.session.commit()
+
+    import app.tasks
+    monkeypatch.setattr(app.tasks.analyze_image_task, "apply_async", lambda *a, **k: (_ for _ in ()).throw(AssertionError("dispatched")))
+    _login_student(client)
+    client.post("/questions/new", data={"grade": "middle", "image": (io.BytesIO(second), "q.png")},
+                content_type="multipart/form-data")
+
+    q = Question.query.order_by(Question.id.desc()).first()
+    assert q.id != source.id
+    assert (q.explanation_status, q.explanation) == ("completed", "キャッシュ済み解説")
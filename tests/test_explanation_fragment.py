@@ -0,0 +1,51 @@
+import re
+from app import db
+from app.models import Question
+from app.querycount import count_queries
+
+EXPLANATION = "長い解説。" * 2000
+
+def _completed(seed_data, school="school_a", n=1):
+    qs = [Question(content=f"q{i}", user_id=seed_data["student"].id, school_id=seed_data[school].id,
+                   explanation=EXPLANATION, explanation_status="completed") for i in range(n)]
+    db.session.add_all(qs)
+    db.session.commit()
+    return qs
+
+def _login(client, email):
+    client.post("/auth/login", data={"email": email, "password": "password"})
+
+def test_list_does_not_load_or_render_explanations(app, client, seed_data):
+    qs = _completed(seed_data, n=5)
+    _login(client, "manager@example.com")
+    db.session.expire_all()
+
+    with count_queries() as stats:
+        html = client.get("/questions").get_data(as_text=True)
+    assert "長い解説" not in html
+    assert f'data-src="/questions/{qs[0].id}/explanation"' in html
+    list_select = next(s for s in stats.statements if "FROM questions" in s and "JOIN" in s)
+    assert not re.search(r"questions\.explanation\b(?!_)", list_select)
+
+def test_fragment_has_caching_headers_and_etag(app, client, seed_data):
+    q = _completed(seed_data)[0]
+    _login(client, "manager@example.com")
+
+    resp = client.get(f"/questions/{q.id}/explanation")
+    assert resp.status_code == 200
+    assert "長い解説" in resp.get_data(as_text=True)
+    assert resp.cache_control.private and resp.cache_control.max_age == 60
+    etag = resp.headers["ETag"]
+
+    assert client.get(f"/questions/{q.id}/explanation", headers={"If-None-Match": etag}).status_code == 304
+
+    # 再生成で内容が変わったら ETag も変わる
+    q.explanation = "新しい解説"
+    db.session.commit()
+    resp = client.get(f"/questions/{q.id}/explanation", headers={"If-None-Match": etag})
+    assert resp.status_code == 200 and "新しい解説" in resp.get_data(as_text=True)
+
+def test_fragment_respects_school_scope(app, client, seed_data):
+    q = _completed(seed_data, school="school_b")[0]
+    _login(client, "manager@example.com")
+    assert client.get(f"/questions/{q.id}/explanation").status_code == 404
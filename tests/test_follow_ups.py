@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+from app import db
+from app.models import FollowUp, FollowUpThread, Question
+from app.tasks import requestion_task
+
+def _completed_question(seed_data):
+    q = Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                 image_path="https://b/x.jpg", explanation="元の解説", explanation_status="completed")
+    db.session.add(q)
+    db.session.commit()
+    return q.id
+
+def _ask(client, qid, text):
+    return client.post("/api/re-question", json={"question_id": qid, "question_text": text})
+
+def _answer(job_id):
+    return requestion_task.apply(args=[job_id]).get()
+
+def test_follow_ups_are_stored_and_use_incremental_context(client, seed_data, stub_openai, stub_s3, monkeypatch):
+    app = client.application
+    app.config.update(RATE_LIMIT_ENABLED=False, FOLLOWUP_VERBATIM_TURNS=1)
+    monkeypatch.setattr("app.tasks.requestion_task.apply_async", lambda *a, **k: SimpleNamespace(id="t"))
+    qid = _completed_question(seed_data)
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+
+    for text in ["一つ目の質問", "二つ目の質問", "三つ目の質問"]:
+        _answer(_ask(client, qid, text).get_json()["job_id"])
+
+    messages = stub_openai.calls[-1]["messages"]
+    # 先頭 (画像 + 元の解説) は毎回同じ
+    assert messages[0] == stub_openai.calls[0]["messages"][0]
+    assert "元の解説" in messages[0]["content"][0]["text"]
+    # 1つ目は要約、2つ目はそのまま、3つ目が今回の質問
+    assert messages[1]["content"].startswith("【これまでの追加質問と回答の要約】")
+    assert "Q1: 一つ目の質問" in messages[1]["content"]
+    assert messages[2:4] == [{"role": "user", "content": "二つ目の質問"},
+                             {"role": "assistant", "content": "スタブ解説"}]
+    assert "三つ目の質問" in messages[4]["content"] and len(messages) == 5
+
+    thread = FollowUpThread.query.filter_by(question_id=qid).one()
+    assert [f.position for f in thread.follow_ups] == [1, 2, 3]
+    assert all(f.status == "completed" and f.answer == "スタブ解説" for f in thread.follow_ups)
+    assert thread.summary_position == 2
+
+    listed = client.get(f"/api/questions/{qid}/follow-ups").get_json()["follow_ups"]
+    assert [f["question"] for f in listed] == ["一つ目の質問", "二つ目の質問", "三つ目の質問"]
+
+def test_identical_follow_up_is_answered_from_store(client, seed_data, stub_openai, stub_s3, monkeypatch):
+    client.application.config["RATE_LIMIT_ENABLED"] = False
+    sent = []
+    monkeypatch.setattr("app.tasks.requestion_task.apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="t"))
+    qid = _completed_question(seed_data)
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+
+    first = _ask(client, qid, "なぜ x=2 になるの?").get_json()
+    # 処理中に同じ質問が来たら同じジョブを返す
+    assert _ask(client, qid, "なぜ x=2 になるの?").get_json()["job_id"] == first["job_id"]
+    _answer(first["job_id"])
+
+    resp = _ask(client, qid, "なぜ　x=2 になるの？")
+    assert resp.status_code == 200
+    assert resp.get_json()["cached"] is True
+    assert resp.get_json()["answer"] == "スタブ解説"
+    assert len(sent) == 1 and len(stub_openai.calls) == 1
+    assert FollowUp.query.count() == 1
@@ -0,0 +1,78 @@
+import base64
+import io
+from PIL import Image
+from types import SimpleNamespace
+from app import db
+from app.imaging import normalize_image, to_data_url
+from app.models import Question
+from app.pipeline import prepare_explanation
+
+def _photo(size=(4000, 3000), orientation=None, fmt="JPEG", mode="RGB"):
+    img = Image.new(mode, size, (200, 30, 30) if mode == "RGB" else (200, 30, 30, 0))
+    out = io.BytesIO()
+    kwargs = {}
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x010F] = "PhoneMaker"
+        kwargs["exif"] = exif.tobytes()
+    img.save(out, format=fmt, **kwargs)
+    return out.getvalue()
+
+def test_normalize_rotates_downscales_and_strips_exif():
+    # orientation=6 (90度回転) の横長写真 → 縦長になる
+    result = normalize_image(_photo(orientation=6), max_edge=1024, quality=80)
+
+    img = Image.open(io.BytesIO(result.data))
+    assert img.format == "JPEG"
+    assert img.size == (768, 1024)
+    assert not img.getexif()
+    assert result.content_type == "image/jpeg"
+
+def test_normalize_flattens_transparency():
+    result = normalize_image(_photo(size=(100, 50), fmt="PNG", mode="RGBA"))
+    img = Image.open(io.BytesIO(result.data))
+    assert img.mode == "RGB" and img.size == (100, 50)
+    assert img.getpixel((10, 10)) == (255, 255, 255)
+
+def test_normalize_rejects_non_images():
+    try:
+        normalize_image(b"not an image")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+
+def test_upload_stores_normalized_image(client, app, seed_data, monkeypatch):
+    app.config["IMAGE_MAX_EDGE"] = 512
+    uploaded = {}
+    def fake_upload(f, name, content_type=None):
+        uploaded.update(data=f.read(), name=name, content_type=content_type)
+        return "https://bucket.s3.amazonaws.com/x.jpg"
+    monkeypatch.setattr("app.utils_s3.upload_file_to_s3", fake_upload)
+    monkeypatch.setattr("app.tasks.analyze_image_task.apply_async", lambda *a, **k: SimpleNamespace(id="t"))
+
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+    original = _photo(fmt="PNG")
+    client.post("/questions/new", data={"grade": "middle", "image": (io.BytesIO(original), "photo.png")},
+                content_type="multipart/form-data")
+
+    assert uploaded["content_type"] == "image/jpeg"
+    assert uploaded["name"].endswith(".jpg")
+    assert max(Image.open(io.BytesIO(uploaded["data"])).size) == 512
+    assert len(uploaded["data"]) < len(original)
+
+def test_prepare_sends_inline_base64_when_enabled(app, seed_data, stub_s3):
+    app.config.update({"IMAGE_INLINE_ENABLED": True, "PHASH_ENABLED": False})
+    image = _photo(size=(64, 48))
+    stub_s3.objects["abc.jpg"] = image
+    q = Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                 image_path="https://bucket.s3.amazonaws.com/abc.jpg", explanation_status="processing")
+    db.session.add(q)
+    db.session.commit()
+
+    job, _ = prepare_explanation(q.id)
+
+    url = job.request["messages"][0]["content"][1]["image_url"]["url"]
+    assert url == to_data_url(image)
+    assert base64.b64decode(url.split(",", 1)[1]) == image
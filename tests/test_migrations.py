@@ -0,0 +1,57 @@
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+from app import db
+from manage import INITIAL_REVISION, alembic_config, upgrade_db
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    yield engine
+    engine.dispose()
+
+def _schema_diff(conn):
+    return compare_metadata(MigrationContext.configure(conn), db.metadata)
+
+def test_upgrade_head_matches_models(app, engine):
+    with engine.connect() as conn:
+        upgrade_db(conn)
+        assert _schema_diff(conn) == []
+        indexes = {i["name"]: i for i in inspect(conn).get_indexes("questions")}
+    assert {"ix_questions_created_id", "ix_questions_school_created_id",
+            "ix_questions_user_created_id", "ix_questions_processing_updated",
+            "ix_questions_image_path", "ix_questions_thumbnail_path"} <= set(indexes)
+    assert indexes["ix_questions_processing_updated"]["column_names"] == ["updated_at"]
+
+def test_upgrade_legacy_init_db_database(app, engine):
+    # 以前の init-db で作った DB (alembic_version なし、列は一部だけ追加済み)
+    with engine.connect() as conn:
+        command.upgrade(alembic_config(conn), INITIAL_REVISION)
+        conn.commit()
+        conn.execute(text("DROP TABLE alembic_version"))
+        conn.execute(text("ALTER TABLE questions ADD COLUMN grade VARCHAR(20)"))
+        conn.execute(text("INSERT INTO schools (id, name) VALUES (1, 'A')"))
+        conn.execute(text("INSERT INTO users (id, email, password_hash, role, school_id) "
+                          "VALUES (1, 's@example.com', 'x', 'student', 1)"))
+        conn.execute(text("INSERT INTO questions (content, user_id, school_id, created_at, grade) "
+                          "VALUES ('q', 1, 1, '2025-01-01 00:00:00', 'middle')"))
+        conn.commit()
+
+        upgrade_db(conn)
+
+        assert _schema_diff(conn) == []
+        row = conn.execute(text("SELECT grade, updated_at, explanation_generation FROM questions")).one()
+    assert row.grade == "middle"
+    assert row.updated_at is not None
+    assert row.explanation_generation == 0
+
+def test_downgrade_drops_question_indexes(app, engine):
+    with engine.connect() as conn:
+        upgrade_db(conn)
+        command.downgrade(alembic_config(conn), "20261018_0002")
+        conn.commit()
+        names = {i["name"] for i in inspect(conn).get_indexes("questions")}
+    assert "ix_questions_school_created_id" not in names
+    assert "ix_questions_status_updated" in names
@@ -0,0 +1,62 @@
+import re
+from datetime import datetime, timedelta
+from app import db
+from app.models import Question
+from app.pagination import paginate_keyset, decode_cursor, encode_cursor, cached_count
+
+def _questions(seed_data, n=25):
+    base = datetime(2025, 1, 1)
+    # 3件ずつ同じ投稿時刻 (同時刻は id で順序が決まる)
+    qs = [Question(content=f"q{i}", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                   created_at=base + timedelta(minutes=i // 3)) for i in range(n)]
+    db.session.add_all(qs)
+    db.session.commit()
+    return sorted(qs, key=lambda q: (q.created_at, q.id), reverse=True)
+
+def test_keyset_pages_cover_all_rows_in_order(app, seed_data):
+    expected = [q.id for q in _questions(seed_data)]
+
+    seen, pages, cursor = [], [], None
+    while True:
+        page = paginate_keyset(Question.query, 10, after=cursor)
+        pages.append(page)
+        seen += [q.id for q in page.items]
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    assert seen == expected
+    assert [len(p.items) for p in pages] == [10, 10, 5]
+    assert not pages[0].has_prev and pages[1].has_prev
+
+    # 前へ戻ると直前のページと同じ内容
+    back = paginate_keyset(Question.query, 10, before=pages[2].prev_cursor)
+    assert [q.id for q in back.items] == [q.id for q in pages[1].items]
+    first = paginate_keyset(Question.query, 10, before=back.prev_cursor)
+    assert [q.id for q in first.items] == expected[:10] and not first.has_prev
+
+def test_invalid_cursor_falls_back_to_first_page(app, seed_data):
+    qs = _questions(seed_data, 3)
+    assert decode_cursor("not-a-cursor") is None
+    assert decode_cursor(encode_cursor(qs[0])) == (qs[0].created_at, qs[0].id)
+    assert [q.id for q in paginate_keyset(Question.query, 10, after="%%%").items] == [q.id for q in qs]
+
+def test_count_is_cached(app, seed_data):
+    _questions(seed_data, 4)
+    assert cached_count(Question.query, "test") == 4
+    _questions(seed_data, 2)
+    assert cached_count(Question.query, "test") == 4
+    app.config["QUESTION_COUNT_TTL"] = 0
+    assert cached_count(Question.query, "test") is None
+
+def test_list_links_use_cursors(app, client, seed_data):
+    app.config["PAGE_SIZE"] = 10
+    expected = [q.id for q in _questions(seed_data)]
+    client.post("/auth/login", data={"email": "manager@example.com", "password": "password"})
+
+    html = client.get("/questions").get_data(as_text=True)
+    assert "全 25 件" in html
+    after = re.search(r'after=([\w-]+)', html).group(1)
+    html = client.get(f"/questions?after={after}").get_data(as_text=True)
+    ids = [int(i) for i in re.findall(r'<td>(\d+)</td>', html)]
+    assert ids == expected[10:20]
+    assert "before=" in html
@@ -0,0 +1,57 @@
+import io
+import random
+import pytest
+from PIL import Image, ImageDraw
+from app import db, phash
+from app.models import Question
+from app.tasks import analyze_image_task
+
+@pytest.fixture(autouse=True)
+def reset_index(monkeypatch):
+    monkeypatch.setattr(phash, "_index", None)
+    monkeypatch.setattr(phash, "_max_indexed_id", 0)
+
+def _worksheet(offset=0, size=(400, 300)):
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    for i in range(6):
+        draw.rectangle([20 + offset, 20 + i * 45 + offset, 300 + offset, 40 + i * 45 + offset], fill=(i * 40, 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+def test_dhash_tolerates_small_shift_and_rescale():
+    a = phash.dhash(_worksheet())
+    b = phash.dhash(_worksheet(offset=3, size=(410, 305)))
+    assert (a ^ b).bit_count() <= 8
+
+def test_hamming_index_matches_linear_scan():
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(5000)]
+    index = phash.HammingIndex(max_distance=4)
+    for i, h in enumerate(hashes):
+        index.add(h, i)
+    query = hashes[123] ^ 0b1011
+    expected = sorted(((h ^ query).bit_count(), i) for i, h in enumerate(hashes) if (h ^ query).bit_count() <= 4)
+    assert index.search(query) == expected
+    assert index.search(query)[0] == (3, 123)
+
+def test_task_reuses_near_duplicate_explanation(app, seed_data, stub_openai, stub_s3):
+    source = Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                      grade="middle", image_path="https://b/one.jpg",
+                      image_phash=phash.to_hex(phash.dhash(_worksheet())),
+                      explanation="既存の解説", explanation_status="completed")
+    q = Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                 grade="middle", image_path="https://b/two.jpg", explanation_status="processing")
+    db.session.add_all([source, q])
+    db.session.commit()
+    stub_s3.objects["two.jpg"] = _worksheet(size=(420, 315))
+
+    result = analyze_image_task.apply(args=[q.id]).get()
+
+    assert result["reused_from"] == source.id
+    assert stub_openai.calls == []
+    db.session.expire_all()
+    reused = db.session.get(Question, q.id)
+    assert reused.explanation == "既存の解説"
+    assert reused.image_phash is not None
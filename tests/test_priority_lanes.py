@@ -0,0 +1,73 @@
+import io
+from types import SimpleNamespace
+
+import app.tasks
+from app import metrics
+from app.models import Question, db
+from app.tasks import LANE_BACKFILL, LANE_INTERACTIVE, LANE_MANUAL, LANE_QUEUES, dispatch_explanation
+
+
+def login(client, email):
+    return client.post("/auth/login", data={"email": email, "password": "password"}, follow_redirects=True)
+
+
+def capture_dispatch(monkeypatch):
+    sent = []
+    monkeypatch.setattr(app.tasks.analyze_image_task, "apply_async", 
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="stub-task"))
+    return sent
+
+
+def test_dispatch_routes_lane_to_queue(app, monkeypatch):
+    sent = capture_dispatch(monkeypatch)
+    with app.app_context():
+        dispatch_explanation(1)
+        dispatch_explanation(2, LANE_BACKFILL, countdown=30)
+
+    assert sent[0]["queue"] == LANE_QUEUES[LANE_INTERACTIVE]
+    assert sent[0]["kwargs"]["lane"] == LANE_INTERACTIVE
+    assert sent[0]["kwargs"]["enqueued_at"] > 0
+    assert sent[1]["queue"] == "explain.backfill"
+    assert sent[1]["countdown"] == 30
+
+
+def test_upload_uses_interactive_lane_and_manual_retry_uses_manual(client, app, seed_data, stub_s3, monkeypatch):
+    sent = capture_dispatch(monkeypatch)
+    monkeypatch.setattr("app.utils_s3.upload_file_to_s3", lambda f, name, content_type=None: f"https://bucket.s3.amazonaws.com/{name}")
+    login(client, "student@example.com")
+
+    client.post("/questions/new", data={"image": (io.BytesIO(b"lane-image"), "q.png"), "grade": "high"},
+                content_type="multipart/form-data")
+    assert sent[-1]["queue"] == "explain.interactive"
+
+    qid = Question.query.order_by(Question.id.desc()).first().id
+    Question.query.filter_by(id=qid).update({"explanation_status": "failed"})
+    db.session.commit()
+    client.post(f"/questions/{qid}/explain")
+    assert sent[-1]["queue"] == "explain.manual"
+
+
+def test_histogram_quantiles(app):
+    with app.app_context():
+        for value in [0.05] * 90 + [7] * 10:
+            metrics.observe("queue_wait:test", value)
+        hist = metrics.histogram("queue_wait:test", minutes=5)
+
+    assert hist["count"] == 100
+    assert metrics.quantile(hist, 0.5) == 0.1
+    assert metrics.quantile(hist, 0.95) == 10.0
+    assert metrics.quantile({"count": 0, "buckets": []}, 0.5) is None
+
+
+def test_queue_metrics_page_is_hq_only(client, app, seed_data):
+    with app.app_context():
+        metrics.observe(f"queue_wait:{LANE_MANUAL}", 3)
+
+    login(client, "student@example.com")
+    assert client.get("/admin/queues").status_code == 403
+    client.get("/auth/logout")
+
+    login(client, "hq@example.com")
+    res = client.get("/admin/queues")
+    assert res.status_code == 200
+    assert b"explain.manual" in res.data
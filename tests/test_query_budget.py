@@ -0,0 +1,67 @@
+from flask import g
+from app import db
+from app.models import Question, User, ROLE_STUDENT
+from app.querycount import QueryBudgetExceeded, count_queries, query_budget
+
+def _many_authors(seed_data, n=20):
+    for i in range(n):
+        u = User(email=f"author{i}@example.com", role=ROLE_STUDENT, school_id=seed_data["school_a"].id)
+        u.set_password("x")
+        db.session.add(u)
+        db.session.flush()
+        db.session.add(Question(content=f"q{i}", user_id=u.id, school_id=seed_data["school_a"].id))
+    db.session.commit()
+
+def _cold_get(client, url):
+    """テストのセッションに読み込み済みの行を使わせない (本番の1リクエストと同じ状態で数える)"""
+    db.session.remove()
+    g.pop("_login_user", None)
+    with count_queries() as stats:
+        resp = client.get(url)
+    return resp, stats
+
+def test_question_list_does_not_load_authors_per_row(app, client, seed_data):
+    _many_authors(seed_data)
+    client.post("/auth/login", data={"email": "hq@example.com", "password": "password"})
+
+    resp, stats = _cold_get(client, "/questions")
+    assert resp.status_code == 200
+    assert "author19@example.com" in resp.get_data(as_text=True)
+    assert stats.count <= 6
+    assert f'desc="{stats.count} queries"' in resp.headers["Server-Timing"]
+
+    resp, stats = _cold_get(client, "/export/questions.csv")
+    assert resp.status_code == 200 and stats.count <= 4
+
+def test_admin_users_loads_schools_with_users(app, client, seed_data):
+    _many_authors(seed_data)
+    client.post("/auth/login", data={"email": "hq@example.com", "password": "password"})
+    resp, stats = _cold_get(client, "/admin/users")
+    assert resp.status_code == 200 and stats.count <= 4
+
+def test_budget_overrun_fails_in_strict_mode(app, client, seed_data):
+    @app.route("/_test/n_plus_one")
+    @query_budget(2)
+    def n_plus_one():
+        return ",".join(q.user.email for q in Question.query.all())
+
+    _many_authors(seed_data, 3)
+    try:
+        _cold_get(client, "/_test/n_plus_one")
+    except QueryBudgetExceeded as e:
+        assert "n_plus_one ran 4 queries (budget 2)" in str(e)
+    else:
+        raise AssertionError("expected QueryBudgetExceeded")
+
+    app.config["QUERY_BUDGET_STRICT"] = False
+    resp, stats = _cold_get(client, "/_test/n_plus_one")
+    assert resp.status_code == 200 and stats.count == 4
+
+def test_server_timing_only_when_enabled(app, client, seed_data):
+    client.post("/auth/login", data={"email": "hq@example.com", "password": "password"})
+    app.config.update(TESTING=False, QUERY_SERVER_TIMING=False)
+    resp = client.get("/questions")
+    assert resp.status_code == 200 and "Server-Timing" not in resp.headers
+
+    app.config["QUERY_SERVER_TIMING"] = True
+    assert "queries" in client.get("/questions").headers["Server-Timing"]
@@ -0,0 +1,36 @@
+import pytest
+from app import ratelimit
+from app.ratelimit import TokenBucketLimiter, AdaptiveConcurrency, RateLimitTimeout
+
+def test_token_bucket_enforces_requests_and_tokens(app, fake_redis):
+    limiter = TokenBucketLimiter(fake_redis, rpm=3, tpm=10000, name="test")
+    assert [limiter.try_acquire(100) for _ in range(3)] == [0, 0, 0]
+    # 4件目はリクエスト枠が空くまで待つ (60s / 3 = 約20s)
+    assert 15 < limiter.try_acquire(100) <= 20
+
+    tokens = TokenBucketLimiter(fake_redis, rpm=1000, tpm=1000, name="tokens")
+    assert tokens.try_acquire(800) == 0
+    assert tokens.try_acquire(800) > 0
+    with pytest.raises(RateLimitTimeout):
+        tokens.acquire(800, timeout=0.1)
+
+def test_bucket_is_shared_between_limiter_instances(app, fake_redis):
+    a = TokenBucketLimiter(fake_redis, rpm=2, tpm=10000, name="shared")
+    b = TokenBucketLimiter(fake_redis, rpm=2, tpm=10000, name="shared")
+    assert a.try_acquire(1) == 0
+    assert b.try_acquire(1) == 0
+    assert a.try_acquire(1) > 0
+
+def test_aimd_backs_off_on_low_headroom_and_429(app):
+    c = AdaptiveConcurrency(initial=8, maximum=16)
+    healthy = {"x-ratelimit-remaining-requests": "400", "x-ratelimit-limit-requests": "500",
+               "x-ratelimit-remaining-tokens": "150000", "x-ratelimit-limit-tokens": "200000"}
+    c.on_response(healthy)
+    assert 8 < c.limit < 9
+    c.on_response(dict(healthy, **{"x-ratelimit-remaining-tokens": "5000"}))
+    assert c.limit == pytest.approx(8.125 * 0.7)
+    c.on_rate_limited()
+    assert c.limit == pytest.approx(8.125 * 0.7 * 0.5)
+    for _ in range(int(c.limit)):
+        assert c.try_acquire()
+    assert not c.try_acquire()
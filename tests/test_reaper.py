@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from app import db
+from app.models import Question
+from app.reaper import reap, REAPED_MESSAGE
+
+def _ago(minutes):
+    return datetime.utcnow() - timedelta(minutes=minutes)
+
+def test_reaper_requeues_only_expired_leases(app, monkeypatch, make_question):
+    stuck = make_question(updated_at=_ago(45)).id
+    fresh = make_question(updated_at=_ago(1)).id
+    done = make_question(status="completed", updated_at=_ago(45)).id
+    sent = []
+    monkeypatch.setattr("app.tasks.analyze_image_task.apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="t"))
+
+    summary = reap(lease_seconds=1800)
+
+    assert summary == {"found": 1, "requeued": 1, "failed": 0, "skipped": 0}
+    assert [k["args"] for k in sent] == [[stuck]]
+    assert sent[0]["queue"] == "explain.backfill"
+    assert sent[0]["kwargs"]["generation"] == 2
+    row = db.session.get(Question, stuck)
+    assert row.updated_at > datetime.utcnow() - timedelta(minutes=1)
+    assert db.session.get(Question, fresh).explanation_generation == 1
+    assert db.session.get(Question, done).explanation_status == "completed"
+
+def test_reaper_skips_rows_heartbeated_after_read(app, monkeypatch, make_question):
+    qid = make_question(updated_at=_ago(45)).id
+    sent = []
+    monkeypatch.setattr("app.tasks.analyze_image_task.apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="t"))
+
+    def heartbeat_then_count(question_id):
+        # stuck_query の読み取りと claim の間にタスクが処理を始めた
+        Question.query.filter_by(id=question_id).update({Question.updated_at: datetime.utcnow()})
+        db.session.commit()
+        return 1
+    monkeypatch.setattr("app.reaper._requeue_count", heartbeat_then_count)
+
+    summary = reap(lease_seconds=1800)
+
+    assert summary == {"found": 1, "requeued": 0, "failed": 0, "skipped": 1}
+    assert sent == []
+    db.session.expire_all()
+    row = db.session.get(Question, qid)
+    assert (row.explanation_status, row.explanation_generation) == ("processing", 1)
+
+def test_reaper_fails_after_max_requeues(app, monkeypatch, make_question):
+    qid = make_question(updated_at=_ago(45)).id
+    monkeypatch.setattr("app.tasks.analyze_image_task.apply_async", lambda *a, **k: SimpleNamespace(id="t"))
+
+    assert reap(lease_seconds=1800, max_requeues=1)["requeued"] == 1
+    # 投入したタスクも実行されずに止まった
+    Question.query.filter_by(id=qid).update({Question.updated_at: datetime.utcnow() - timedelta(hours=1)})
+    db.session.commit()
+    assert reap(lease_seconds=1800, max_requeues=1)["failed"] == 1
+
+    db.session.expire_all()
+    row = db.session.get(Question, qid)
+    assert (row.explanation_status, row.explanation) == ("failed", REAPED_MESSAGE)
+
+def test_reaper_dry_run_changes_nothing(app, make_question):
+    qid = make_question(updated_at=_ago(45)).id
+
+    assert reap(lease_seconds=1800, dry_run=True) == {"found": 1, "requeued": 0, "failed": 0, "skipped": 0}
+    assert db.session.get(Question, qid).explanation_generation == 1
+
+def test_processing_start_heartbeats_claimed_row(app, stub_s3, make_question):
+    from app.pipeline import prepare_explanation
+    # claim 済み (processing) のままキューで待っていたタスク
+    qid = make_question(updated_at=_ago(45)).id
+    before = db.session.get(Question, qid).updated_at
+
+    prepare_explanation(qid, generation=1)
+
+    db.session.expire_all()
+    assert db.session.get(Question, qid).updated_at > before + timedelta(minutes=40)
+    assert reap(lease_seconds=1800, dry_run=True)["found"] == 0
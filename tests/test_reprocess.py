@@ -0,0 +1,119 @@
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import app.tasks
+from app import clients, db
+from app.batch import collect_batch, custom_id
+from app.models import Question
+from app.reprocess import Checkpoint, candidate_query, claim_rows, reprocess
+
+def _make_questions(seed_data, statuses, minutes_ago=120, heartbeat_minutes_ago=None):
+    created = datetime.utcnow() - timedelta(minutes=minutes_ago)
+    heartbeat = created if heartbeat_minutes_ago is None else datetime.utcnow() - timedelta(minutes=heartbeat_minutes_ago)
+    qs = [Question(content="[画像による質問]", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                   image_path=f"https://bucket.s3.amazonaws.com/{i}.jpg", grade="middle",
+                   explanation_status=status, created_at=created, updated_at=heartbeat)
+          for i, status in enumerate(statuses)]
+    db.session.add_all(qs)
+    db.session.commit()
+    return [q.id for q in qs]
+
+def _capture_dispatch(monkeypatch):
+    sent = []
+    monkeypatch.setattr(app.tasks.analyze_image_task, "apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="stub-task"))
+    return sent
+
+def test_reprocess_selects_failed_and_stuck(app, seed_data, monkeypatch, tmp_path):
+    ids = _make_questions(seed_data, ["failed", "processing", "completed", "failed"])
+    recent = _make_questions(seed_data, ["failed"], minutes_ago=1)
+    sent = _capture_dispatch(monkeypatch)
+    path = str(tmp_path / "reprocess.json")
+
+    summary = reprocess(candidate_query(), Checkpoint(path), chunk_size=2, rate=0, echo=lambda m: None)
+
+    assert summary["enqueued"] == 3
+    assert [k["args"][0] for k in sent] == [ids[0], ids[1], ids[3]]
+    assert {k["queue"] for k in sent} == {"explain.backfill"}
+    assert recent[0] not in [k["args"][0] for k in sent]
+    # 処理中だった質問は世代が進み、古いタスクは stale になる
+    assert db.session.get(Question, ids[1]).explanation_generation == 1
+    assert json.load(open(path))["last_id"] == ids[3]
+
+def test_claim_rows_rechecks_processing_lease(app, seed_data):
+    stuck, failed = _make_questions(seed_data, ["processing", "failed"], heartbeat_minutes_ago=60)
+    rows = candidate_query().order_by(Question.id).all()
+    # 読み取り後にタスクが処理を始めた (ハートビートで updated_at だけ進む)
+    Question.query.filter_by(id=stuck).update({Question.updated_at: datetime.utcnow()})
+    db.session.commit()
+
+    claims = claim_rows(rows)
+
+    assert [question_id for question_id, _ in claims] == [failed]
+    db.session.expire_all()
+    assert db.session.get(Question, stuck).explanation_generation == 0
+
+def test_reprocess_skips_processing_with_recent_heartbeat(app, seed_data):
+    # 昔の投稿だが、再生成・リトライで今まさに処理中 (updated_at が新しい)
+    running = _make_questions(seed_data, ["processing"], minutes_ago=600, heartbeat_minutes_ago=1)
+    stuck = _make_questions(seed_data, ["processing"], minutes_ago=600, heartbeat_minutes_ago=60)
+    failed = _make_questions(seed_data, ["failed"], minutes_ago=600, heartbeat_minutes_ago=1)
+
+    selected = [row.id for row in candidate_query().order_by(Question.id)]
+
+    assert running[0] not in selected
+    assert selected == [stuck[0], failed[0]]
+
+def test_reprocess_resumes_from_checkpoint_and_dry_run(app, seed_data, monkeypatch, tmp_path):
+    ids = _make_questions(seed_data, ["failed"] * 4)
+    sent = _capture_dispatch(monkeypatch)
+    state = Checkpoint(str(tmp_path / "cp.json"))
+
+    dry = reprocess(candidate_query(), state, dry_run=True, echo=lambda m: None)
+    assert dry["selected"] == 4 and sent == []
+    assert db.session.get(Question, ids[0]).explanation_status == "failed"
+
+    reprocess(candidate_query(), state, chunk_size=2, rate=0, limit=2, echo=lambda m: None)
+    resumed = Checkpoint(str(tmp_path / "cp.json"))
+    assert resumed.last_id == ids[1]
+    reprocess(candidate_query(), resumed, rate=0, echo=lambda m: None)
+    assert [k["args"][0] for k in sent] == ids
+
+def test_reprocess_batch_submit_and_collect(app, seed_data, stub_s3, monkeypatch, tmp_path):
+    ids = _make_questions(seed_data, ["failed", "failed"])
+    files = {}
+    batches = {}
+
+    def create_file(file, purpose):
+        files["input"] = file[1].read().decode("utf-8")
+        return SimpleNamespace(id="file-in")
+
+    def create_batch(**kwargs):
+        lines = [json.loads(l) for l in files["input"].splitlines()]
+        out = [{"custom_id": l["custom_id"], "error": None,
+                "response": {"status_code": 200, "body": {"choices": [
+                    {"finish_reason": "stop", "message": {"content": "バッチ解説"}}]}}} for l in lines]
+        files["file-out"] = "\n".join(json.dumps(o) for o in out)
+        batches["batch-1"] = SimpleNamespace(id="batch-1", status="completed", output_file_id="file-out",
+                                             error_file_id=None)
+        return batches["batch-1"]
+
+    monkeypatch.setattr(clients, "_openai_client", SimpleNamespace(
+        files=SimpleNamespace(create=create_file, content=lambda fid: SimpleNamespace(text=files[fid])),
+        batches=SimpleNamespace(create=create_batch, retrieve=lambda bid: batches[bid])))
+
+    summary = reprocess(candidate_query(), Checkpoint(), use_batch=True, echo=lambda m: None)
+    assert summary["batches"] == ["batch-1"]
+    first = json.loads(files["input"].splitlines()[0])
+    assert first["custom_id"] == custom_id(ids[0], 1)
+    assert "stream" not in first["body"]
+
+    # 取り込み前に再生成された質問は上書きしない
+    Question.query.filter_by(id=ids[1]).update({"explanation_generation": 5})
+    db.session.commit()
+
+    _, result = collect_batch("batch-1")
+    assert result == {"completed": 1, "failed": 0, "skipped": 1}
+    db.session.expire_all()
+    assert db.session.get(Question, ids[0]).explanation == "バッチ解説"
+    assert db.session.get(Question, ids[0]).explanation_status == "completed"
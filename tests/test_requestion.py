@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+from app import db, ratelimit
+from app.models import Question
+from app.requestion import get_job
+from app.tasks import requestion_task
+
+def _completed_question(seed_data):
+    q = Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                 image_path="https://b/x.jpg", explanation="元の解説", explanation_status="completed")
+    db.session.add(q)
+    db.session.commit()
+    return q.id
+
+def _post(client, qid):
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+    return client.post("/api/re-question", json={"question_id": qid, "question_text": "なぜ?"})
+
+def test_re_question_returns_job_without_calling_model(client, seed_data, stub_openai, monkeypatch):
+    qid = _completed_question(seed_data)
+    sent = []
+    monkeypatch.setattr("app.tasks.requestion_task.apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="t"))
+    # レート枠が空でも Web は待たない
+    client.application.config.update(OPENAI_RPM_LIMIT=1)
+    ratelimit.get_limiter().try_acquire(1)
+
+    resp = _post(client, qid)
+
+    assert resp.status_code == 202
+    job_id = resp.get_json()["job_id"]
+    assert sent[0]["args"] == [job_id] and sent[0]["queue"] == "explain.interactive"
+    assert stub_openai.calls == []
+    assert client.get(f"/api/re-question/{job_id}").get_json()["status"] == "queued"
+
+def test_requestion_task_streams_and_stores_answer(client, seed_data, stub_openai, stub_s3, monkeypatch):
+    app = client.application
+    app.config["RATE_LIMIT_ENABLED"] = False
+    qid = _completed_question(seed_data)
+    monkeypatch.setattr("app.tasks.requestion_task.apply_async", lambda *a, **k: SimpleNamespace(id="t"))
+    job_id = _post(client, qid).get_json()["job_id"]
+
+    result = requestion_task.apply(args=[job_id]).get()
+
+    assert result["status"] == "completed"
+    request = stub_openai.calls[0]
+    assert request["stream"] is True
+    assert "元の解説" in request["messages"][0]["content"][0]["text"]
+    assert request["messages"][0]["content"][1]["image_url"]["url"].startswith("https://stub-s3.local/x.jpg")
+    status = client.get(f"/api/re-question/{job_id}").get_json()
+    assert status == {"status": "completed", "answer": "スタブ解説", "error": None, "job_id": job_id}
+    body = client.get(f"/api/re-question/{job_id}/stream").get_data(as_text=True)
+    assert '"type": "done"' in body and "スタブ解説" in body
+
+def test_requestion_failure_is_recorded(app, seed_data, stub_s3, monkeypatch):
+    from app.requestion import create_job
+    app.config["RATE_LIMIT_ENABLED"] = False
+    job_id = create_job(_completed_question(seed_data), seed_data["student"].id, "なぜ?")
+    def boom(**kwargs):
+        raise RuntimeError("provider down")
+    from app import clients
+    monkeypatch.setattr(clients, "_openai_client", SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        with_raw_response=SimpleNamespace(create=boom)))))
+
+    assert requestion_task.apply(args=[job_id]).get()["status"] == "failed"
+    assert get_job(job_id)["status"] == "failed"
+
+def test_job_is_private_to_its_owner(client, seed_data, monkeypatch):
+    qid = _completed_question(seed_data)
+    monkeypatch.setattr("app.tasks.requestion_task.apply_async", lambda *a, **k: SimpleNamespace(id="t"))
+    job_id = _post(client, qid).get_json()["job_id"]
+    client.get("/auth/logout")
+    client.post("/auth/login", data={"email": "manager@example.com", "password": "password"})
+    assert client.get(f"/api/re-question/{job_id}").status_code == 404
+    assert client.get(f"/api/re-question/{job_id}/stream").status_code == 404
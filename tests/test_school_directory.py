@@ -0,0 +1,60 @@
+from flask import g
+from app import db
+from app.models import School, Question
+from app.querycount import count_queries
+from app.school_directory import VERSION_KEY, get_directory, school_name
+
+def _cold_get(client, url):
+    db.session.remove()
+    g.pop("_login_user", None)
+    with count_queries() as stats:
+        resp = client.get(url)
+    return resp, stats
+
+def _school_queries(stats):
+    return [s for s in stats.statements if "FROM schools" in s]
+
+def test_question_list_reads_schools_once_per_worker(app, client, seed_data):
+    db.session.add(Question(content="q", user_id=seed_data["student"].id, school_id=seed_data["school_b"].id))
+    db.session.commit()
+    client.post("/auth/login", data={"email": "hq@example.com", "password": "password"})
+
+    resp, stats = _cold_get(client, "/questions")
+    assert resp.status_code == 200
+    assert len(_school_queries(stats)) == 1
+
+    resp, stats = _cold_get(client, "/questions")
+    body = resp.get_data(as_text=True)
+    assert _school_queries(stats) == []
+    assert "<td>Test School B</td>" in body
+    assert body.index("Test School A") < body.index("Test School B")
+
+    resp, stats = _cold_get(client, "/export/questions.csv")
+    assert _school_queries(stats) == []
+    assert "Test School B" in resp.get_data(as_text=True)
+
+def test_adding_school_invalidates_directory(app, client, seed_data, fake_redis):
+    client.post("/auth/login", data={"email": "hq@example.com", "password": "password"})
+    client.get("/admin/schools")
+    version = int(fake_redis.get(VERSION_KEY) or 0)
+
+    resp = client.post("/admin/schools", data={"name": "New School"}, follow_redirects=True)
+    assert "New School" in resp.get_data(as_text=True)
+    assert int(fake_redis.get(VERSION_KEY)) == version + 1
+
+def test_other_worker_change_is_picked_up_after_check_interval(app, seed_data, fake_redis):
+    app.config["SCHOOL_DIRECTORY_CHECK_SECONDS"] = 3600
+    assert school_name(seed_data["school_a"].id) == "Test School A"
+
+    # 別のワーカーが校舎を追加した
+    s = School(name="Remote School")
+    db.session.add(s)
+    db.session.commit()
+    fake_redis.incr(VERSION_KEY)
+    assert school_name(s.id) == "-"
+
+    app.config["SCHOOL_DIRECTORY_CHECK_SECONDS"] = 0
+    assert school_name(s.id) == "Remote School"
+    directory = get_directory()
+    assert [e.name for e in directory.schools] == ["Remote School", "Test School A", "Test School B"]
+    assert get_directory() is directory
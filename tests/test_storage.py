@@ -0,0 +1,92 @@
+import io
+from app import metrics
+from app.utils_s3 import presigned_image_url, s3_key_from_url, upload_file_to_s3
+import app.utils_s3 as utils_s3
+
+IMAGE_URL = "https://bucket.s3.ap-northeast-1.amazonaws.com/abc.jpg"
+
+def test_s3_key_from_url(app):
+    assert s3_key_from_url(IMAGE_URL) == "abc.jpg"
+    assert s3_key_from_url("https://bucket.s3.ap-northeast-1.amazonaws.com/dir/x.png") == "dir/x.png"
+
+def test_presigned_url_is_cached_until_near_expiry(app, stub_s3, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils_s3.time, "monotonic", lambda: now[0])
+
+    first = presigned_image_url(IMAGE_URL)
+    assert presigned_image_url(IMAGE_URL) == first
+    assert stub_s3.presign_calls == 1
+    # 有効期限の違う URL は別に発行する
+    presigned_image_url(IMAGE_URL, expires=3600)
+    assert stub_s3.presign_calls == 2
+
+    # 残り60秒 (300秒の2割) を切ったら発行し直す
+    now[0] += 241
+    presigned_image_url(IMAGE_URL)
+    assert stub_s3.presign_calls == 3
+    counters = metrics.get_counters("presign:hit", "presign:miss")
+    assert (counters["presign:hit"], counters["presign:miss"]) == (1, 3)
+
+def test_upload_uses_shared_client(app, stub_s3):
+    app.config.update(AWS_S3_BUCKET_NAME="bucket", AWS_REGION="ap-northeast-1")
+    url = upload_file_to_s3(io.BytesIO(b"data"), "photo.jpg", content_type="image/jpeg")
+
+    key = s3_key_from_url(url)
+    assert url.startswith("https://bucket.s3.ap-northeast-1.amazonaws.com/") and key.endswith(".jpg")
+    assert stub_s3.objects[key] == b"data"
+
+def _use_local_storage(app, tmp_path):
+    from app.storage import reset_storage
+    app.config.update(STORAGE_BACKEND="local", LOCAL_STORAGE_ROOT=str(tmp_path))
+    reset_storage()
+
+def test_local_storage_is_content_addressed(app, tmp_path):
+    from app.storage import get_storage
+    _use_local_storage(app, tmp_path)
+    storage = get_storage()
+
+    key = storage.put(io.BytesIO(b"same image"), "a.JPG")
+    assert storage.put(io.BytesIO(b"same image"), "b.jpg") == key
+    digest = key.rsplit("/", 1)[1][:-4]
+    assert key == f"{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+    assert storage.get(key) == b"same image"
+    assert metrics.get_counters("storage:dedup")["storage:dedup"] == 1
+    try:
+        storage.path("../outside.jpg")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+
+def test_local_storage_serves_media_with_range(app, client, seed_data, tmp_path):
+    from app import db
+    from app.models import Question
+    from app.storage import get_storage
+    _use_local_storage(app, tmp_path)
+    key = get_storage().put(io.BytesIO(b"0123456789"), "q.png")
+    db.session.add(Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                            image_path=key, explanation_status="completed"))
+    db.session.commit()
+
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+    resp = client.get(f"/media/{key}", headers={"Range": "bytes=2-5"})
+    assert resp.status_code == 206
+    assert resp.data == b"2345"
+    assert client.get("/media/aa/bb/unknown.png").status_code == 404
+
+def test_prepare_inlines_local_images(app, seed_data, tmp_path):
+    from app import db
+    from app.imaging import to_data_url
+    from app.models import Question
+    from app.pipeline import prepare_explanation
+    from app.storage import get_storage
+    _use_local_storage(app, tmp_path)
+    app.config.update(PHASH_ENABLED=False)
+    key = get_storage().put(io.BytesIO(b"\x89PNG local"), "q.png")
+    q = Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                 image_path=key, explanation_status="processing")
+    db.session.add(q)
+    db.session.commit()
+
+    job, _ = prepare_explanation(q.id)
+    assert job.request["messages"][0]["content"][1]["image_url"]["url"] == to_data_url(b"\x89PNG local")
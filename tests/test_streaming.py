@@ -0,0 +1,88 @@
+import json
+from app import db
+from app.models import Question
+from app.streaming import PartialTextWriter, partial_key, channel_name
+from app.tasks import analyze_image_task
+
+def _question(seed_data, status="processing"):
+    q = Question(content="[画像による質問]", user_id=seed_data["student"].id,
+                 school_id=seed_data["school_a"].id, image_path="https://b/s.jpg",
+                 grade="middle", explanation_status=status)
+    db.session.add(q)
+    db.session.commit()
+    return q
+
+def _events(body):
+    return [json.loads(line[len("data: "):]) for line in body.decode("utf-8").splitlines() if line.startswith("data: ")]
+
+def test_task_publishes_partial_text_and_done(app, seed_data, stub_openai, stub_s3, fake_redis):
+    app.config["PHASH_ENABLED"] = False
+    q = _question(seed_data)
+    pubsub = fake_redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel_name(f"question:{q.id}"))
+
+    analyze_image_task.apply(args=[q.id]).get()
+
+    messages = []
+    for _ in range(20):
+        m = pubsub.get_message(timeout=0.01)
+        if m is not None:
+            messages.append(json.loads(m["data"]))
+    assert messages[-1] == {"type": "done", "status": "completed", "text": "スタブ解説"}
+    assert "".join(m["delta"] for m in messages if m["type"] == "partial") == "スタブ解説"
+    assert fake_redis.get(partial_key(f"question:{q.id}")) is None
+
+def test_stream_endpoint_sends_snapshot_then_done(client, seed_data, fake_redis):
+    q = _question(seed_data)
+    writer = PartialTextWriter(f"question:{q.id}")
+    writer.append("途中まで")
+    writer.flush()
+    client.application.config["SSE_MAX_SECONDS"] = 1
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+
+    question_id = q.id
+    events = _events(client.get(f"/api/questions/{question_id}/stream").data)
+    assert events[0] == {"type": "partial", "offset": 0, "delta": "途中まで"}
+    assert events[-1]["type"] == "timeout"
+
+    Question.query.filter_by(id=question_id).update({"explanation_status": "completed", "explanation": "完成"})
+    db.session.commit()
+    events = _events(client.get(f"/api/questions/{question_id}/stream").data)
+    assert events[-1] == {"type": "done", "status": "completed", "text": "完成"}
+
+def test_stream_endpoint_checks_access(client, seed_data):
+    q = _question(seed_data)
+    from app.models import User, ROLE_STUDENT
+    other = User(email="other@example.com", role=ROLE_STUDENT, school_id=seed_data["school_a"].id)
+    other.set_password("password")
+    db.session.add(other)
+    db.session.commit()
+    client.post("/auth/login", data={"email": "other@example.com", "password": "password"})
+    assert client.get(f"/api/questions/{q.id}/stream").status_code == 403
+
+def test_open_stream_releases_thread_for_normal_requests(app, seed_data):
+    """SSE の接続は SSE_MAX_SECONDS で打ち切られ、同じスレッドで次のリクエストを処理できる"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    q = _question(seed_data)
+    question_id = q.id
+    app.config["SSE_MAX_SECONDS"] = 1
+
+    def login():
+        c = app.test_client()
+        c.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+        return c
+
+    stream_client, page_client = login(), login()
+    # gunicorn のスレッド1本の代わり: ストリームの後ろにふつうのリクエストが並ぶ
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        start = time.monotonic()
+        stream = pool.submit(lambda: stream_client.get(f"/api/questions/{question_id}/stream").data)
+        page = pool.submit(lambda: page_client.get(f"/api/questions/{question_id}/status"))
+        resp = page.result(timeout=10)
+        elapsed = time.monotonic() - start
+
+    assert resp.status_code == 200
+    assert resp.get_json()["status"] == "processing"
+    assert _events(stream.result())[-1]["type"] == "timeout"
+    assert elapsed < 5
@@ -0,0 +1,45 @@
+from app import db, metrics
+from app.models import Question, TaskRun
+from app.tasks import analyze_image_task
+from app.timing import STAGE_BUCKETS
+
+def test_task_records_stage_timings(app, stub_openai, stub_s3, make_question):
+    q = make_question()
+
+    result = analyze_image_task.apply(args=[q.id], kwargs={"generation": 1}).get()
+    assert result["status"] == "completed"
+
+    run = TaskRun.query.filter_by(question_id=q.id).one()
+    assert run.status == "completed"
+    assert run.attempt == 0
+    for column in ("db_fetch_ms", "presign_ms", "model_total_ms", "persist_ms", "total_ms"):
+        assert getattr(run, column) is not None, column
+    assert run.total_ms >= run.model_total_ms
+
+    hist = metrics.histogram("stage:model_total", minutes=5, buckets=STAGE_BUCKETS)
+    assert hist["count"] == 1
+
+def test_hq_pipeline_page(client, stub_openai, stub_s3, make_question):
+    q = make_question()
+    analyze_image_task.apply(args=[q.id], kwargs={"generation": 1}).get()
+
+    client.post("/auth/login", data={"email": "hq@example.com", "password": "password"})
+    resp = client.get("/admin/pipeline")
+    assert resp.status_code == 200
+    assert b"model_total" in resp.data
+
+def test_pipeline_page_clamps_minutes(client, seed_data, monkeypatch):
+    from app.metrics import HIST_TTL
+    calls = []
+    real = metrics.histogram
+
+    def histogram(name, minutes, buckets):
+        calls.append(minutes)
+        return real(name, minutes=1, buckets=buckets)
+
+    monkeypatch.setattr(metrics, "histogram", histogram)
+    client.post("/auth/login", data={"email": "hq@example.com", "password": "password"})
+
+    assert client.get("/admin/pipeline?minutes=10000000").status_code == 200
+    assert client.get("/admin/pipeline?minutes=-5").status_code == 200
+    assert set(calls) == {HIST_TTL // 60, 1}
@@ -0,0 +1,53 @@
+from app import db
+from app.models import Question
+from app.tasks import analyze_image_task
+
+def test_analyze_image_task_reuses_app_and_clients(app, stub_openai, stub_s3, monkeypatch, make_question):
+    import threading
+    from app import worker
+    # ワーカーのアプリはプロセスで1回だけ作り、タスクごとに create_app() しないこと
+    created = []
+    monkeypatch.setattr(worker, "_worker_app", None)
+    monkeypatch.setattr(worker, "create_app", lambda: created.append(app) or app)
+
+    ids = [make_question().id for _ in range(2)]
+    results = []
+
+    def run_tasks():
+        # Celery ワーカーと同じく、アプリコンテキストの無いスレッドで実行する
+        for question_id in ids:
+            results.append(analyze_image_task.apply(args=[question_id]).get())
+    thread = threading.Thread(target=run_tasks)
+    thread.start()
+    thread.join()
+
+    assert [r["status"] for r in results] == ["completed", "completed"]
+    assert created == [app]
+    db.session.expire_all()
+    assert db.session.get(Question, ids[0]).explanation == "スタブ解説"
+    image_url = stub_openai.calls[0]["messages"][0]["content"][1]["image_url"]["url"]
+    assert image_url.startswith("https://stub-s3.local/abc.jpg")
+
+def test_worker_init_is_idempotent_per_process(monkeypatch):
+    from types import SimpleNamespace
+    from flask import Flask
+    from app import worker
+    calls = []
+    app = Flask(__name__)
+    # 本物のアプリ生成・DB エンジン・プロセス共有オブジェクトには触れない
+    monkeypatch.setattr(worker, "_initialized_pid", None)
+    monkeypatch.setattr(worker, "_worker_app", None)
+    monkeypatch.setattr(worker, "get_worker_app", lambda: app)
+    monkeypatch.setattr(worker, "db", SimpleNamespace(engine=SimpleNamespace(dispose=lambda close: calls.append("dispose"))))
+    monkeypatch.setattr(worker, "reset_clients", lambda: calls.append("reset"))
+    monkeypatch.setattr(worker, "reset_executor", lambda: None)
+    monkeypatch.setattr(worker.ratelimit, "reset", lambda: None)
+    monkeypatch.setattr(worker, "get_openai_client", lambda: None)
+    monkeypatch.setattr(worker, "get_s3_client", lambda: None)
+    monkeypatch.setattr(worker.phash, "rebuild_index", lambda: calls.append("phash"))
+    app.config.update(PHASH_ENABLED=True)
+
+    worker.init_worker_process()
+    worker.init_worker_process()
+
+    assert calls == ["reset", "dispose", "phash"]
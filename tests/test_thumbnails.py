@@ -0,0 +1,92 @@
+import io
+from PIL import Image
+from app import db
+from app.imaging import make_thumbnail
+from app.models import Question
+from app.pipeline import prepare_explanation
+from app.thumbnails import CACHE_CONTROL, backfill
+
+def _photo(size=(1600, 1200)):
+    out = io.BytesIO()
+    Image.new("RGB", size, (10, 200, 90)).save(out, format="JPEG")
+    return out.getvalue()
+
+def _question(seed_data, **kwargs):
+    q = Question(content="[画像による質問]", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                 grade="middle", **kwargs)
+    db.session.add(q)
+    db.session.commit()
+    return q
+
+def test_make_thumbnail_is_small_webp():
+    data = make_thumbnail(_photo(), max_edge=320, quality=70)
+    img = Image.open(io.BytesIO(data))
+    assert img.format == "WEBP"
+    assert img.size == (320, 240)
+    try:
+        make_thumbnail(b"not an image")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+
+def test_worker_stores_thumbnail_with_cache_control(app, seed_data, stub_s3):
+    app.config.update(AWS_S3_BUCKET_NAME="bucket", AWS_REGION="ap-northeast-1", PHASH_ENABLED=False)
+    stub_s3.objects["abc.jpg"] = _photo()
+    q = _question(seed_data, image_path="abc.jpg", explanation_status="processing")
+
+    job, _ = prepare_explanation(q.id)
+    assert job is not None
+
+    q = db.session.get(Question, q.id)
+    assert q.thumbnail_path and q.thumbnail_path != "abc.jpg"
+    assert Image.open(io.BytesIO(stub_s3.objects[q.thumbnail_path])).format == "WEBP"
+    assert stub_s3.extra_args[q.thumbnail_path] == {"ContentType": "image/webp", "CacheControl": CACHE_CONTROL}
+
+def test_list_shows_cached_thumbnail_urls_and_lazy_full_image(app, client, seed_data, stub_s3):
+    app.config.update(AWS_S3_BUCKET_NAME="bucket", AWS_REGION="ap-northeast-1")
+    q = _question(seed_data, image_path="abc.jpg", thumbnail_path="thumb.webp",
+                  explanation="解説", explanation_status="completed")
+    client.post("/auth/login", data={"email": "manager@example.com", "password": "password"})
+
+    first = client.get("/questions").get_data(as_text=True)
+    second = client.get("/questions").get_data(as_text=True)
+    assert 'src="https://stub-s3.local/thumb.webp?expires=604800"' in first
+    assert 'loading="lazy"' in first
+    # 同じ URL を返すのでブラウザのキャッシュが効く
+    assert stub_s3.presign_calls == 1 and 'src="https://stub-s3.local/thumb.webp?expires=604800"' in second
+    # 原寸画像はモーダルを開くまで読み込まない
+    assert f'data-src="/questions/{q.id}/image"' in first
+
+    resp = client.get(f"/questions/{q.id}/image")
+    assert resp.status_code == 302
+    assert resp.headers["Location"] == "https://stub-s3.local/abc.jpg?expires=300"
+    assert resp.cache_control.max_age == 150
+
+def test_image_redirect_is_not_cached_past_url_expiry(app, client, seed_data, stub_s3, monkeypatch):
+    from app import utils_s3
+    app.config.update(AWS_S3_BUCKET_NAME="bucket", AWS_REGION="ap-northeast-1")
+    q = _question(seed_data, image_path="abc.jpg", explanation_status="completed")
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+    now = [1000.0]
+    monkeypatch.setattr(utils_s3.time, "monotonic", lambda: now[0])
+
+    client.get(f"/questions/{q.id}/image")
+    # キャッシュの URL は残り 80 秒 (作り直しの閾値 60 秒より長いので同じ URL を返す)
+    now[0] += 220
+    resp = client.get(f"/questions/{q.id}/image")
+
+    assert stub_s3.presign_calls == 1
+    assert resp.cache_control.max_age == 80 - 30
+
+def test_backfill_skips_unreadable_images(app, seed_data, stub_s3):
+    app.config.update(AWS_S3_BUCKET_NAME="bucket", AWS_REGION="ap-northeast-1")
+    stub_s3.objects["broken.png"] = b"not an image"
+    stub_s3.objects["ok.jpg"] = _photo()
+    broken = _question(seed_data, image_path="broken.png", explanation_status="completed")
+    ok = _question(seed_data, image_path="ok.jpg", explanation_status="completed")
+
+    summary = backfill(limit=10, echo=lambda _: None)
+    assert summary == {"created": 1, "failed": 1}
+    assert db.session.get(Question, ok.id).thumbnail_path is not None
+    assert db.session.get(Question, broken.id).thumbnail_path is None
@@ -0,0 +1,124 @@
+import io
+from types import SimpleNamespace
+from PIL import Image
+from app import db
+from app.imaging import normalize_image
+from app.models import Question
+from app.pipeline import prepare_explanation
+from app.services import ExplanationCacheService
+
+def _login_student(client):
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+
+def _photo(size=(3000, 2000), maker=None):
+    out = io.BytesIO()
+    kwargs = {}
+    if maker:
+        exif = Image.Exif()
+        exif[0x010F] = maker
+        kwargs["exif"] = exif.tobytes()
+    Image.new("RGB", size, (30, 120, 200)).save(out, format="PNG", **kwargs)
+    return out.getvalue()
+
+def _configure(app):
+    app.config.update(AWS_S3_BUCKET_NAME="bucket", AWS_REGION="ap-northeast-1", UPLOAD_MAX_BYTES=1024 * 1024)
+
+def test_upload_policy_limits_type_and_size(app, client, seed_data, stub_s3):
+    _configure(app)
+    _login_student(client)
+    resp = client.post("/api/uploads", json={"content_type": "image/png"})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    student_id = seed_data["student"].id
+    assert data["key"].startswith(f"uploads/{student_id}/") and data["key"].endswith(".png")
+    assert data["fields"]["Content-Type"] == "image/png"
+    assert ["content-length-range", 1, 1024 * 1024] in stub_s3.post_conditions
+
+    assert client.post("/api/uploads", json={"content_type": "application/pdf"}).status_code == 400
+
+def test_confirm_creates_question_and_dispatches(app, client, seed_data, stub_s3, monkeypatch):
+    _configure(app)
+    dispatched = []
+    monkeypatch.setattr("app.tasks.analyze_image_task.apply_async",
+                        lambda *a, **k: dispatched.append(k) or SimpleNamespace(id="task-1"))
+    _login_student(client)
+    key = client.post("/api/uploads", json={"content_type": "image/png"}).get_json()["key"]
+
+    # S3 にまだ無ければ質問は作らない
+    assert client.post("/api/uploads/confirm", json={"key": key, "grade": "high"}).status_code == 400
+    stub_s3.objects[key] = _photo((10, 10))
+
+    resp = client.post("/api/uploads/confirm", json={"key": key, "grade": "high"})
+    assert resp.status_code == 201
+    q = db.session.get(Question, resp.get_json()["question_id"])
+    assert q.image_path == key
+    assert (q.grade, q.explanation_status, q.content_hash) == ("high", "processing", None)
+    assert len(dispatched) == 1 and dispatched[0]["queue"] == "explain.interactive"
+
+    # 再送しても質問は増えない
+    again = client.post("/api/uploads/confirm", json={"key": key, "grade": "high"})
+    assert again.get_json()["question_id"] == q.id
+    assert Question.query.count() == 1 and len(dispatched) == 1
+
+    # ワーカーが取り込んだ後 (image_path が変わり、元の画像は削除済み) の再送も同じ質問を返す
+    q.image_path = "ab/cd/abcd.jpg"
+    db.session.commit()
+    del stub_s3.objects[key]
+    again = client.post("/api/uploads/confirm", json={"key": key, "grade": "high"})
+    assert again.status_code == 201 and again.get_json()["question_id"] == q.id
+    assert Question.query.count() == 1 and len(dispatched) == 1
+
+def test_confirm_rejects_other_users_key(app, client, seed_data, stub_s3):
+    _configure(app)
+    other_key = f"uploads/{seed_data['manager'].id}/abc.png"
+    stub_s3.objects[other_key] = b"x"
+    _login_student(client)
+    assert client.post("/api/uploads/confirm", json={"key": other_key, "grade": "middle"}).status_code == 403
+    assert client.post("/api/uploads/confirm", json={"key": f"uploads/{seed_data['student'].id}/../x.png"}).status_code == 403
+    assert Question.query.count() == 0
+
+def _uploaded_question(seed_data, stub_s3, image, grade="middle"):
+    key = f"uploads/{seed_data['student'].id}/raw.png"
+    stub_s3.objects[key] = image
+    q = Question(content="[画像による質問]", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                 image_path=key, grade=grade, explanation_status="processing", explanation_generation=1)
+    db.session.add(q)
+    db.session.commit()
+    return q, key
+
+def test_worker_ingests_direct_upload(app, seed_data, stub_s3):
+    _configure(app)
+    app.config.update(IMAGE_MAX_EDGE=1024)
+    image = _photo()
+    q, raw_key = _uploaded_question(seed_data, stub_s3, image)
+
+    job, result = prepare_explanation(q.id, generation=1)
+    assert result is None and job is not None
+
+    q = db.session.get(Question, q.id)
+    new_key = q.image_path
+    # ハッシュは正規化後 (保存した画像) のバイト列から取る
+    assert q.content_hash == ExplanationCacheService.content_hash(stub_s3.objects[new_key])
+    assert new_key != raw_key and raw_key not in stub_s3.objects
+    assert Image.open(io.BytesIO(stub_s3.objects[new_key])).size == (1024, 683)
+
+def test_worker_reuses_cached_explanation_for_upload(app, seed_data, stub_s3, stub_openai):
+    _configure(app)
+    # メタデータだけが違う同じ写真
+    image, other = _photo((20, 20), maker="PhoneA"), _photo((20, 20), maker="PhoneB")
+    assert image != other
+    normalized = normalize_image(other, app.config["IMAGE_MAX_EDGE"], app.config["IMAGE_JPEG_QUALITY"])
+    source = Question(content="x", user_id=seed_data["student"].id, school_id=seed_data["school_a"].id,
+                      grade="middle", content_hash=ExplanationCacheService.content_hash(normalized.data),
+                      explanation="キャッシュ済み解説", explanation_status="completed")
+    db.session.add(source)
+    db.session.commit()
+    ExplanationCacheService.store(source)
+    db.session.commit()
+    q, _ = _uploaded_question(seed_data, stub_s3, image)
+
+    job, result = prepare_explanation(q.id, generation=1)
+    assert job is None and result["cached"]
+    q = db.session.get(Question, q.id)
+    assert (q.explanation_status, q.explanation) == ("completed", "キャッシュ済み解説")
+    assert stub_openai.calls == []
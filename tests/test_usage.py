@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+from app import db
+from app.models import Question, UsageEvent, UsageRollup
+from app.tasks import analyze_image_task
+from app.usage import cost_micros, record_usage, KIND_BATCH, KIND_EXPLANATION
+
+USAGE = SimpleNamespace(prompt_tokens=1200, completion_tokens=300,
+                        prompt_tokens_details=SimpleNamespace(cached_tokens=1000))
+
+def test_cost_uses_cached_and_batch_prices(app):
+    app.config.update(OPENAI_PRICE_INPUT_PER_MTOK=2.0, OPENAI_PRICE_CACHED_INPUT_PER_MTOK=0.5,
+                      OPENAI_PRICE_OUTPUT_PER_MTOK=10.0, OPENAI_BATCH_DISCOUNT=0.5)
+    # 200 * 2 + 1000 * 0.5 + 300 * 10 = 3900 マイクロドル
+    assert cost_micros(1200, 1000, 300) == 3900
+    assert cost_micros(1200, 1000, 300, KIND_BATCH) == 1950
+
+def test_task_records_usage_and_rollups(app, seed_data, stub_openai, stub_s3, make_question):
+    stub_openai.usage = USAGE
+    for _ in range(2):
+        q = make_question()
+        assert analyze_image_task.apply(args=[q.id], kwargs={"generation": 1}).get()["status"] == "completed"
+
+    events = UsageEvent.query.all()
+    assert len(events) == 2
+    assert (events[0].input_tokens, events[0].cached_tokens, events[0].output_tokens) == (1200, 1000, 300)
+    assert events[0].school_id == seed_data["school_a"].id
+
+    # 同じ時間帯・日の集計行に加算される
+    for period in ("hour", "day"):
+        rollup = UsageRollup.query.filter_by(period=period, kind=KIND_EXPLANATION).one()
+        assert rollup.requests == 2
+        assert rollup.output_tokens == 600
+        assert rollup.cost_micros == events[0].cost_micros * 2
+
+def test_soft_budget_routes_to_backfill(client, seed_data, monkeypatch, make_question):
+    school = seed_data["school_a"]
+    school.monthly_budget_soft_usd = 0.001
+    record_usage(KIND_EXPLANATION, USAGE, school_id=school.id)
+    db.session.commit()
+    q = make_question(status="failed", generation=0)
+    qid = q.id
+    sent = []
+    monkeypatch.setattr("app.tasks.analyze_image_task.apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="stub-task"))
+
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+    client.post(f"/questions/{qid}/explain")
+
+    assert len(sent) == 1
+    assert sent[0]["queue"] == "explain.backfill"
+
+def test_hard_budget_rejects_new_work(client, seed_data, monkeypatch, make_question):
+    school = seed_data["school_a"]
+    school.monthly_budget_hard_usd = 0.001
+    record_usage(KIND_EXPLANATION, USAGE, school_id=school.id)
+    db.session.commit()
+    q = make_question(status="completed", explanation="解説")
+    qid = q.id
+    sent = []
+    monkeypatch.setattr("app.tasks.requestion_task.apply_async",
+                        lambda *a, **k: sent.append(k) or SimpleNamespace(id="stub-task"))
+
+    client.post("/auth/login", data={"email": "student@example.com", "password": "password"})
+    resp = client.post("/api/re-question", json={"question_id": qid, "question_text": "もう少し詳しく"})
+
+    assert resp.status_code == 429
+    assert sent == []
+
+def test_hq_usage_page(client, seed_data):
+    record_usage(KIND_EXPLANATION, USAGE, school_id=seed_data["school_a"].id)
+    db.session.commit()
+    client.post("/auth/login", data={"email": "hq@example.com", "password": "password"})
+
+    resp = client.get("/admin/usage")
+    assert resp.status_code == 200
+    assert b"Test School A" in resp.data
+
+    resp = client.post("/admin/usage", data={"school_id": seed_data["school_b"].id, "soft": "50", "hard": "80"})
+    assert resp.status_code == 302
+    assert seed_data["school_b"].monthly_budget_hard_usd == 80.0